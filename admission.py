@@ -0,0 +1,170 @@
+"""
+远程桌面控制系统 - 准入控制模块
+在握手之前按IP白名单、单IP连接频率和未认证连接数决定是否接受连接，握手成功后再占用会话名额
+"""
+import ipaddress
+import threading
+import time
+
+class CIDRMatcher:
+    """预编译的CIDR白名单
+
+    每个前缀长度对应一个网络号集合，匹配时对出现过的前缀长度各做一次集合查找，
+    与白名单条目数量无关。白名单为空时允许所有地址。
+    """
+
+    def __init__(self, cidrs=()):
+        self.prefixes = {4: {}, 6: {}}  # 版本 -> {前缀长度: 网络号集合}
+        self.empty = True
+        for cidr in cidrs:
+            try:
+                network = ipaddress.ip_network(str(cidr).strip(), strict=False)
+            except ValueError:
+                print(f"忽略无效的白名单条目: {cidr}")
+                continue
+            shift = network.max_prefixlen - network.prefixlen
+            table = self.prefixes[network.version].setdefault(shift, set())
+            table.add(int(network.network_address) >> shift)
+            self.empty = False
+
+    def match(self, ip):
+        """判断IP是否在白名单内"""
+        if self.empty:
+            return True
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        value = int(address)
+        for shift, networks in self.prefixes[address.version].items():
+            if value >> shift in networks:
+                return True
+        return False
+
+class TokenBucket:
+    """令牌桶限速"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def consume(self, rate, burst, now):
+        """补充令牌并尝试取出一个"""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+class AdmissionController:
+    """连接准入控制：白名单、单IP连接频率限制和并发会话上限
+
+    连接先以“未认证”身份占用名额（每个IP最多 max_pending_per_ip 个，总共最多 max_pending 个），
+    握手成功后调用 authenticate() 转为会话，只有已认证的会话计入 max_sessions，
+    空闲的未认证连接无法占满会话名额。
+    """
+
+    def __init__(self, allowed_ip_list=(), rate=2.0, burst=5, max_sessions=10, max_pending=32,
+                 max_pending_per_ip=2):
+        self.matcher = CIDRMatcher(allowed_ip_list)
+        self.rate = rate
+        self.burst = burst
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending
+        self.max_pending_per_ip = max_pending_per_ip
+        self.active = 0
+        self.pending = {}  # IP -> 尚未完成握手的连接数
+        self.rejected = {"allowlist": 0, "rate": 0, "pending": 0, "sessions": 0}
+        self._buckets = {}
+        self._last_prune = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, allowed_ip_list=None, rate=None, burst=None, max_sessions=None, max_pending=None,
+                  max_pending_per_ip=None):
+        """更新准入参数（配置热加载时调用）"""
+        matcher = CIDRMatcher(allowed_ip_list) if allowed_ip_list is not None else None
+        with self._lock:
+            if matcher is not None:
+                self.matcher = matcher
+            if rate is not None:
+                self.rate = float(rate)
+            if burst is not None:
+                self.burst = float(burst)
+            if max_sessions is not None:
+                self.max_sessions = int(max_sessions)
+            if max_pending is not None:
+                self.max_pending = int(max_pending)
+            if max_pending_per_ip is not None:
+                self.max_pending_per_ip = int(max_pending_per_ip)
+
+    def admit(self, ip):
+        """尝试为新连接占用一个未认证名额，返回 (是否接受, 拒绝原因)"""
+        with self._lock:
+            if not self.matcher.match(ip):
+                return self._reject("allowlist")
+
+            now = time.monotonic()
+            bucket = self._buckets.get(ip)
+            if bucket is None:
+                bucket = self._buckets[ip] = TokenBucket(self.burst)
+            if not bucket.consume(self.rate, self.burst, now):
+                return self._reject("rate")
+
+            pending = self.pending.get(ip, 0)
+            if pending >= self.max_pending_per_ip or sum(self.pending.values()) >= self.max_pending:
+                return self._reject("pending")
+            if self.active >= self.max_sessions:
+                return self._reject("sessions")
+
+            self.pending[ip] = pending + 1
+            self._prune(now)
+            return True, None
+
+    def authenticate(self, ip):
+        """握手成功，把未认证名额转为会话名额，返回 (是否接受, 拒绝原因)"""
+        with self._lock:
+            if self.active >= self.max_sessions:
+                return self._reject("sessions")
+            self._release_pending(ip)
+            self.active += 1
+            return True, None
+
+    def release(self, ip, authenticated):
+        """连接结束，归还名额，authenticated 表示是否已通过 authenticate()"""
+        with self._lock:
+            if authenticated:
+                self.active = max(0, self.active - 1)
+            else:
+                self._release_pending(ip)
+
+    def pending_count(self):
+        """尚未完成握手的连接总数"""
+        with self._lock:
+            return sum(self.pending.values())
+
+    def _release_pending(self, ip):
+        """归还未认证名额（调用方需持有锁）"""
+        pending = self.pending.get(ip, 0) - 1
+        if pending > 0:
+            self.pending[ip] = pending
+        else:
+            self.pending.pop(ip, None)
+
+    def _reject(self, reason):
+        """记录拒绝原因（调用方需持有锁）"""
+        self.rejected[reason] += 1
+        return False, reason
+
+    def _prune(self, now):
+        """定期清理已回满的令牌桶，避免大量源地址占用内存（调用方需持有锁）"""
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        full = self.burst / max(self.rate, 1e-6)
+        for ip in [ip for ip, b in self._buckets.items() if now - b.updated > full]:
+            del self._buckets[ip]
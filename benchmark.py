@@ -0,0 +1,862 @@
+"""
+远程桌面控制系统 - 性能基准
+用法: python benchmark.py <项目> [参数]
+截图相关项目在无显示环境下可配合Xvfb运行，例如:
+    xvfb-run -s "-screen 0 1920x1080x24" python benchmark.py capture --backend mss
+"""
+import argparse
+import pickle
+import socket
+import zlib
+import threading
+import time
+import tracemalloc
+
+from capture import create_capture_backend
+from utils import SecureSocket
+from handshake import client_handshake
+from colormodes import COLOR_MODES, ColorEncoder
+from netsim import PROFILES, ImpairmentProxy, DatagramImpairmentProxy, LinkProfile, add_link_arguments, profile_from_args
+
+def measure_frames(func, frames):
+    """重复执行func，返回 (每秒帧数, 每帧平均临时分配字节数)"""
+    func()  # 预热，让复用缓冲区完成首次分配
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        func()
+    elapsed = time.perf_counter() - start
+
+    # 分配统计单独跑一轮，避免tracemalloc开销影响帧率
+    tracemalloc.start()
+    total = 0
+    for _ in range(frames):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - current
+    tracemalloc.stop()
+
+    return frames / elapsed, total / frames
+
+def bench_capture(args):
+    """截图后端基准：帧率和每帧内存分配"""
+    backend = create_capture_backend(args.backend)
+    width, height = backend.screen_size
+    print(f"后端: {backend.name}  屏幕: {width}x{height}")
+
+    regions = {"全屏": None, "1/4区域": (0, 0, width // 2, height // 2)}
+    for label, bbox in regions.items():
+        fps, alloc = measure_frames(lambda: backend.grab(bbox), args.frames)
+        print(f"  {label:<8} {fps:8.1f} 帧/秒  {alloc / 1024:10.1f} KB分配/帧")
+    backend.close()
+
+def start_server(limit_connections=False, input_controller=None, capture_process=False, capture_backend="synthetic"):
+    """在本地回环地址上启动使用合成画面的服务端"""
+    from server import RemoteDesktopServer
+
+    server = RemoteDesktopServer("127.0.0.1", 0, capture_backend=capture_backend, input_controller=input_controller,
+                                 capture_process=capture_process)
+    if not limit_connections:
+        # 基准会频繁重连，放开准入限速
+        server.admission.configure(rate=1e6, burst=1e6, max_sessions=10 ** 6, max_pending=10 ** 6,
+                                   max_pending_per_ip=10 ** 6)
+    server.listen()
+    return server
+
+def connect_once(port, session_token=None, last_seq=None, source_ip=None):
+    """连接本地服务端直到收到第一帧，返回 (首帧耗时秒, 接收字节数, 会话令牌, 帧序号)"""
+    client = SecureSocket()
+    if source_ip is not None:
+        client.socket.bind((source_ip, 0))
+    start = time.perf_counter()
+    client.connect("127.0.0.1", port)
+    client_handshake(client)
+    client.send_data({"type": "hello", "session_token": session_token, "last_seq": last_seq})
+    token = None
+    while True:
+        data = client.receive_data(timeout=5.0)
+        if data is None:
+            raise RuntimeError("连接被关闭")
+        if data.get("type") == "server_info":
+            token = data.get("session_token")
+        elif data.get("type") in ("screen", "tiles"):
+            break
+    elapsed = time.perf_counter() - start
+    client.send_data({"type": "frame_ack", "seq": data["seq"]})
+    time.sleep(0.05)  # 等待服务端处理确认
+    client.close()
+    return elapsed, client.bytes_received, token, data["seq"]
+
+def bench_resume(args):
+    """会话恢复基准：冷连接与恢复连接的首帧耗时和字节数"""
+    server = start_server()
+    try:
+        results = {"冷连接": [], "恢复连接": []}
+        for _ in range(args.rounds):
+            elapsed, nbytes, token, seq = connect_once(server.port)
+            results["冷连接"].append((elapsed, nbytes))
+            time.sleep(args.gap)  # 断线期间画面发生少量变化
+            elapsed, nbytes, _, _ = connect_once(server.port, token, seq)
+            results["恢复连接"].append((elapsed, nbytes))
+    finally:
+        server.stop()
+
+    for label, samples in results.items():
+        avg_ms = sum(s[0] for s in samples) / len(samples) * 1000
+        avg_kb = sum(s[1] for s in samples) / len(samples) / 1024
+        print(f"  {label:<6} 首帧 {avg_ms:8.1f} ms  {avg_kb:10.1f} KB")
+
+def watch(port, duration, counts, index):
+    """作为观看者连接转发端，统计duration秒内收到的画面数"""
+    viewer = SecureSocket()
+    viewer.connect("127.0.0.1", port)
+    client_handshake(viewer)
+    viewer.send_data({"type": "hello", "view_only": True})
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            data = viewer.receive_data()
+        except socket.timeout:
+            continue
+        if data is None:
+            break
+        if data.get("type") in ("screen", "tiles"):
+            counts[index] += 1
+    viewer.close()
+
+def bench_relay(args):
+    """转发端基准：不同观看人数下被控端发送量与观看者帧率"""
+    from relay import RemoteDesktopRelay
+
+    server = start_server()
+    relay = RemoteDesktopRelay("127.0.0.1", server.port, host="127.0.0.1", port=0)
+    # 所有观看者来自同一地址，放开准入限速
+    relay.admission.configure(rate=1e6, burst=1e6, max_pending=10 ** 6, max_pending_per_ip=10 ** 6)
+    relay.listen()
+    time.sleep(0.5)
+    try:
+        for audience in args.audience:
+            sent_before = sum(c.bytes_sent for c in server.clients)
+            counts = [0] * audience
+            threads = [threading.Thread(target=watch, args=(relay.port, args.duration, counts, i))
+                       for i in range(audience)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            host_kb = (sum(c.bytes_sent for c in server.clients) - sent_before) / 1024 / args.duration
+            print(f"  观看者 {audience:3d}  被控端连接数 {len(server.clients)}  "
+                  f"被控端发送 {host_kb:8.1f} KB/秒  观看者平均 {sum(counts) / audience / args.duration:6.1f} 帧/秒")
+    finally:
+        relay.stop()
+        server.stop()
+
+def flood(port, source_ip, stop, counter):
+    """从指定源地址反复建立并关闭连接"""
+    while not stop.is_set():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind((source_ip, 0))
+            sock.connect(("127.0.0.1", port))
+            counter[0] += 1
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+def idle_flood(port, source_ip, stop, counter, interval):
+    """按不超过频率限制的间隔建立连接后什么也不发送，一直占着直到结束"""
+    sockets = []
+    while not stop.is_set():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind((source_ip, 0))
+            sock.connect(("127.0.0.1", port))
+            sockets.append(sock)
+            counter[0] += 1
+        except OSError:
+            sock.close()
+        stop.wait(interval)
+    for sock in sockets:
+        sock.close()
+
+def probe_connects(port, source_ip, stop, interval, results):
+    """洪泛期间定期以新客户端身份完整连接到首帧，记录成功耗时和失败次数"""
+    while not stop.is_set():
+        try:
+            results["latency"].append(connect_once(port, source_ip=source_ip)[0])
+        except Exception:
+            results["failed"] += 1
+        stop.wait(interval)
+
+def bench_flood(args):
+    """准入控制基准：连接洪泛期间已连接会话的帧率和新客户端能否连上"""
+    server = start_server(limit_connections=True)
+    scenarios = (("无洪泛", None, 0), (f"{args.threads}线程洪泛", flood, args.threads),
+                 ("空闲连接占位", idle_flood, 1))
+    sources = {flood: "127.0.0.2", idle_flood: "127.0.0.4"}
+    try:
+        for label, target, flooders in scenarios:
+            stop = threading.Event()
+            counter = [0]
+            flood_args = (server.port, sources.get(target), stop, counter)
+            if target is idle_flood:
+                flood_args += (args.idle_interval,)
+            threads = [threading.Thread(target=target, args=flood_args) for _ in range(flooders)]
+            results = {"latency": [], "failed": 0}
+            threads.append(threading.Thread(target=probe_connects,
+                                            args=(server.port, "127.0.0.3", stop, args.connect_interval, results)))
+            rejected = dict(server.admission.rejected)
+            for thread in threads:
+                thread.start()
+            counts = [0]
+            watch(server.port, args.duration, counts, 0)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            latency = results["latency"]
+            avg_ms = sum(latency) / len(latency) * 1000 if latency else float("nan")
+            print(f"  {label:<10} 合法会话 {counts[0] / args.duration:6.1f} 帧/秒  "
+                  f"新连接 成功 {len(latency):3d} 失败 {results['failed']:3d} 平均首帧 {avg_ms:7.1f} ms  "
+                  f"洪泛连接 {counter[0] / args.duration:8.0f} 次/秒  "
+                  f"拒绝 {({k: v - rejected[k] for k, v in server.admission.rejected.items()})}")
+    finally:
+        server.stop()
+
+def handshake_once(port, password, ticket):
+    """完成一次握手后断开，返回 (耗时秒, 新票据)"""
+    sock = SecureSocket()
+    start = time.perf_counter()
+    sock.connect("127.0.0.1", port)
+    ticket = client_handshake(sock, password, ticket)
+    elapsed = time.perf_counter() - start
+    sock.close()
+    return elapsed, ticket
+
+def handshake_worker(port, password, ticket, count, results, index):
+    """连续握手count次，使用票据时每次换用新签发的票据"""
+    for _ in range(count):
+        _, new_ticket = handshake_once(port, password, ticket)
+        if ticket is not None:
+            ticket = new_ticket
+    results[index] = count
+
+def bench_handshake(args):
+    """握手基准：完整握手与恢复握手的延迟及并发时的CPU开销"""
+    server = start_server()
+    server.handshake.configure(args.password, {"n": args.kdf_n})
+    try:
+        samples = [handshake_once(server.port, args.password, None) for _ in range(args.rounds)]
+        full_ms = sum(s[0] for s in samples) / len(samples) * 1000
+        ticket = samples[-1][1]
+        resumed = []
+        for _ in range(args.rounds):
+            elapsed, ticket = handshake_once(server.port, args.password, ticket)
+            resumed.append(elapsed)
+        print(f"  顺序握手延迟  完整 {full_ms:8.1f} ms  恢复 {sum(resumed) / len(resumed) * 1000:8.1f} ms")
+
+        for label, resume in (("完整", False), ("恢复", True)):
+            tickets = [handshake_once(server.port, args.password, None)[1] if resume else None
+                       for _ in range(args.concurrency)]
+            results = [0] * args.concurrency
+            threads = [threading.Thread(target=handshake_worker,
+                                        args=(server.port, args.password, tickets[i], args.per_thread, results, i))
+                       for i in range(args.concurrency)]
+            cpu_start, wall_start = time.process_time(), time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+            total = sum(results)
+            print(f"  {args.concurrency}路并发{label}握手  {total / wall:8.1f} 次/秒  "
+                  f"CPU {cpu / total * 1000:6.2f} ms/次（客户端+服务端）")
+    finally:
+        server.stop()
+
+def office_content(width, height, seed=0):
+    """模拟办公画面：白底、窗口标题栏和大量细小深色“文字”笔画"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    rgb = np.full((height, width, 3), 250, dtype=np.uint8)
+    rgb[:32] = (40, 90, 160)  # 标题栏
+    rgb[32:, :220] = (235, 238, 242)  # 侧边栏
+    for line_top in range(60, height - 20, 22):
+        x = 240
+        while x < width - 60:
+            word = int(rng.integers(12, 60))
+            strokes = rng.random((12, word)) < 0.35
+            rgb[line_top:line_top + 12, x:x + word][strokes] = (30, 30, 30)
+            x += word + 8
+    return rgb
+
+def photo_content(width, height, seed=0):
+    """模拟照片画面：平滑的彩色渐变叠加细噪声"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    rgb = np.empty((height, width, 3), dtype=np.float32)
+    rgb[..., 0] = 128 + 100 * np.sin(x / 97.0) * np.cos(y / 131.0)
+    rgb[..., 1] = 128 + 100 * np.sin((x + y) / 173.0)
+    rgb[..., 2] = 128 + 100 * np.cos(x / 61.0 - y / 89.0)
+    rgb += rng.normal(0, 6, rgb.shape)
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+def bench_colormodes(args):
+    """色彩模式基准：各模式在办公和照片画面上的每帧字节数和编码耗时"""
+    from PIL import Image
+
+    contents = {"办公": office_content, "照片": photo_content}
+    for label, generate in contents.items():
+        image = Image.fromarray(generate(args.width, args.height), "RGB")
+        print(f"{label}画面 {args.width}x{args.height}:")
+        for mode in COLOR_MODES:
+            encoder = ColorEncoder(mode)
+            encoder.encode(image, args.quality)  # 预热（调色板首帧计算）
+            start = time.perf_counter()
+            for _ in range(args.frames):
+                fields = encoder.encode(image, args.quality)
+            elapsed = (time.perf_counter() - start) / args.frames
+            # 线路字节数按SecureSocket的序列化和压缩估算（不含加密开销）
+            wire = len(zlib.compress(pickle.dumps(fields)))
+            # 比JPEG大时编码器改发JPEG，这里同时列出该模式本身的体积
+            own = len(zlib.compress(pickle.dumps(encoder._encode_reduced(image)))) if mode != "jpeg" else wire
+            note = f"（比JPEG大，改发JPEG；本模式 {own / 1024:.1f} KB）" if encoder.jpeg_fallback else ""
+            print(f"  {mode:<8} {wire / 1024:10.1f} KB/帧  编码 {elapsed * 1000:8.1f} ms/帧{note}")
+
+def bench_input(args):
+    """输入注入基准：以固定频率发送鼠标和键盘事件，统计发送到注入完成的延迟百分位数"""
+    from inputengine import RecordingController
+
+    for delay_ms in args.inject_delay:
+        controller = RecordingController(delay=delay_ms / 1000)
+        server = start_server(input_controller=controller)
+        client = SecureSocket()
+        try:
+            client.connect("127.0.0.1", server.port)
+            client_handshake(client)
+            client.send_data({"type": "hello"})
+            interval = 1.0 / args.rate
+            start = time.perf_counter()
+            for i in range(args.events):
+                if i % 4 == 3:
+                    command = {"type": "keyboard_press" if i % 8 == 3 else "keyboard_release", "key": "shift"}
+                else:
+                    command = {"type": "mouse_move", "x": i % 1920, "y": i % 1080}
+                command["sent_at"] = time.time()
+                client.send_data(command)
+                time.sleep(max(0.0, start + (i + 1) * interval - time.perf_counter()))
+            send_elapsed = time.perf_counter() - start
+            time.sleep(0.5 + delay_ms / 1000 * 10)
+
+            stats = server.input_engine.latency_percentiles()
+            e2e = stats["end_to_end"] or {}
+            print(f"  注入耗时 {delay_ms:5.1f} ms  发送 {args.events / send_elapsed:7.1f} 事件/秒  "
+                  f"已注入 {stats['injected']}  合并移动 {stats['coalesced']}  "
+                  f"延迟 p50 {e2e.get(50, 0):6.2f} p95 {e2e.get(95, 0):6.2f} p99 {e2e.get(99, 0):6.2f} ms")
+        finally:
+            client.close()
+            server.stop()
+
+def start_link(port, profile, seed=0):
+    """在服务端前面启动网络损伤代理，返回代理（连接代理的端口即可经过模拟链路）"""
+    proxy = ImpairmentProxy("127.0.0.1", port, up=profile, seed=seed)
+    proxy.listen()
+    return proxy
+
+def link_session(port, duration, color_mode, quality, input_rate):
+    """经模拟链路连接服务端，返回 (首帧耗时秒, 帧数, 接收字节数)，期间按固定频率发送鼠标移动"""
+    client = SecureSocket()
+    start = time.perf_counter()
+    client.connect("127.0.0.1", port)
+    client_handshake(client)
+    client.send_data({"type": "hello", "color_mode": color_mode})
+    client.send_data({"type": "set_quality", "quality": quality, "color_mode": color_mode})
+    first_frame = None
+    frames = 0
+    deadline = time.monotonic() + duration
+    next_input = time.monotonic()
+    while time.monotonic() < deadline:
+        if input_rate and time.monotonic() >= next_input:
+            client.send_data({"type": "mouse_move", "x": frames, "y": frames, "sent_at": time.time()})
+            next_input += 1.0 / input_rate
+        try:
+            data = client.receive_data(timeout=0.02)
+        except socket.timeout:
+            continue
+        if data is None:
+            break
+        if data.get("type") == "screen":
+            frames += 1
+            if first_frame is None:
+                first_frame = time.perf_counter() - start
+            client.send_data({"type": "frame_ack", "seq": data.get("seq")})
+    received = client.bytes_received
+    client.close()
+    return first_frame, frames, received
+
+def bench_link(args):
+    """模拟链路基准：不同链路参数下的首帧耗时、帧率、下行吞吐量和输入延迟"""
+    from inputengine import RecordingController
+
+    profiles = {name: PROFILES[name] for name in args.profiles} if args.profiles else {
+        args.profile: profile_from_args(args)}
+    for name, profile in profiles.items():
+        server = start_server(input_controller=RecordingController())
+        proxy = start_link(server.port, profile, args.seed)
+        try:
+            first_frame, frames, received = link_session(
+                proxy.port, args.duration, args.color_mode, args.quality, args.input_rate)
+            stats = server.input_engine.latency_percentiles()
+            e2e = stats["end_to_end"] or {}
+            first_ms = first_frame * 1000 if first_frame is not None else float("nan")
+            print(f"  {name:<10} 首帧 {first_ms:8.1f} ms  {frames / args.duration:6.1f} 帧/秒  "
+                  f"下行 {received / 1024 / args.duration:8.1f} KB/秒  "
+                  f"输入延迟 p50 {e2e.get(50, 0):7.1f} p95 {e2e.get(95, 0):7.1f} ms")
+            if args.trace_dir:
+                proxy.save_trace(f"{args.trace_dir}/{name}.csv")
+        finally:
+            proxy.stop()
+            server.stop()
+
+def send_inputs(port, duration, rate):
+    """按固定频率发送带时间戳的鼠标移动
+
+    不读取服务端发来的画面：接收缓冲区满后只会阻塞服务端给本连接发画面的线程，
+    不影响接收输入，测得的延迟也不包含客户端解密画面的开销。
+    """
+    client = SecureSocket()
+    client.connect("127.0.0.1", port)
+    client_handshake(client)
+    client.send_data({"type": "hello"})
+    start = time.perf_counter()
+    for i in range(int(duration * rate)):
+        client.send_data({"type": "mouse_move", "x": i % 1920, "y": i % 1080, "sent_at": time.time()})
+        time.sleep(max(0.0, start + (i + 1) / rate - time.perf_counter()))
+    client.close()
+
+def run_viewers(port, duration, viewers, results):
+    """在独立进程中运行观看者，避免客户端的解密解压占用服务端进程的GIL"""
+    counts = [0] * viewers
+    threads = [threading.Thread(target=watch, args=(port, duration, counts, i)) for i in range(viewers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(counts)
+
+def bench_pipeline(args):
+    """独立截图编码进程基准：多个观看者同时接收时的帧率和输入延迟，与单进程模式对比"""
+    import multiprocessing
+    from inputengine import RecordingController
+
+    context = multiprocessing.get_context("spawn")
+    for label, capture_process in (("单进程", False), ("独立进程", True)):
+        server = start_server(input_controller=RecordingController(), capture_process=capture_process)
+        try:
+            time.sleep(1.0)  # 等待子进程启动
+            results = context.Queue()
+            clients = [
+                context.Process(target=run_viewers, args=(server.port, args.duration, args.viewers, results)),
+                context.Process(target=send_inputs, args=(server.port, args.duration, args.input_rate))
+            ]
+            for process in clients:
+                process.start()
+            if capture_process and args.kill_after:
+                # 模拟子进程崩溃，检验监督线程能否自动重启
+                time.sleep(args.kill_after)
+                server.pipeline.process.kill()
+            counts = results.get()
+            for process in clients:
+                process.join()
+
+            stats = server.input_engine.latency_percentiles()
+            e2e = stats["end_to_end"] or {}
+            restarts = f"  重启 {server.pipeline.restarts} 次" if capture_process else ""
+            print(f"  {label:<6} {args.viewers}个观看者平均 {sum(counts) / args.viewers / args.duration:6.1f} 帧/秒  "
+                  f"输入延迟 p50 {e2e.get(50, 0):6.2f} p95 {e2e.get(95, 0):6.2f} p99 {e2e.get(99, 0):6.2f} ms{restarts}")
+        finally:
+            server.stop()
+
+def bursty_office_backend(active, period):
+    """注册一个办公画面的合成截图后端：每个周期内方块只移动active秒，其余时间画面静止"""
+    import numpy as np
+    from capture import CAPTURE_BACKENDS, SyntheticCapture
+
+    class BurstyOfficeCapture(SyntheticCapture):
+        name = "bursty-office"
+
+        def __init__(self):
+            super().__init__()
+            width, height = self.screen_size
+            self._background[..., 2::-1] = office_content(width, height)
+
+        def grab(self, bbox=None):
+            phase = time.monotonic() % period
+            self.static = phase >= active
+            return super().grab(bbox)
+
+    CAPTURE_BACKENDS[BurstyOfficeCapture.name] = BurstyOfficeCapture
+    return BurstyOfficeCapture.name
+
+def bench_progressive(args):
+    """渐进式画质基准：与固定画质相比的平均码率、变化消息大小和最终画质图"""
+    backend = bursty_office_backend(args.active, args.period)
+    modes = [(f"固定画质{q}", q, False) for q in args.fixed] + [("渐进", args.fixed[-1], True)]
+    for label, quality, progressive in modes:
+        server = start_server(capture_backend=backend)
+        client = SecureSocket()
+        try:
+            client.connect("127.0.0.1", server.port)
+            client_handshake(client)
+            client.send_data({"type": "hello", "progressive": progressive})
+            client.send_data({"type": "set_quality", "quality": quality, "progressive": progressive})
+            change_bytes, changes = 0, 0
+            start_bytes = None
+            deadline = time.monotonic() + args.duration
+            while time.monotonic() < deadline:
+                before = client.bytes_received
+                try:
+                    data = client.receive_data(timeout=0.2)
+                except socket.timeout:
+                    continue
+                if data is None:
+                    break
+                if start_bytes is None and data.get("type") == "screen":
+                    start_bytes = before  # 首帧之前的握手和设置不计入
+                    deadline = time.monotonic() + args.duration
+                if data.get("type") in ("screen", "tiles"):
+                    if data.get("seq") is not None:
+                        changes += 1
+                        change_bytes += client.bytes_received - before
+                        client.send_data({"type": "frame_ack", "seq": data["seq"]})
+            total = client.bytes_received - (start_bytes or 0)
+
+            client.send_data({"type": "stats"})
+            stats = None
+            while stats is None:
+                data = client.receive_data(timeout=2.0)
+                if data is None:
+                    break
+                if data.get("type") == "stats":
+                    stats = data
+            quality_map = ((stats or {}).get("session") or {}).get("quality_map")
+            counts = quality_map["counts"] if quality_map else "-"
+            print(f"  {label:<10} 平均 {total / 1024 / args.duration:8.1f} KB/秒  "
+                  f"变化消息 {change_bytes / max(1, changes) / 1024:7.1f} KB/条  画质图 {counts}")
+        finally:
+            client.close()
+            server.stop()
+
+def sample_messages(width, height):
+    """按类型生成一组典型消息，画面类消息使用模拟办公画面的实际编码结果"""
+    from PIL import Image
+    from utils import encode_image
+
+    image = Image.fromarray(office_content(width, height), "RGB")
+    tiles = [[x, 64, 64, 64, encode_image(image.crop((x, 64, x + 64, 128)), 35)] for x in range(256, 768, 64)]
+    messages = {
+        "mouse_move": [{"type": "mouse_move", "x": 100 + i * 3, "y": 200 + i, "sent_at": time.time() + i / 100}
+                       for i in range(200)],
+        "keyboard_press": [{"type": "keyboard_press", "key": key, "sent_at": time.time()} for key in "hello world" * 10],
+        "frame_ack": [{"type": "frame_ack", "seq": i} for i in range(200)],
+        "viewport": [{"type": "viewport", "x": i * 10, "y": 0, "width": 1280, "height": 720, "zoom": 1.0}
+                     for i in range(50)],
+        "server_info": [{"type": "server_info", "version": "1.0.0", "screen_size": {"width": width, "height": height},
+                         "session_token": f"{i:032x}", "resumed": False, "codecs": []} for i in range(5)],
+        "screen": [dict({"type": "screen", "seq": i, "region": [0, 0, width, height], "scale": 1.0},
+                        **ColorEncoder(mode).encode(image, 70)) for i, mode in enumerate(("jpeg", "yuv420"))],
+        "tiles": [{"type": "tiles", "seq": i, "region": [0, 0, width, height], "scale": 1.0,
+                   "tiles": tiles} for i in range(20)],
+    }
+    return messages
+
+def bench_compression(args):
+    """消息压缩基准：逐条独立zlib与连接级流式压缩（及zstd字典）的压缩率和每条压缩加解压耗时"""
+    from compression import StreamCodec, ZSTD_CODEC_NAME
+
+    messages = sample_messages(args.width, args.height)
+    variants = ["独立zlib", "流式"] + (["流式+zstd"] if ZSTD_CODEC_NAME else [])
+    print(f"{'类型':<16}" + "".join(f"{name:>26}" for name in variants))
+    for msg_type, samples in messages.items():
+        serialized = [pickle.dumps(m) for m in samples]
+        raw = sum(len(s) for s in serialized)
+        cells = []
+        for variant in variants:
+            sender, receiver = StreamCodec(), StreamCodec()
+            if variant.endswith("zstd"):
+                sender.enable_zstd([ZSTD_CODEC_NAME])
+            wire = 0
+            start = time.process_time()
+            for s in serialized:
+                if variant == "独立zlib":
+                    # 原来的做法：每条消息独立压缩
+                    payload = zlib.compress(s)
+                    zlib.decompress(payload)
+                else:
+                    payload = sender.compress(msg_type, s)
+                    receiver.decompress(payload)
+                wire += len(payload)
+            elapsed = time.process_time() - start
+            cells.append(f"{raw / wire:7.2f}x {elapsed / len(samples) * 1e6:9.1f} us/条")
+        print(f"{msg_type:<16}" + "".join(f"{cell:>26}" for cell in cells))
+
+def stall_summary(arrivals, duration, threshold):
+    """画面更新间隔统计，返回 (每秒更新数, 最大间隔ms, p99间隔ms, 超过阈值的间隔累计ms)"""
+    gaps = sorted(b - a for a, b in zip(arrivals, arrivals[1:]))
+    if not gaps:
+        return 0.0, float("nan"), float("nan"), duration * 1000
+    p99 = gaps[min(len(gaps) - 1, int(len(gaps) * 0.99))]
+    stalled = sum(gap for gap in gaps if gap >= threshold)
+    return len(arrivals) / duration, gaps[-1] * 1000, p99 * 1000, stalled * 1000
+
+def udp_session(server, port, profile, duration, input_rate, use_datagram, seed):
+    """经模拟链路观看持续变化的画面，返回 (画面更新时刻列表, 统计信息行)
+
+    TCP模式下每条画面消息算一次更新；UDP模式下每个收齐的分片组算一次更新，
+    UDP数据报经过同样参数的UDP损伤代理。
+    """
+    from datagram import DatagramReceiver
+
+    client = SecureSocket()
+    client.connect("127.0.0.1", port)
+    client_handshake(client)
+    client.send_data({"type": "hello", "datagram": use_datagram})
+    arrivals = []
+    receiver = None
+    datagram_proxy = None
+
+    def on_slice(message):
+        arrivals.append(time.monotonic())
+        client.send_data({"type": "datagram_ack", "seq": message["seq"]})
+
+    start = time.monotonic()
+    deadline = start + duration
+    next_input = start
+    try:
+        while time.monotonic() < deadline:
+            if input_rate and time.monotonic() >= next_input:
+                client.send_data({"type": "mouse_move", "x": 0, "y": 0, "sent_at": time.time()})
+                next_input += 1.0 / input_rate
+            try:
+                data = client.receive_data(timeout=0.02)
+            except socket.timeout:
+                continue
+            if data is None:
+                break
+            if data.get("type") == "server_info" and data.get("datagram"):
+                datagram_proxy = DatagramImpairmentProxy("127.0.0.1", data["datagram"]["port"], up=profile, seed=seed)
+                datagram_proxy.listen()
+                receiver = DatagramReceiver(client.session_key, ("127.0.0.1", datagram_proxy.port), on_slice)
+                receiver.start()
+            elif data.get("type") in ("screen", "tiles"):
+                arrivals.append(time.monotonic())
+                client.send_data({"type": "frame_ack", "seq": data.get("seq")})
+        details = ""
+        if receiver is not None:
+            details = (f"  分片组 完成 {receiver.completed} 校验恢复 {receiver.recovered} 丢弃 {receiver.dropped}"
+                       f"  丢弃数据报 {datagram_proxy.dropped['down']}")
+            for stream in list(server.datagram_streams.values()):
+                details += f"  重发图块 {stream.stats()['resent_tiles']}"
+        elif use_datagram:
+            details = "  未协商UDP"
+        return arrivals, details
+    finally:
+        client.close()
+        if receiver is not None:
+            receiver.close()
+        if datagram_proxy is not None:
+            datagram_proxy.stop()
+
+def bench_udp(args):
+    """UDP画面流基准：不同丢包率下TCP与UDP的画面更新率和停顿时间"""
+    from inputengine import RecordingController
+
+    base = profile_from_args(args)
+    for loss in args.losses:
+        profile = LinkProfile(base.delay, base.jitter, base.bandwidth, base.stall_interval, base.stall_duration,
+                              loss=loss, rto=base.rto)
+        for label, use_datagram in (("TCP", False), ("UDP", True)):
+            server = start_server(input_controller=RecordingController())
+            proxy = start_link(server.port, profile, args.seed)
+            try:
+                arrivals, details = udp_session(
+                    server, proxy.port, profile, args.duration, args.input_rate, use_datagram, args.seed)
+            finally:
+                proxy.stop()
+                server.stop()
+            rate, max_gap, p99_gap, stalled = stall_summary(arrivals, args.duration, args.stall_threshold / 1000)
+            print(f"  丢包 {loss:4.1f}%  {label}  更新 {rate:6.1f} 次/秒  最大间隔 {max_gap:7.1f} ms  "
+                  f"p99间隔 {p99_gap:7.1f} ms  停顿累计 {stalled:8.1f} ms{details}")
+
+def bench_profile(args):
+    """采样分析开销：不分析与分析期间的帧率和进程CPU时间，并列出分析到的热点函数"""
+    from profiler import SamplingProfiler
+
+    server = start_server()
+    try:
+        for label, interval in [("不分析", None)] + [(f"采样{ms:g}ms", ms / 1000) for ms in args.intervals]:
+            profiler = None
+            if interval is not None:
+                # 服务端与基准在同一进程，直接采样即可覆盖截图、编码、发送和接收线程
+                profiler = SamplingProfiler(args.duration + 1, interval)
+                profiler.start()
+            cpu = time.process_time()
+            _, frames, _ = link_session(server.port, args.duration, "jpeg", 70, args.input_rate)
+            cpu = time.process_time() - cpu
+            print(f"  {label:<10} {frames / args.duration:6.1f} 帧/秒  CPU {cpu / args.duration * 100:6.1f}%")
+            if profiler is not None:
+                profiler.stop()
+                profiler.join()
+                if args.output:
+                    print(f"    折叠栈已写入 {profiler.save(args.output)}")
+        for name, own, total in profiler.top_functions(args.top) if profiler is not None else []:
+            print(f"    {own:6d} {total:6d}  {name}")
+    finally:
+        server.stop()
+
+def bench_jpeg(args):
+    """JPEG编码基准：PIL保存到BytesIO、解码再编码（compress_image）与直接从BGRA数组编码的耗时和内存分配"""
+    import io
+    import numpy as np
+    from capture import frame_to_image
+    from jpegencoder import JpegEncoder, available_backends
+    from utils import compress_image
+
+    for width, height in args.sizes:
+        frame = np.empty((height, width, 4), dtype=np.uint8)
+        frame[..., 2::-1] = office_content(width, height)
+        frame[..., 3] = 255
+
+        def pil_save():
+            # send_screen原来的做法：每帧转换为PIL图像并保存到新的BytesIO
+            stream = io.BytesIO()
+            frame_to_image(frame).save(stream, format="JPEG", quality=args.quality)
+            return stream.getvalue()
+
+        encoded = pil_save()
+        paths = {"PIL保存": pil_save,
+                 "解码再编码": lambda: compress_image(encoded, args.quality)}
+        for backend in available_backends():
+            encoder = JpegEncoder(backend, args.subsampling)
+            paths[f"直接编码/{backend}"] = lambda encoder=encoder: encoder.encode(frame, args.quality)
+        print(f"{width}x{height}  画质 {args.quality}  色度抽样 {args.subsampling}")
+        for label, func in paths.items():
+            fps, alloc = measure_frames(func, args.frames)
+            print(f"  {label:<18} {1000 / fps:8.2f} ms/帧  {alloc / 1024:10.1f} KB分配/帧  {len(func()) / 1024:8.1f} KB")
+
+BENCHMARKS = {
+    "capture": bench_capture,
+    "resume": bench_resume,
+    "relay": bench_relay,
+    "flood": bench_flood,
+    "handshake": bench_handshake,
+    "colormodes": bench_colormodes,
+    "input": bench_input,
+    "link": bench_link,
+    "pipeline": bench_pipeline,
+    "progressive": bench_progressive,
+    "compression": bench_compression,
+    "udp": bench_udp,
+    "profile": bench_profile,
+    "jpeg": bench_jpeg,
+}
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="远程桌面控制系统性能基准")
+    subparsers = parser.add_subparsers(dest="name", required=True)
+
+    capture_parser = subparsers.add_parser("capture", help="截图后端帧率和内存分配")
+    capture_parser.add_argument("--backend", default="auto", help="auto / mss / pil / synthetic")
+    capture_parser.add_argument("--frames", type=int, default=100)
+
+    resume_parser = subparsers.add_parser("resume", help="冷连接与会话恢复的首帧耗时和字节数")
+    resume_parser.add_argument("--rounds", type=int, default=10)
+    resume_parser.add_argument("--gap", type=float, default=0.3, help="断线时长（秒）")
+
+    relay_parser = subparsers.add_parser("relay", help="转发端在不同观看人数下的开销")
+    relay_parser.add_argument("--audience", type=int, nargs="+", default=[1, 10, 30])
+    relay_parser.add_argument("--duration", type=float, default=3.0)
+
+    flood_parser = subparsers.add_parser("flood", help="连接洪泛下已连接会话的帧率和新客户端的连接成功率")
+    flood_parser.add_argument("--threads", type=int, default=8)
+    flood_parser.add_argument("--duration", type=float, default=8.0)
+    flood_parser.add_argument("--idle-interval", type=float, default=0.5, help="空闲占位连接的间隔（秒）")
+    flood_parser.add_argument("--connect-interval", type=float, default=0.5, help="新客户端连接的间隔（秒）")
+
+    handshake_parser = subparsers.add_parser("handshake", help="完整握手与恢复握手的延迟和CPU开销")
+    handshake_parser.add_argument("--password", default="benchmark")
+    handshake_parser.add_argument("--kdf-n", type=int, default=32768)
+    handshake_parser.add_argument("--rounds", type=int, default=10)
+    handshake_parser.add_argument("--concurrency", type=int, default=16)
+    handshake_parser.add_argument("--per-thread", type=int, default=5)
+
+
+    colormodes_parser = subparsers.add_parser("colormodes", help="各色彩模式的每帧字节数和编码耗时")
+    colormodes_parser.add_argument("--width", type=int, default=1920)
+    colormodes_parser.add_argument("--height", type=int, default=1080)
+    colormodes_parser.add_argument("--quality", type=int, default=70)
+    colormodes_parser.add_argument("--frames", type=int, default=10)
+
+    input_parser = subparsers.add_parser("input", help="输入事件从发送到注入的延迟百分位数")
+    input_parser.add_argument("--events", type=int, default=2000)
+    input_parser.add_argument("--rate", type=float, default=500, help="每秒发送事件数")
+    input_parser.add_argument("--inject-delay", type=float, nargs="+", default=[0, 1, 5],
+                              help="模拟单次注入耗时（毫秒）")
+
+    link_parser = subparsers.add_parser("link", help="模拟网络链路下的帧率、吞吐量和输入延迟")
+    add_link_arguments(link_parser)
+    link_parser.add_argument("--profiles", nargs="+", choices=sorted(PROFILES),
+                             help="依次测试多个链路预设（忽略单项链路参数）")
+    link_parser.add_argument("--duration", type=float, default=5.0)
+    link_parser.add_argument("--color-mode", choices=COLOR_MODES, default="jpeg")
+    link_parser.add_argument("--quality", type=int, default=70)
+    link_parser.add_argument("--input-rate", type=float, default=20, help="每秒发送的鼠标移动数")
+    link_parser.add_argument("--trace-dir", help="每个链路的吞吐量轨迹CSV写入该目录")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="独立截图编码进程与单进程模式的帧率和输入延迟")
+    pipeline_parser.add_argument("--viewers", type=int, default=4)
+    pipeline_parser.add_argument("--duration", type=float, default=5.0)
+    pipeline_parser.add_argument("--input-rate", type=float, default=100, help="每秒发送的鼠标移动数")
+    pipeline_parser.add_argument("--kill-after", type=float, default=0,
+                                 help="独立进程模式下运行多少秒后杀掉子进程（0表示不杀）")
+
+    progressive_parser = subparsers.add_parser("progressive", help="渐进式画质与固定画质的码率对比")
+    progressive_parser.add_argument("--fixed", type=int, nargs="+", default=[35, 90], help="对比的固定画质")
+    progressive_parser.add_argument("--duration", type=float, default=10.0)
+    progressive_parser.add_argument("--active", type=float, default=1.0, help="每个周期内画面变化的秒数")
+    progressive_parser.add_argument("--period", type=float, default=4.0, help="画面变化周期（秒）")
+
+    compression_parser = subparsers.add_parser("compression", help="各消息类型的压缩率和每条CPU耗时")
+    compression_parser.add_argument("--width", type=int, default=1920)
+    compression_parser.add_argument("--height", type=int, default=1080)
+
+    udp_parser = subparsers.add_parser("udp", help="丢包链路下TCP与UDP画面流的停顿时间对比")
+    add_link_arguments(udp_parser)
+    udp_parser.add_argument("--losses", type=float, nargs="+", default=[0, 1, 3], help="依次测试的丢包率（百分比）")
+    udp_parser.add_argument("--duration", type=float, default=5.0)
+    udp_parser.add_argument("--input-rate", type=float, default=20, help="每秒发送的鼠标移动数，使服务端保持高帧率")
+    udp_parser.add_argument("--stall-threshold", type=float, default=200, help="计为停顿的更新间隔（毫秒）")
+
+    profile_parser = subparsers.add_parser("profile", help="采样性能分析的开销和热点函数")
+    profile_parser.add_argument("--duration", type=float, default=5.0)
+    profile_parser.add_argument("--intervals", type=float, nargs="+", default=[5, 1], help="采样间隔（毫秒）")
+    profile_parser.add_argument("--input-rate", type=float, default=20, help="每秒发送的鼠标移动数")
+    profile_parser.add_argument("--top", type=int, default=10, help="列出的热点函数个数")
+    profile_parser.add_argument("--output", help="折叠栈写入该目录")
+
+    jpeg_parser = subparsers.add_parser("jpeg", help="JPEG编码路径的每帧耗时和内存分配")
+    jpeg_parser.add_argument("--sizes", type=lambda s: tuple(int(v) for v in s.split("x")), nargs="+",
+                             default=[(1920, 1080), (3840, 2160)], help="画面尺寸，如 1920x1080")
+    jpeg_parser.add_argument("--quality", type=int, default=70)
+    jpeg_parser.add_argument("--subsampling", choices=("420", "422", "444"), default="420")
+    jpeg_parser.add_argument("--frames", type=int, default=20)
+
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+远程桌面控制系统 - 屏幕捕获模块
+提供可替换的截图后端，统一输出复用缓冲区上的BGRA格式NumPy视图
+"""
+import time
+import numpy as np
+from PIL import Image
+
+try:
+    import mss  # 可选依赖，Linux下走X11共享内存路径
+except ImportError:
+    mss = None
+
+class CaptureBackend:
+    """截图后端基类
+
+    grab() 返回形状为 (高, 宽, 4) 的BGRA uint8数组，它是后端内部复用缓冲区
+    的视图，下一次grab()时会被覆盖，调用方需要在下一帧之前用完或自行复制。
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self._buffer = np.empty(0, dtype=np.uint8)
+        self.screen_size = (0, 0)
+
+    def _frame_buffer(self, width, height):
+        """获取指定尺寸的连续帧缓冲视图，仅在容量不足时重新分配"""
+        nbytes = width * height * 4
+        if self._buffer.size < nbytes:
+            self._buffer = np.empty(nbytes, dtype=np.uint8)
+        return self._buffer[:nbytes].reshape(height, width, 4)
+
+    def _normalize_bbox(self, bbox):
+        """未指定边界框时截取全屏"""
+        if bbox is None:
+            return (0, 0, self.screen_size[0], self.screen_size[1])
+        return tuple(int(v) for v in bbox)
+
+    def grab(self, bbox=None):
+        """截取屏幕区域，bbox为 (left, top, right, bottom)"""
+        raise NotImplementedError
+
+    def close(self):
+        """释放后端资源"""
+        pass
+
+class MSSCapture(CaptureBackend):
+    """基于mss的截图后端（X11下使用MIT-SHM共享内存）"""
+
+    name = "mss"
+
+    def __init__(self):
+        super().__init__()
+        if mss is None:
+            raise RuntimeError("未安装mss")
+        self._sct = mss.mss()
+        monitor = self._sct.monitors[1]
+        self._origin = (monitor["left"], monitor["top"])
+        self.screen_size = (monitor["width"], monitor["height"])
+
+    def grab(self, bbox=None):
+        left, top, right, bottom = self._normalize_bbox(bbox)
+        width, height = right - left, bottom - top
+        shot = self._sct.grab({
+            "left": self._origin[0] + left,
+            "top": self._origin[1] + top,
+            "width": width,
+            "height": height
+        })
+        frame = self._frame_buffer(width, height)
+        np.copyto(frame, np.frombuffer(shot.raw, dtype=np.uint8).reshape(height, width, 4))
+        return frame
+
+    def close(self):
+        self._sct.close()
+
+class PILCapture(CaptureBackend):
+    """基于PIL ImageGrab的降级截图后端"""
+
+    name = "pil"
+
+    def __init__(self):
+        super().__init__()
+        from PIL import ImageGrab
+        self._grab = ImageGrab.grab
+        self.screen_size = self._grab().size
+
+    def grab(self, bbox=None):
+        left, top, right, bottom = self._normalize_bbox(bbox)
+        image = self._grab(bbox=(left, top, right, bottom)).convert("RGB")
+        frame = self._frame_buffer(image.width, image.height)
+        frame[..., 2::-1] = np.asarray(image)
+        frame[..., 3] = 255
+        return frame
+
+class SyntheticCapture(CaptureBackend):
+    """合成画面后端，用于无显示环境下的测试和基准"""
+
+    name = "synthetic"
+
+    def __init__(self, width=1920, height=1080, box_size=128, fps=30):
+        super().__init__()
+        self.screen_size = (width, height)
+        self.box_size = box_size
+        # 方块位置由时间决定，多个实例（如各客户端的发送线程）看到的是同一块“屏幕”
+        self.fps = fps
+        self.static = False  # 为True时画面保持不变，用于模拟空闲桌面
+        # 背景为固定渐变，每帧只重绘移动方块
+        x = np.linspace(0, 255, width, dtype=np.uint8)
+        y = np.linspace(0, 255, height, dtype=np.uint8)
+        self._background = np.empty((height, width, 4), dtype=np.uint8)
+        self._background[..., 0] = x[np.newaxis, :]
+        self._background[..., 1] = y[:, np.newaxis]
+        self._background[..., 2] = 128
+        self._background[..., 3] = 255
+
+    def grab(self, bbox=None):
+        left, top, right, bottom = self._normalize_bbox(bbox)
+        index = 0 if self.static else int(time.monotonic() * self.fps)
+        frame = self._frame_buffer(right - left, bottom - top)
+        np.copyto(frame, self._background[top:bottom, left:right])
+
+        # 方块沿对角线移动，换算到截取区域内的坐标
+        width, height = self.screen_size
+        bx = (index * 16) % max(1, width - self.box_size) - left
+        by = (index * 9) % max(1, height - self.box_size) - top
+        x0, y0 = max(0, bx), max(0, by)
+        x1 = min(frame.shape[1], bx + self.box_size)
+        y1 = min(frame.shape[0], by + self.box_size)
+        if x0 < x1 and y0 < y1:
+            frame[y0:y1, x0:x1, :3] = 255
+        return frame
+
+CAPTURE_BACKENDS = {
+    "mss": MSSCapture,
+    "pil": PILCapture,
+    "synthetic": SyntheticCapture,
+}
+
+def create_capture_backend(name="auto", **kwargs):
+    """按名称创建截图后端，auto时优先使用mss，不可用时退回PIL"""
+    if name != "auto":
+        return CAPTURE_BACKENDS[name](**kwargs)
+
+    for candidate in ("mss", "pil"):
+        try:
+            return CAPTURE_BACKENDS[candidate]()
+        except Exception:
+            continue
+    raise RuntimeError("没有可用的截图后端")
+
+def frame_to_image(frame):
+    """将BGRA帧转换为PIL RGB图像（连续数组直接按BGRX解码，不做额外的NumPy复制）"""
+    frame = np.ascontiguousarray(frame)
+    height, width = frame.shape[:2]
+    return Image.frombuffer("RGB", (width, height), frame, "raw", "BGRX", 0, 1)
@@ -8,17 +8,30 @@ import threading
 import socket
 import base64
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
 from PIL import Image, ImageTk
 import io
 
 # 导入自定义工具模块
 from utils import SecureSocket
+from config import load_config
+from handshake import client_handshake
+from colormodes import decode_image
+from compression import available_codecs
+from datagram import DatagramReceiver, decode_tile
 
 # 客户端配置
 DEFAULT_HOST = "localhost"
 DEFAULT_PORT = 5555
 CLIENT_VERSION = "1.0.0"
+ZOOM_LEVELS = ["25%", "50%", "75%", "100%", "150%", "200%"]
+# 色彩模式：低带宽链路可选择降低色彩精度
+COLOR_MODE_LABELS = {"JPEG": "jpeg", "YUV420": "yuv420", "RGB565": "rgb565", "256色": "palette"}
+
+# 断线重连：指数退避的初始/最大间隔和放弃前的总时长（秒），总时长与服务端会话宽限期一致
+RECONNECT_INITIAL_DELAY = 0.5
+RECONNECT_MAX_DELAY = 8.0
+RECONNECT_TIMEOUT = 60.0
 
 logging.basicConfig(
     level=logging.INFO,
@@ -36,10 +49,27 @@ class RemoteDesktopClient:
         self.master.protocol("WM_DELETE_WINDOW", self.on_close)
         
         self.connected = False
+        self.view_only = False  # 通过转发进程观看时不发送输入
         self.client_socket = None
         self.server_info = None
         self.current_image = None
+        self.overview_image = None
         self.screen_scale = 1.0  # 屏幕缩放比例
+        self.last_viewport = None
+        self.auto_reconnect = load_config('client').get('auto_reconnect', True)
+        self.udp_video = load_config('client').get('udp_video', False)
+        self.datagram_receiver = None  # 服务端同意UDP画面流时的接收端
+        self.tile_seqs = {}  # UDP画面中各图块最后显示的分片组序号，忽略乱序到达的旧图块
+        
+        # 会话恢复状态：服务端下发的令牌、最后显示的帧序号及其图像
+        self.session_token = None
+        self.last_seq = None
+        self.region = None
+        self.region_image = None
+        self.remote_address = None
+        self.password = ""
+        self.color_mode = "jpeg"
+        self.tickets = {}  # 各服务端地址的恢复票据，重连时跳过密钥交换和密码KDF
         
         # 创建UI
         self.create_widgets()
@@ -65,6 +95,10 @@ class RemoteDesktopClient:
         self.port_entry.insert(0, str(DEFAULT_PORT))
         self.port_entry.pack(side=tk.LEFT, padx=5)
         
+        ttk.Label(self.control_frame, text="密码:").pack(side=tk.LEFT, padx=5)
+        self.password_entry = ttk.Entry(self.control_frame, width=10, show="*")
+        self.password_entry.pack(side=tk.LEFT, padx=5)
+        
         self.connect_button = ttk.Button(
             self.control_frame, 
             text="连接", 
@@ -86,10 +120,49 @@ class RemoteDesktopClient:
         )
         self.quality_scale.pack(side=tk.LEFT)
         
+        # 色彩模式
+        ttk.Label(self.control_frame, text="色彩:").pack(side=tk.LEFT, padx=10)
+        self.color_mode_var = tk.StringVar(value="JPEG")
+        self.color_mode_combo = ttk.Combobox(
+            self.control_frame,
+            textvariable=self.color_mode_var,
+            values=list(COLOR_MODE_LABELS),
+            width=7,
+            state="readonly"
+        )
+        self.color_mode_combo.pack(side=tk.LEFT)
+        self.color_mode_combo.bind("<<ComboboxSelected>>", self.set_quality)
+        
+        # 渐进式画质：变化区域先以低画质显示，静止后逐步补发到无损
+        self.progressive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.control_frame,
+            text="渐进",
+            variable=self.progressive_var,
+            command=self.set_quality
+        ).pack(side=tk.LEFT, padx=5)
+        
+        # 缩放控制
+        ttk.Label(self.control_frame, text="缩放:").pack(side=tk.LEFT, padx=10)
+        self.zoom_var = tk.StringVar(value="100%")
+        self.zoom_combo = ttk.Combobox(
+            self.control_frame,
+            textvariable=self.zoom_var,
+            values=ZOOM_LEVELS,
+            width=5,
+            state="readonly"
+        )
+        self.zoom_combo.pack(side=tk.LEFT)
+        self.zoom_combo.bind("<<ComboboxSelected>>", self.set_zoom)
+        
         # 状态显示
         self.status_label = ttk.Label(self.control_frame, text="未连接")
         self.status_label.pack(side=tk.RIGHT, padx=10)
         
+        # 统计信息
+        ttk.Button(self.control_frame, text="统计", command=self.request_stats).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(self.control_frame, text="性能分析", command=self.request_profile).pack(side=tk.RIGHT, padx=5)
+        
         # 创建画布用于显示远程屏幕
         self.canvas_frame = ttk.Frame(self.master)
         self.canvas_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=10, pady=5)
@@ -99,7 +172,13 @@ class RemoteDesktopClient:
             bg="black",
             highlightthickness=0
         )
+        self.h_scrollbar = ttk.Scrollbar(self.canvas_frame, orient=tk.HORIZONTAL, command=self.on_scroll_x)
+        self.v_scrollbar = ttk.Scrollbar(self.canvas_frame, orient=tk.VERTICAL, command=self.on_scroll_y)
+        self.canvas.config(xscrollcommand=self.h_scrollbar.set, yscrollcommand=self.v_scrollbar.set)
+        self.h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.canvas.bind("<Configure>", lambda e: self.send_viewport())
         
         # 绑定鼠标和键盘事件
         self.canvas.bind("<Motion>", self.on_mouse_move)
@@ -137,6 +216,8 @@ class RemoteDesktopClient:
         except ValueError:
             messagebox.showerror("错误", "端口必须是数字")
             return
+        self.password = self.password_entry.get()
+        self.color_mode = COLOR_MODE_LABELS.get(self.color_mode_var.get(), "jpeg")
             
         self.status_label.config(text="正在连接...")
         self.statusbar.config(text=f"正在连接到 {host}:{port}")
@@ -152,30 +233,108 @@ class RemoteDesktopClient:
     def connect_thread(self, host, port):
         """连接线程处理函数"""
         try:
-            # 创建套接字
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(5)
-            sock.connect((host, port))
-            
-            # 创建安全套接字
-            self.client_socket = SecureSocket(sock)
+            self.open_connection(host, port)
             
             # 更新UI状态
             self.master.after(0, self.on_connect_success)
             
-            # 启动屏幕更新线程
-            self.screen_update_thread = threading.Thread(
-                target=self.update_screen
-            )
-            self.screen_update_thread.daemon = True
-            self.screen_update_thread.start()
-            
         except Exception as e:
-            self.master.after(0, lambda: self.on_connect_error(str(e)))
+            self.master.after(0, lambda msg=str(e): self.on_connect_error(msg))
+            
+    def open_connection(self, host, port):
+        """建立连接并发送握手，持有会话令牌时请求恢复会话"""
+        # 创建套接字
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect((host, port))
+        
+        # 创建安全套接字，握手后切换到会话密钥；有票据时走恢复握手
+        client_socket = SecureSocket(sock)
+        self.tickets[(host, port)] = client_handshake(client_socket, self.password, self.tickets.get((host, port)))
+        client_socket.send_data({
+            "type": "hello",
+            "version": CLIENT_VERSION,
+            "session_token": self.session_token,
+            "color_mode": self.color_mode,
+            "progressive": self.progressive_var.get(),
+            "codecs": available_codecs(),
+            "datagram": self.udp_video,
+            # 只有仍保留着该帧图像时才能以它为基准增量恢复
+            "last_seq": self.last_seq if self.region_image is not None else None
+        })
+        self.client_socket = client_socket
+        self.remote_address = (host, port)
+        
+        # 启动屏幕更新线程
+        self.screen_update_thread = threading.Thread(
+            target=self.update_screen,
+            args=(client_socket,)
+        )
+        self.screen_update_thread.daemon = True
+        self.screen_update_thread.start()
+        
+    def close_datagram(self):
+        """关闭UDP画面接收端"""
+        if self.datagram_receiver is not None:
+            self.datagram_receiver.close()
+            self.datagram_receiver = None
+            
+    def start_reconnect(self):
+        """连接意外断开，保留画面并在后台线程中重连"""
+        self.close_datagram()
+        if self.client_socket:
+            try:
+                self.client_socket.close()
+            except:
+                pass
+            self.client_socket = None
+            
+        self.status_label.config(text="正在重连...")
+        self.statusbar.config(text="连接已断开，正在尝试恢复会话")
+        
+        reconnect_thread = threading.Thread(target=self.reconnect_thread)
+        reconnect_thread.daemon = True
+        reconnect_thread.start()
+        
+    def reconnect_thread(self):
+        """按指数退避间隔重连，不阻塞界面"""
+        delay = RECONNECT_INITIAL_DELAY
+        deadline = time.monotonic() + RECONNECT_TIMEOUT
+        while self.connected and time.monotonic() < deadline:
+            time.sleep(delay)
+            if not self.connected:
+                return
+            try:
+                self.open_connection(*self.remote_address)
+                self.master.after(0, self.on_reconnect_success)
+                return
+            except Exception as e:
+                logging.info("重连失败: %s", e)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                
+        if self.connected:
+            self.master.after(0, self.on_reconnect_failed)
+            
+    def on_reconnect_success(self):
+        """重连成功处理"""
+        if not self.connected:
+            # 重连期间用户已主动断开
+            if self.client_socket:
+                self.client_socket.close()
+                self.client_socket = None
+            return
+        self.status_label.config(text="已连接")
+        self.statusbar.config(text="已重新连接到服务器")
+        
+    def on_reconnect_failed(self):
+        """重连超时处理"""
+        self.disconnect_from_server()
+        messagebox.showinfo("断开连接", "服务器已断开连接，重连失败")
             
     def on_connect_success(self):
         """连接成功处理"""
         self.connected = True
+        self.last_viewport = None
         self.connect_button.config(text="断开连接")
         self.status_label.config(text="已连接")
         self.statusbar.config(text="已连接到服务器")
@@ -189,6 +348,7 @@ class RemoteDesktopClient:
     def disconnect_from_server(self):
         """断开与服务器的连接"""
         self.connected = False
+        self.close_datagram()
         
         if self.client_socket:
             try:
@@ -201,21 +361,27 @@ class RemoteDesktopClient:
         self.status_label.config(text="未连接")
         self.statusbar.config(text="已断开连接")
         
-        # 清除画布
+        # 清除画布和会话状态
         self.canvas.delete("all")
         self.current_image = None
+        self.overview_image = None
+        self.session_token = None
+        self.last_seq = None
+        self.region = None
+        self.region_image = None
         
-    def update_screen(self):
-        """更新屏幕显示线程"""
+    def update_screen(self, client_socket):
+        """更新屏幕显示线程，连接被替换或关闭后退出"""
         try:
-            while self.connected and self.client_socket:
+            while self.client_socket is client_socket:
                 try:
-                    data = self.client_socket.receive_data(timeout=1.0)
+                    data = client_socket.receive_data(timeout=1.0)
                 except socket.timeout:
                     continue
                     
                 if not data:
-                    self.master.after(0, self.handle_disconnect)
+                    if self.client_socket is client_socket:
+                        self.master.after(0, self.handle_disconnect)
                     break
                     
                 # 根据数据类型处理
@@ -223,49 +389,316 @@ class RemoteDesktopClient:
                 
                 if data_type == "server_info":
                     self.server_info = data  # 使用属性类型提示
+                    self.session_token = data.get("session_token")
+                    client_socket.codec.enable_zstd(data.get("codecs"))
+                    self.view_only = bool(data.get("view_only"))
+                    self.close_datagram()
+                    if data.get("datagram"):
+                        # 画面改走UDP，发往与TCP相同的服务端地址；UDP不通时服务端自动回退到TCP
+                        self.datagram_receiver = DatagramReceiver(
+                            client_socket.session_key,
+                            (self.remote_address[0], data["datagram"]["port"]),
+                            lambda message, sock=client_socket: self.process_datagram_slice(sock, message)
+                        )
+                        self.datagram_receiver.start()
+                    if not data.get("resumed"):
+                        # 新会话，服务端会发送完整画面，可见区域需要重新上报
+                        self.last_seq = None
+                        self.region_image = None
+                        self.last_viewport = None
                     self.master.after(0, lambda: self.statusbar.config(
                         text=f"服务器版本: {data.get('version', '未知')}"
                     ))
+                    self.master.after(0, self.update_scrollregion)
                     
                 elif data_type == "screen":
-                    self.process_screen_data(data.get("image", ""))
+                    self.process_screen_data(data)
+                    self.acknowledge_frame(client_socket, data.get("seq"))
+                    
+                elif data_type == "tiles":
+                    self.process_tiles_data(data.get("tiles", []), data.get("region"))
+                    self.acknowledge_frame(client_socket, data.get("seq"))
+                    
+                elif data_type == "overview":
+                    self.process_overview_data(data.get("image", ""), data.get("scale", 1.0))
+                    
+                elif data_type == "stats":
+                    self.master.after(0, lambda stats=data: self.show_stats(stats))
+                    
+                elif data_type == "profile_result":
+                    self.master.after(0, lambda result=data: self.show_profile(result))
                     
         except Exception as e:
-            if self.connected:
-                self.master.after(0, lambda: self.handle_error(str(e)))
+            if self.connected and self.client_socket is client_socket:
+                self.master.after(0, lambda msg=str(e): self.handle_error(msg))
                 
-    def process_screen_data(self, image_data):
+    def acknowledge_frame(self, client_socket, seq):
+        """确认已显示的帧，服务端据此作为断线恢复的基准"""
+        if seq is None or self.region_image is None or self.view_only:
+            return
+        self.last_seq = seq
+        try:
+            client_socket.send_data({"type": "frame_ack", "seq": seq})
+        except Exception:
+            pass
+            
+    def process_tiles_data(self, tiles, region):
+        """将恢复会话时收到的变化图块贴到保留的画面上"""
+        if self.region_image is None or list(region or []) != list(self.region or []):
+            self.region_image = None
+            return
+            
+        try:
+            image = self.region_image.copy()
+            for x, y, w, h, tile_data in tiles:
+                tile = Image.open(io.BytesIO(base64.b64decode(tile_data)))
+                tile = tile.resize((max(1, int(w * self.screen_scale)), max(1, int(h * self.screen_scale))), Image.BILINEAR)
+                image.paste(tile, (int(x * self.screen_scale), int(y * self.screen_scale)))
+            self.region_image = image
+            self.master.after(0, lambda img=image, x=region[0], y=region[1]: self.display_image(img, x, y))
+        except Exception as e:
+            self.region_image = None
+            logging.error("图块处理失败: %s", e)
+                
+    def process_datagram_slice(self, client_socket, message):
+        """把UDP画面的一个分片组中的图块贴到画面上并确认
+
+        分片组可能乱序到达，每个图块只接受比已显示内容更新的序号。
+        """
+        if self.client_socket is not client_socket:
+            return
+        seq, region = message["seq"], message["region"]
+        try:
+            left, top, right, bottom = region
+            size = (max(1, int((right - left) * self.screen_scale)), max(1, int((bottom - top) * self.screen_scale)))
+            if self.region_image is None or list(region) != list(self.region or []) or self.region_image.size != size:
+                # 新的可见区域或显示比例：从空白画面开始，服务端会重发区域内所有图块
+                self.region = list(region)
+                self.region_image = Image.new("RGB", size)
+                self.tile_seqs = {}
+            image = self.region_image.copy()
+            for x, y, w, h, tile_data in message["tiles"]:
+                if self.tile_seqs.get((x, y), 0) > seq:
+                    continue
+                self.tile_seqs[(x, y)] = seq
+                tile = decode_tile(tile_data)
+                tile = tile.resize((max(1, int(w * self.screen_scale)), max(1, int(h * self.screen_scale))), Image.BILINEAR)
+                image.paste(tile, (int(x * self.screen_scale), int(y * self.screen_scale)))
+            self.region_image = image
+            self.master.after(0, lambda img=image, x=region[0], y=region[1]: self.display_image(img, x, y))
+            client_socket.send_data({"type": "datagram_ack", "seq": seq})
+        except Exception as e:
+            logging.error("UDP画面处理失败: %s", e)
+            
+    def process_screen_data(self, data):
         """处理屏幕图像数据"""
-        if not image_data:
+        if not data.get("image") and not data.get("data"):
             return
+        region = data.get("region")
+        scale = data.get("scale", 1.0)
             
         try:
-            img_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(img_bytes))
-            self.master.after(0, lambda img=image: self.display_image(img))
+            # 按消息中的色彩模式解码（JPEG或低带宽模式的向量化解码）
+            image = decode_image(data)
+            image.load()
+            # 服务端按可见区域和编码比例发送，换算到当前显示比例
+            if region:
+                left, top, right, bottom = region
+            else:
+                left, top, right, bottom = 0, 0, image.width / scale, image.height / scale
+            size = (max(1, int((right - left) * self.screen_scale)), max(1, int((bottom - top) * self.screen_scale)))
+            if image.size != size:
+                image = image.resize(size, Image.BILINEAR)
+            self.region = region
+            self.region_image = image
+            self.master.after(0, lambda img=image, x=left, y=top: self.display_image(img, x, y))
         except Exception as e:
+            self.region_image = None
             logging.error("图像处理失败: %s", e)
+            
+    def process_overview_data(self, image_data, scale):
+        """处理低分辨率全屏缩略图，作为可见区域之外的背景"""
+        if not image_data or scale <= 0:
+            return
+            
+        try:
+            image = Image.open(io.BytesIO(base64.b64decode(image_data)))
+            image.load()
+            size = (max(1, int(image.width / scale * self.screen_scale)), max(1, int(image.height / scale * self.screen_scale)))
+            image = image.resize(size, Image.BILINEAR)
+            self.master.after(0, lambda img=image: self.display_overview(img))
+        except Exception as e:
+            logging.error("缩略图处理失败: %s", e)
         
-    def display_image(self, image):
-        """简化图像显示"""
+    def display_image(self, image, x=0, y=0):
+        """在可见区域位置显示图像"""
         self.current_image = ImageTk.PhotoImage(image)
-        self.canvas.create_image(0, 0, image=self.current_image, anchor=tk.NW)
+        self.canvas.delete("screen")
+        self.canvas.create_image(
+            int(x * self.screen_scale), int(y * self.screen_scale),
+            image=self.current_image, anchor=tk.NW, tags="screen"
+        )
+        
+    def display_overview(self, image):
+        """显示全屏缩略图背景"""
+        self.overview_image = ImageTk.PhotoImage(image)
+        self.canvas.delete("overview")
+        self.canvas.create_image(0, 0, image=self.overview_image, anchor=tk.NW, tags="overview")
+        self.canvas.tag_lower("overview")
+        
+    def get_screen_size(self):
+        """获取远程屏幕尺寸"""
+        screen_size = (self.server_info or {}).get("screen_size", {})
+        return screen_size.get("width", 1920), screen_size.get("height", 1080)
+        
+    def update_scrollregion(self):
+        """根据远程屏幕尺寸和缩放比例更新画布滚动区域"""
+        width, height = self.get_screen_size()
+        self.canvas.config(scrollregion=(0, 0, int(width * self.screen_scale), int(height * self.screen_scale)))
+        self.send_viewport()
+        
+    def set_zoom(self, event=None):
+        """设置本地显示缩放比例"""
+        try:
+            self.screen_scale = int(self.zoom_var.get().rstrip("%")) / 100.0
+        except ValueError:
+            self.screen_scale = 1.0
+        self.canvas.delete("all")
+        self.current_image = None
+        self.overview_image = None
+        self.region_image = None
+        self.update_scrollregion()
+        
+    def on_scroll_x(self, *args):
+        """水平滚动画布"""
+        self.canvas.xview(*args)
+        self.send_viewport()
+        
+    def on_scroll_y(self, *args):
+        """垂直滚动画布"""
+        self.canvas.yview(*args)
+        self.send_viewport()
+        
+    def send_viewport(self):
+        """将当前可见区域和缩放比例发送给服务端"""
+        if not self.connected or not self.client_socket or not self.server_info or self.view_only:
+            return
+            
+        viewport = {
+            "x": int(self.canvas.canvasx(0) / self.screen_scale),
+            "y": int(self.canvas.canvasy(0) / self.screen_scale),
+            "width": int(self.canvas.winfo_width() / self.screen_scale) + 1,
+            "height": int(self.canvas.winfo_height() / self.screen_scale) + 1,
+            "zoom": self.screen_scale
+        }
+        if viewport == self.last_viewport:
+            return
+        self.last_viewport = viewport
+        
+        try:
+            self.client_socket.send_data(dict(viewport, type="viewport"))
+        except:
+            pass
         
     def set_quality(self, event=None):
         """设置图像质量"""
+        self.color_mode = COLOR_MODE_LABELS.get(self.color_mode_var.get(), "jpeg")
         if self.connected and self.client_socket:
             quality = self.quality_var.get()
             try:
                 self.client_socket.send_data({
                     "type": "set_quality",
-                    "quality": quality
+                    "quality": quality,
+                    "color_mode": self.color_mode,
+                    "progressive": self.progressive_var.get()
                 })
             except:
                 pass
                 
+    def request_stats(self):
+        """向服务端请求统计信息，回复在接收线程中显示"""
+        if self.connected and self.client_socket:
+            try:
+                self.client_socket.send_data({"type": "stats"})
+            except:
+                pass
+                
+    def request_profile(self):
+        """请求服务端进行采样性能分析，结果在分析结束后回传"""
+        if not self.connected or not self.client_socket:
+            return
+        duration = simpledialog.askinteger("性能分析", "分析时长（秒）:", initialvalue=10, minvalue=1, maxvalue=120)
+        if duration is None:
+            return
+        try:
+            self.client_socket.send_data({"type": "profile", "duration": duration, "stream": True})
+            self.statusbar.config(text=f"服务端性能分析中，约 {duration} 秒后返回结果")
+        except:
+            pass
+            
+    def show_profile(self, result):
+        """显示性能分析摘要，并可把完整折叠栈保存到本地"""
+        if result.get("error") and "ticks" not in result:
+            messagebox.showerror("性能分析", result["error"])
+            return
+        # 服务端保存文件失败时仍有采样结果，显示错误代替文件路径
+        saved = result.get("error") or f"服务端文件: {result.get('path')}"
+        self.statusbar.config(text=f"性能分析完成，{saved}")
+        lines = [f"时长 {result.get('duration', 0):.1f} 秒  采样 {result.get('ticks')} 次  {saved}",
+                 "", "各线程采样数（运行=采样间隔内占用了CPU）:"]
+        lines.extend(f"  {name:<24} 运行 {active:>6}  总计 {total:>6}"
+                     for name, (active, total) in (result.get("threads") or {}).items())
+        lines.extend(["", f"{'自身':>8} {'累计':>8}  函数"])
+        lines.extend(f"{own:>8} {total:>8}  {name}" for name, own, total in result.get("top") or [])
+        
+        window = tk.Toplevel(self.master)
+        window.title("性能分析")
+        text = tk.Text(window, width=120, height=40, font=("Courier", 9))
+        text.insert(tk.END, "\n".join(lines))
+        text.config(state=tk.DISABLED)
+        text.pack(fill=tk.BOTH, expand=True)
+        
+        if result.get("collapsed"):
+            path = filedialog.asksaveasfilename(
+                parent=window, title="保存折叠栈", defaultextension=".collapsed",
+                filetypes=[("折叠栈", "*.collapsed"), ("所有文件", "*.*")]
+            )
+            if path:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(result["collapsed"])
+                
+    def show_stats(self, stats):
+        """在单独窗口中显示服务端统计信息和渐进画质图"""
+        lines = [
+            f"客户端数: {stats.get('clients')}  截图后端: {stats.get('capture_backend')}  "
+            f"独立进程: {stats.get('capture_process')}",
+            f"握手: {stats.get('handshakes')}",
+            f"准入: {stats.get('admission')}",
+            f"输入: {stats.get('input')}"
+        ]
+        if stats.get("datagram"):
+            receiver = self.datagram_receiver
+            lines.append(f"UDP画面: {stats['datagram']}")
+            if receiver is not None:
+                lines.append(f"UDP接收: 完成 {receiver.completed}  校验恢复 {receiver.recovered}  丢弃 {receiver.dropped}")
+        session = stats.get("session") or {}
+        lines.append(f"会话: 帧序号 {session.get('seq')}  色彩 {session.get('color_mode')}  "
+                     f"渐进 {session.get('progressive')}")
+        quality_map = session.get("quality_map")
+        if quality_map:
+            lines.append(f"画质图（{quality_map['tile']}像素图块，0=低画质 1=高画质 2=无损）: {quality_map['counts']}")
+            lines.extend(quality_map["rows"])
+        
+        window = tk.Toplevel(self.master)
+        window.title("统计信息")
+        text = tk.Text(window, width=100, height=40, font=("Courier", 9))
+        text.insert(tk.END, "\n".join(lines))
+        text.config(state=tk.DISABLED)
+        text.pack(fill=tk.BOTH, expand=True)
+                
     def on_mouse_move(self, event):
         """处理鼠标移动事件"""
-        if not self.connected or not self.client_socket or not self.server_info:
+        if not self.connected or not self.client_socket or self.view_only or not self.server_info:
             return
             
         try:
@@ -274,23 +707,24 @@ class RemoteDesktopClient:
             screen_width = screen_size.get("width", 1920)
             screen_height = screen_size.get("height", 1080)
             
-            # 使用缩放比例转换坐标
+            # 使用缩放比例和滚动偏移转换坐标
             if self.screen_scale > 0:
-                x = int(event.x / self.screen_scale)
-                y = int(event.y / self.screen_scale)
+                x = int(self.canvas.canvasx(event.x) / self.screen_scale)
+                y = int(self.canvas.canvasy(event.y) / self.screen_scale)
                 
                 # 发送鼠标移动命令
                 self.client_socket.send_data({
                     "type": "mouse_move",
                     "x": x,
-                    "y": y
+                    "y": y,
+                    "sent_at": time.time()  # 服务端据此统计输入延迟
                 })
         except:
             pass
             
     def on_mouse_click(self, event, button, clicks):
         """处理鼠标点击事件"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.client_socket or self.view_only:
             return
             
         try:
@@ -298,14 +732,15 @@ class RemoteDesktopClient:
             self.client_socket.send_data({
                 "type": "mouse_click",
                 "button": button,
-                "clicks": clicks
+                "clicks": clicks,
+                "sent_at": time.time()  # 服务端据此统计输入延迟
             })
         except:
             pass
             
     def on_mouse_wheel(self, event):
         """处理鼠标滚轮事件"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.client_socket or self.view_only:
             return
             
         try:
@@ -317,14 +752,15 @@ class RemoteDesktopClient:
             self.client_socket.send_data({
                 "type": "mouse_scroll",
                 "dx": dx,
-                "dy": dy
+                "dy": dy,
+                "sent_at": time.time()  # 服务端据此统计输入延迟
             })
         except:
             pass
             
     def on_key_press(self, event):
         """处理键盘按下事件"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.client_socket or self.view_only:
             return
             
         try:
@@ -334,14 +770,15 @@ class RemoteDesktopClient:
                 # 发送键盘按下命令
                 self.client_socket.send_data({
                     "type": "keyboard_press",
-                    "key": key
+                    "key": key,
+                    "sent_at": time.time()  # 服务端据此统计输入延迟
                 })
         except:
             pass
             
     def on_key_release(self, event):
         """处理键盘释放事件"""
-        if not self.connected or not self.client_socket:
+        if not self.connected or not self.client_socket or self.view_only:
             return
             
         try:
@@ -351,7 +788,8 @@ class RemoteDesktopClient:
                 # 发送键盘释放命令
                 self.client_socket.send_data({
                     "type": "keyboard_release",
-                    "key": key
+                    "key": key,
+                    "sent_at": time.time()  # 服务端据此统计输入延迟
                 })
         except:
             pass
@@ -397,14 +835,18 @@ class RemoteDesktopClient:
         
     def handle_disconnect(self):
         """处理服务器断开连接"""
-        if self.connected:
+        if self.connected and self.auto_reconnect and self.session_token:
+            self.start_reconnect()
+        elif self.connected:
             self.disconnect_from_server()
             messagebox.showinfo("断开连接", "服务器已断开连接")
             
     def handle_error(self, error_msg):
         """处理错误"""
         self.statusbar.config(text=f"错误: {error_msg}")
-        if self.connected:
+        if self.connected and self.auto_reconnect and self.session_token:
+            self.start_reconnect()
+        elif self.connected:
             self.disconnect_from_server()
             messagebox.showerror("连接错误", f"与服务器通信时出错:\n{error_msg}")
             
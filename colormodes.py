@@ -0,0 +1,178 @@
+"""
+远程桌面控制系统 - 色彩模式模块
+低带宽链路下在编码前降低色彩精度：YUV 4:2:0色度抽样、RGB565 16位打包、
+自适应256色调色板，编解码均为NumPy向量化实现。
+这些模式是降低精度后的无损压缩，适合色块多的办公画面；照片、视频等内容上会比JPEG大十几倍，
+因此编码器定期与JPEG比较体积，更大时自动改发JPEG。
+"""
+import io
+import zlib
+import base64
+import numpy as np
+from PIL import Image
+
+from capture import frame_to_image
+from jpegencoder import JpegEncoder
+
+COLOR_MODES = ("jpeg", "yuv420", "rgb565", "palette")
+ZLIB_LEVEL = 1  # 抽样/量化后的数据用最快的级别，压缩率与高级别相差无几
+# 调色板每隔多少帧重新计算一次，期间复用缓存的调色板做映射
+PALETTE_REFRESH_FRAMES = 30
+# 非JPEG模式每隔多少帧与JPEG比较一次体积，比JPEG大时在下次比较前改发JPEG
+JPEG_CHECK_FRAMES = 30
+
+def rgb_to_yuv420(rgb):
+    """RGB转BT.601 YCbCr，色度在2x2块内取平均，返回 (Y, U, V) 三个uint8平面
+
+    色度转换是线性的，先对RGB做2x2平均再转换，只需处理四分之一的像素。
+    """
+    height, width = rgb.shape[:2]
+    # 亮度：系数之和为256，uint16不会溢出
+    y = rgb[..., 0].astype(np.uint16) * 77
+    y += rgb[..., 1].astype(np.uint16) * 150
+    y += rgb[..., 2].astype(np.uint16) * 29
+    y += 128
+    y >>= 8
+
+    # 奇数尺寸时复制最后一行/列补齐，再按2x2块求和
+    pad = ((0, height % 2), (0, width % 2), (0, 0))
+    if pad[0][1] or pad[1][1]:
+        rgb = np.pad(rgb, pad, mode="edge")
+    # 四个像素之和不超过1020，用uint16按步长切片累加比reshape求和快得多
+    block = rgb[0::2, 0::2].astype(np.uint16)
+    block += rgb[1::2, 0::2]
+    block += rgb[0::2, 1::2]
+    block += rgb[1::2, 1::2]
+    block = block.astype(np.int32)
+    r, g, b = block[..., 0], block[..., 1], block[..., 2]
+    # 块内和是4个像素之和，右移10位同时完成平均和系数归一
+    u = ((-43 * r - 85 * g + 128 * b + 512) >> 10) + 128
+    v = ((128 * r - 107 * g - 21 * b + 512) >> 10) + 128
+    return (y.astype(np.uint8),
+            np.clip(u, 0, 255).astype(np.uint8),
+            np.clip(v, 0, 255).astype(np.uint8))
+
+def yuv420_to_rgb(y, u, v):
+    """YUV 4:2:0平面还原为RGB数组"""
+    height, width = y.shape
+    u = np.repeat(np.repeat(u, 2, axis=0), 2, axis=1)[:height, :width].astype(np.int32) - 128
+    v = np.repeat(np.repeat(v, 2, axis=0), 2, axis=1)[:height, :width].astype(np.int32) - 128
+    y = y.astype(np.int32)
+    rgb = np.empty((height, width, 3), dtype=np.int32)
+    rgb[..., 0] = y + ((359 * v + 128) >> 8)
+    rgb[..., 1] = y - ((88 * u + 183 * v + 128) >> 8)
+    rgb[..., 2] = y + ((454 * u + 128) >> 8)
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+def rgb_to_rgb565(rgb):
+    """RGB打包为16位RGB565"""
+    r = rgb[..., 0].astype(np.uint16)
+    g = rgb[..., 1].astype(np.uint16)
+    b = rgb[..., 2].astype(np.uint16)
+    return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+
+def rgb565_to_rgb(packed):
+    """RGB565解包，低位用高位补齐以保证纯白还原为255"""
+    r = (packed >> 11) & 0x1F
+    g = (packed >> 5) & 0x3F
+    b = packed & 0x1F
+    rgb = np.empty(packed.shape + (3,), dtype=np.uint8)
+    rgb[..., 0] = (r << 3) | (r >> 2)
+    rgb[..., 1] = (g << 2) | (g >> 4)
+    rgb[..., 2] = (b << 3) | (b >> 2)
+    return rgb
+
+class ColorEncoder:
+    """按色彩模式编码画面，保存跨帧状态（调色板缓存、JPEG编码器的句柄和缓冲区）"""
+
+    def __init__(self, mode="jpeg", jpeg=None):
+        self.mode = mode if mode in COLOR_MODES else "jpeg"
+        self.jpeg = jpeg or JpegEncoder()
+        self._palette_image = None
+        self._palette_age = 0
+        self._frames = 0
+        self.jpeg_fallback = False  # 当前内容上该模式比JPEG大，暂时改发JPEG
+
+    def encode(self, image, quality=70):
+        """编码PIL RGB图像，返回要合并进screen消息的字段"""
+        if self.mode == "jpeg":
+            return self._encode_jpeg(image, quality)
+        return self._smaller(lambda: self._encode_reduced(image), lambda: self._encode_jpeg(image, quality))
+
+    def encode_frame(self, frame, quality=70, scale=1.0):
+        """直接编码截图得到的BGRA帧（scale小于1时先缩放），JPEG模式不经过PIL图像"""
+        def encode_jpeg():
+            return {"image": base64.b64encode(self.jpeg.encode(frame, quality, scale)).decode()}
+        if self.mode == "jpeg":
+            return encode_jpeg()
+        return self._smaller(lambda: self._encode_reduced(frame_to_image(self.jpeg.resize(frame, scale))), encode_jpeg)
+
+    def _smaller(self, encode_reduced, encode_jpeg):
+        """定期同时编码两种格式，按体积决定之后的帧发送哪一种"""
+        check = self._frames % JPEG_CHECK_FRAMES == 0
+        self._frames += 1
+        if not check:
+            return encode_jpeg() if self.jpeg_fallback else encode_reduced()
+        fields, jpeg_fields = encode_reduced(), encode_jpeg()
+        self.jpeg_fallback = payload_size(fields) > payload_size(jpeg_fields)
+        return jpeg_fields if self.jpeg_fallback else fields
+
+    @staticmethod
+    def _encode_jpeg(image, quality):
+        img_byte_arr = io.BytesIO()
+        image.save(img_byte_arr, format='JPEG', quality=quality)
+        return {"image": base64.b64encode(img_byte_arr.getvalue()).decode()}
+
+    def _encode_reduced(self, image):
+        """按非JPEG色彩模式编码"""
+        rgb = np.asarray(image)
+        fields = {"encoding": self.mode, "size": [image.width, image.height]}
+        if self.mode == "yuv420":
+            planes = rgb_to_yuv420(rgb)
+            fields["data"] = zlib.compress(b"".join(p.tobytes() for p in planes), ZLIB_LEVEL)
+        elif self.mode == "rgb565":
+            fields["data"] = zlib.compress(rgb_to_rgb565(rgb).astype("<u2").tobytes(), ZLIB_LEVEL)
+        else:
+            indexed = self._quantize(image)
+            fields["palette"] = bytes(indexed.getpalette()[:768])
+            fields["data"] = zlib.compress(np.asarray(indexed).tobytes(), ZLIB_LEVEL)
+        return fields
+
+    def _quantize(self, image):
+        """映射到自适应调色板，调色板定期重算，其余帧直接复用"""
+        if self._palette_image is None or self._palette_age >= PALETTE_REFRESH_FRAMES:
+            self._palette_image = image.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+            self._palette_age = 0
+            return self._palette_image
+        self._palette_age += 1
+        return image.quantize(palette=self._palette_image, dither=Image.Dither.NONE)
+
+def payload_size(fields):
+    """画面字段的有效载荷字节数（base64按解码后的长度计）"""
+    if "image" in fields:
+        return len(fields["image"]) * 3 // 4
+    return len(fields["data"]) + len(fields.get("palette", b""))
+
+def decode_image(data):
+    """把screen消息中的画面字段解码为PIL RGB图像"""
+    encoding = data.get("encoding", "jpeg")
+    if encoding == "jpeg":
+        return Image.open(io.BytesIO(base64.b64decode(data["image"])))
+
+    width, height = data["size"]
+    raw = zlib.decompress(data["data"])
+    if encoding == "yuv420":
+        cw, ch = (width + 1) // 2, (height + 1) // 2
+        y = np.frombuffer(raw, dtype=np.uint8, count=width * height).reshape(height, width)
+        u = np.frombuffer(raw, dtype=np.uint8, count=cw * ch, offset=width * height).reshape(ch, cw)
+        v = np.frombuffer(raw, dtype=np.uint8, count=cw * ch, offset=width * height + cw * ch).reshape(ch, cw)
+        rgb = yuv420_to_rgb(y, u, v)
+    elif encoding == "rgb565":
+        rgb = rgb565_to_rgb(np.frombuffer(raw, dtype="<u2").reshape(height, width))
+    elif encoding == "palette":
+        palette = np.frombuffer(data["palette"], dtype=np.uint8).reshape(-1, 3)
+        indices = np.frombuffer(raw, dtype=np.uint8).reshape(height, width)
+        rgb = palette[indices]
+    else:
+        raise ValueError(f"未知的色彩模式: {encoding}")
+    return Image.fromarray(rgb, "RGB")
@@ -3,29 +3,54 @@
 用于存储和管理系统配置
 """
 import os
+import copy
 import json
+import time
+import atexit
 import getpass
+import tempfile
+import threading
 from pathlib import Path
 
+# 修改后延迟写回的时间（秒），期间的多次修改合并为一次写入
+SAVE_DELAY = 0.5
+# 监视配置文件外部修改的轮询间隔（秒）
+POLL_INTERVAL = 1.0
+
 # 默认配置
 DEFAULT_CONFIG = {
     # 服务端配置
     "server": {
         "port": 5555,
         "screen_quality": 70,
+        "jpeg_encoder": "auto",  # JPEG编码后端: auto / turbojpeg / cv2 / pil
+        "jpeg_subsampling": "420",  # 色度抽样: 420 / 422 / 444（444文字边缘更清晰，体积更大）
+        "frame_rate": 10,
+        "max_frame_rate": 30,
+        "capture_process": False,  # 截图编码放到独立进程，避免与输入处理争抢GIL
+        "udp_video": True,  # 客户端支持时画面经UDP发送，避免丢包时TCP重传阻塞整个画面流
         "allow_clipboard": True,
         "allow_file_transfer": False,
         "encryption_enabled": True,
         "password_protected": False,
         "password": "",
-        "allowed_ip_list": [],
+        "kdf_n": 32768,  # 密码KDF(scrypt)成本参数，必须是2的幂，越大越安全也越耗时
+        "allowed_ip_list": [],  # 支持CIDR，如 "192.168.1.0/24"，为空时不限制
+        "max_sessions": 10,  # 已认证会话数上限
+        "max_pending": 32,  # 尚未完成握手的连接数上限
+        "max_pending_per_ip": 2,  # 单个IP尚未完成握手的连接数上限
+        "connect_rate": 2.0,  # 单个IP每秒允许的新连接数
+        "connect_burst": 5,
         "enable_logging": True,
+        "allow_profiling": False,  # 允许客户端发起采样性能分析
+        "profile_dir": "",  # 性能分析结果目录，为空时使用配置目录下的profiles
     },
     
     # 客户端配置
     "client": {
         "recent_connections": [],
         "auto_reconnect": True,
+        "udp_video": False,  # 请求服务端经UDP发送画面，UDP不通时自动回退到TCP
         "default_quality": 70,
         "enable_fullscreen": True,
         "show_status_bar": True,
@@ -56,66 +81,213 @@ def get_config_file(mode='server'):
     else:
         return os.path.join(config_dir, 'client_config.json')
 
-def load_config(mode='server'):
-    """加载配置"""
-    config_file = get_config_file(mode)
-    
-    # 如果配置文件不存在，创建默认配置
-    if not os.path.exists(config_file):
-        save_config(DEFAULT_CONFIG[mode], mode)
-        return DEFAULT_CONFIG[mode].copy()
-    
-    try:
-        with open(config_file, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-        
+class ConfigStore:
+    """内存配置存储
+
+    配置只在首次使用时从磁盘解析一次，之后的读取都走内存。修改先作用于内存，
+    再由后台定时器合并多次修改后原子写回（临时文件 + 重命名）。watch() 启动
+    后会按文件修改时间轮询外部修改，并通知订阅者变化的配置项。
+    """
+
+    def __init__(self, mode='server', save_delay=SAVE_DELAY, poll_interval=POLL_INTERVAL):
+        self.mode = mode
+        self.path = get_config_file(mode)
+        self.save_delay = save_delay
+        self.poll_interval = poll_interval
+        self.subscribers = []
+        self._lock = threading.RLock()
+        self._save_timer = None
+        self._mtime = None
+        self._watching = False
+        config = self._read()
+        self._config = config if config is not None else copy.deepcopy(DEFAULT_CONFIG[mode])
+
+    def _read(self):
+        """从磁盘读取配置并补全默认项，文件不存在时写入默认配置
+
+        文件损坏或只写了一半（编辑器保存中、写入被截断）时返回None，由调用方保留现有配置。
+        """
+        config = copy.deepcopy(DEFAULT_CONFIG[self.mode])
+        if not os.path.exists(self.path):
+            self._write(config)
+            return config
+
+        try:
+            # 先记录修改时间，同一个损坏的文件只报告一次错误
+            self._mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                loaded = json.load(f)
+            if not isinstance(loaded, dict):
+                raise ValueError("配置文件内容不是JSON对象")
+        except Exception as e:
+            print(f"加载配置文件出错: {e}")
+            return None
         # 确保所有默认配置项都存在
-        default = DEFAULT_CONFIG[mode].copy()
-        for key, value in default.items():
-            if key not in config:
-                config[key] = value
-                
+        config.update(loaded)
         return config
-    except Exception as e:
-        print(f"加载配置文件出错: {e}")
-        return DEFAULT_CONFIG[mode].copy()
+
+    def _write(self, config):
+        """原子写入配置文件"""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(config, f, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            # 记录自身写入后的修改时间，避免被当作外部修改重新加载
+            self._mtime = os.path.getmtime(self.path)
+            return True
+        except Exception as e:
+            print(f"保存配置文件出错: {e}")
+            return False
+
+    def snapshot(self):
+        """返回当前配置的副本"""
+        with self._lock:
+            return copy.deepcopy(self._config)
+
+    def get(self, key, default=None):
+        """读取配置项"""
+        with self._lock:
+            return copy.deepcopy(self._config.get(key, default))
+
+    def get_int(self, key, default=0):
+        """读取整数配置项，类型不符时返回默认值"""
+        try:
+            return int(self.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_bool(self, key, default=False):
+        """读取布尔配置项"""
+        value = self.get(key, default)
+        return value if isinstance(value, bool) else default
+
+    def get_list(self, key, default=None):
+        """读取列表配置项"""
+        value = self.get(key, default)
+        return value if isinstance(value, list) else list(default or [])
+
+    def update(self, updates):
+        """修改配置项，通知订阅者并安排延迟写回"""
+        with self._lock:
+            changed = {k: v for k, v in updates.items() if self._config.get(k) != v}
+            self._config.update(copy.deepcopy(updates))
+            self._schedule_save()
+        if changed:
+            self._notify(changed)
+        return True
+
+    def replace(self, config):
+        """整体替换配置"""
+        with self._lock:
+            removed = [k for k in self._config if k not in config]
+            for key in removed:
+                del self._config[key]
+        return self.update(config)
+
+    def _schedule_save(self):
+        """合并短时间内的多次修改为一次写入（调用方需持有锁）"""
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """立即写回尚未保存的修改"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            return self._write(self._config)
+
+    def subscribe(self, callback):
+        """订阅配置变化，callback接收 {配置项: 新值}"""
+        self.subscribers.append(callback)
+
+    def _notify(self, changed):
+        """通知订阅者"""
+        for callback in list(self.subscribers):
+            try:
+                callback(copy.deepcopy(changed))
+            except Exception as e:
+                print(f"应用配置变化出错: {e}")
+
+    def watch(self):
+        """启动后台线程监视配置文件的外部修改"""
+        if self._watching:
+            return
+        self._watching = True
+        thread = threading.Thread(target=self._watch_loop)
+        thread.daemon = True
+        thread.start()
+
+    def _watch_loop(self):
+        """按修改时间轮询配置文件，发生外部修改时重新加载"""
+        while self._watching:
+            time.sleep(self.poll_interval)
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                continue
+            if mtime == self._mtime:
+                continue
+
+            config = self._read()
+            if config is None:
+                # 文件无法解析时保留内存中的配置，不能退回默认值（会关闭密码验证和IP白名单）
+                continue
+            with self._lock:
+                changed = {k: v for k, v in config.items() if self._config.get(k) != v}
+                self._config = config
+            if changed:
+                self._notify(changed)
+
+    def stop_watching(self):
+        """停止监视"""
+        self._watching = False
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_config_store(mode='server'):
+    """获取指定模式的配置存储（进程内单例）"""
+    with _stores_lock:
+        if mode not in _stores:
+            _stores[mode] = ConfigStore(mode)
+        return _stores[mode]
+
+@atexit.register
+def _flush_stores():
+    """退出时写回尚未保存的修改"""
+    for store in list(_stores.values()):
+        if store._save_timer is not None:
+            store.flush()
+
+def load_config(mode='server'):
+    """加载配置（返回内存配置的副本）"""
+    return get_config_store(mode).snapshot()
 
 def save_config(config, mode='server'):
     """保存配置"""
-    config_file = get_config_file(mode)
-    
-    try:
-        with open(config_file, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=4, ensure_ascii=False)
-        return True
-    except Exception as e:
-        print(f"保存配置文件出错: {e}")
-        return False
+    return get_config_store(mode).replace(config)
 
 def update_config(updates, mode='server'):
     """更新配置的部分内容"""
-    config = load_config(mode)
-    
-    # 更新配置
-    for key, value in updates.items():
-        config[key] = value
-    
-    # 保存更新后的配置
-    return save_config(config, mode)
+    return get_config_store(mode).update(updates)
 
 def add_recent_connection(host, port):
     """添加最近连接到客户端配置"""
-    config = load_config('client')
+    store = get_config_store('client')
     
     # 连接信息
     connection = {
         "host": host,
         "port": port,
-        "last_connected": import_time().strftime("%Y-%m-%d %H:%M:%S")
+        "last_connected": import_time().datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
     
     # 检查是否已经存在
-    recent = config.get('recent_connections', [])
+    recent = store.get_list('recent_connections')
     for i, conn in enumerate(recent):
         if conn.get('host') == host and conn.get('port') == port:
             # 移除旧记录
@@ -125,11 +297,8 @@ def add_recent_connection(host, port):
     # 添加到最前面
     recent.insert(0, connection)
     
-    # 保留最近10个连接
-    config['recent_connections'] = recent[:10]
-    
-    # 保存配置
-    save_config(config, 'client')
+    # 保留最近10个连接，延迟写回
+    store.update({'recent_connections': recent[:10]})
 
 def import_time():
     """导入时间模块"""
@@ -0,0 +1,345 @@
+"""
+远程桌面控制系统 - UDP画面传输模块
+画面以图块为单位经UDP发送，不受TCP队头阻塞影响：图块按大小分片打包成不超过MTU的数据报，
+每个数据报用会话密钥派生的ChaCha20-Poly1305加密认证，每组分片附带一个异或校验包可恢复单个丢包。
+服务端按图块记录客户端已确认显示的内容，丢失的图块在下一帧自动重发。输入和控制消息仍走TCP。
+"""
+import os
+import io
+import time
+import pickle
+import socket
+import struct
+import threading
+
+import numpy as np
+from PIL import Image
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+DATAGRAM_MTU = 1200  # 每个数据报的最大字节数，低于常见路径MTU，避免IP分片
+HEADER = struct.Struct(">BIHHBBI")  # 类型、分片组序号、分片序号、数据分片数、校验组大小、是否校验包、总长度
+TAG_SIZE = 16
+FRAGMENT_SIZE = DATAGRAM_MTU - HEADER.size - TAG_SIZE
+FEC_GROUP = 8  # 每8个数据分片附带1个异或校验分片
+SLICE_BYTES = 32 * 1024  # 每个分片组最多包含的图块字节数，组越小丢包影响的图块越少
+SLICE_TIMEOUT = 1.0  # 未收齐的分片组保留时间（秒）
+RESEND_TIMEOUT = 0.25  # 已发送但未确认的图块超过该时间后重发（秒）
+PROBE_INTERVAL = 0.2
+PROBE_TIMEOUT = 2.0  # 服务端等待客户端UDP探测包的时间，超时回退到TCP
+ACK_TIMEOUT = 3.0  # 有未确认图块且这么久没有收到任何确认时，认为UDP不通，回退到TCP
+
+PACKET_DATA = 1
+PACKET_PROBE = 2
+DIRECTION_SERVER = 0
+DIRECTION_CLIENT = 1
+
+def datagram_key(session_key):
+    """从TCP握手的会话密钥派生UDP加密密钥"""
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"datagram").derive(session_key)
+
+def nonce(direction, parity, index, seq):
+    """每个数据报唯一的随机数：方向、是否校验包、分片序号、分片组序号"""
+    return struct.pack(">BBHI4x", direction, parity, index, seq)
+
+def xor_fragments(fragments):
+    """把多个分片补齐到相同长度后逐字节异或"""
+    buffer = np.zeros(FRAGMENT_SIZE, dtype=np.uint8)
+    for fragment in fragments:
+        buffer[:len(fragment)] ^= np.frombuffer(fragment, dtype=np.uint8)
+    return buffer.tobytes()
+
+def packetize(aead, seq, payload):
+    """把一个分片组的数据切成数据报，每FEC_GROUP个数据分片后附加一个异或校验包"""
+    fragments = [payload[i:i + FRAGMENT_SIZE] for i in range(0, len(payload), FRAGMENT_SIZE)] or [b""]
+    count = len(fragments)
+    packets = []
+    for index, fragment in enumerate(fragments):
+        header = HEADER.pack(PACKET_DATA, seq, index, count, FEC_GROUP, 0, len(payload))
+        packets.append(header + aead.encrypt(nonce(DIRECTION_SERVER, 0, index, seq), fragment, header))
+    if count > 1:
+        for group, start in enumerate(range(0, count, FEC_GROUP)):
+            parity = xor_fragments(fragments[start:start + FEC_GROUP])
+            header = HEADER.pack(PACKET_DATA, seq, group, count, FEC_GROUP, 1, len(payload))
+            packets.append(header + aead.encrypt(nonce(DIRECTION_SERVER, 1, group, seq), parity, header))
+    return packets
+
+class DatagramStream:
+    """服务端UDP画面流（每个客户端一个）
+
+    client_view 保存客户端已确认显示的画面，只有与之不同的图块才需要发送；
+    已发送未确认的图块在内容再次变化或超时后重发，确认按图块记录最新的序号，乱序确认不会回退。
+    """
+
+    def __init__(self, session_key, host="0.0.0.0", tile=64):
+        self.aead = ChaCha20Poly1305(datagram_key(session_key))
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, 0))
+        self.port = self.socket.getsockname()[1]
+        self.tile = tile
+        self.peer = None
+        self.seq = 0
+        self.key = None
+        self.pending = {}  # 分片组序号 -> [(行, 列, 图块像素副本)]
+        self.bytes_sent = 0
+        self.resent_tiles = 0
+        self.last_ack = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait_for_peer(self, timeout=PROBE_TIMEOUT):
+        """等待客户端的探测包以确定其UDP地址（可穿过NAT），超时返回False"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.socket.settimeout(max(0.01, deadline - time.monotonic()))
+            try:
+                data, address = self.socket.recvfrom(DATAGRAM_MTU)
+            except socket.timeout:
+                break
+            except OSError:
+                return False
+            if len(data) < HEADER.size:
+                continue
+            header = data[:HEADER.size]
+            kind, seq, index, _, _, _, _ = HEADER.unpack(header)
+            if kind != PACKET_PROBE:
+                continue
+            try:
+                self.aead.decrypt(nonce(DIRECTION_CLIENT, 0, index, seq), data[HEADER.size:], header)
+            except InvalidTag:
+                continue
+            self.peer = address
+            self.last_ack = time.monotonic()
+            return True
+        return False
+
+    def _reset(self, key, shape):
+        """可见区域、缩放或画质变化时客户端画面需整体重建"""
+        rows, cols = -(-shape[0] // self.tile), -(-shape[1] // self.tile)
+        self.key = key
+        self.client_view = np.zeros(shape, dtype=np.uint8)
+        self.known = np.zeros((rows, cols), dtype=bool)  # 客户端是否已确认显示该图块
+        self.acked_seq = np.zeros((rows, cols), dtype=np.int64)
+        self.sent_seq = np.zeros((rows, cols), dtype=np.int64)  # 0表示没有在途的图块
+        self.sent_at = np.zeros((rows, cols), dtype=np.float64)
+        self.sent_view = np.zeros(shape, dtype=np.uint8)  # 在途图块发送时的内容
+        self.pending.clear()
+
+    def _tile_mask(self, a, b):
+        """两帧之间内容不同的图块"""
+        height, width = a.shape[:2]
+        diff = a.view(np.uint32)[..., 0] != b.view(np.uint32)[..., 0]
+        mask = np.logical_or.reduceat(diff, np.arange(0, height, self.tile), axis=0)
+        return np.logical_or.reduceat(mask, np.arange(0, width, self.tile), axis=1)
+
+    def send_frame(self, frame, region, scale, quality, encode_tile):
+        """发送与客户端画面不同且没有在途的图块，返回发送的图块数
+
+        encode_tile(block) 返回图块像素的编码字节。
+        """
+        now = time.monotonic()
+        with self._lock:
+            key = (tuple(region), scale, quality)
+            if self.key != key or self.client_view.shape != frame.shape:
+                self._reset(key, frame.shape)
+            stale = ~self.known | self._tile_mask(self.client_view, frame)
+            inflight = self.sent_seq > 0
+            # 在途图块内容未变且未超时时不重复发送
+            waiting = inflight & ~self._tile_mask(self.sent_view, frame) & (now - self.sent_at < RESEND_TIMEOUT)
+            rows, cols = np.nonzero(stale & ~waiting)
+            self.resent_tiles += int((inflight[rows, cols]).sum())
+
+        slices, current, size = [], [], 0
+        height, width = frame.shape[:2]
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            x, y = col * self.tile, row * self.tile
+            w, h = min(self.tile, width - x), min(self.tile, height - y)
+            data = encode_tile(frame[y:y + h, x:x + w])
+            current.append((row, col, x, y, w, h, data))
+            size += len(data)
+            if size >= SLICE_BYTES:
+                slices.append(current)
+                current, size = [], 0
+        if current:
+            slices.append(current)
+
+        for tiles in slices:
+            with self._lock:
+                self.seq += 1
+                seq = self.seq
+                saved = []
+                for row, col, x, y, w, h, _ in tiles:
+                    block = frame[y:y + h, x:x + w]
+                    self.sent_view[y:y + h, x:x + w] = block
+                    self.sent_seq[row, col] = seq
+                    self.sent_at[row, col] = now
+                    saved.append((row, col, block.copy()))
+                self.pending[seq] = saved
+                # 长时间未确认的分片组视为丢失，对应图块已由超时重发覆盖
+                for old in [s for s in self.pending if s < seq - 256]:
+                    del self.pending[old]
+            message = {"seq": seq, "region": list(region), "scale": scale,
+                       "tiles": [[x, y, w, h, data] for _, _, x, y, w, h, data in tiles]}
+            for packet in packetize(self.aead, seq, pickle.dumps(message)):
+                self.socket.sendto(packet, self.peer)
+                self.bytes_sent += len(packet)
+        return len(rows)
+
+    def inflight(self):
+        """是否还有已发送未确认的图块"""
+        with self._lock:
+            return self.key is not None and bool((self.sent_seq > 0).any())
+
+    def stalled(self):
+        """有未确认的图块且长时间没有收到任何确认"""
+        return self.inflight() and time.monotonic() - self.last_ack > ACK_TIMEOUT
+
+    def acknowledge(self, seq):
+        """客户端已显示某个分片组，更新其中每个图块的已确认内容"""
+        with self._lock:
+            self.last_ack = time.monotonic()
+            saved = self.pending.pop(seq, None)
+            if saved is None:
+                return
+            for row, col, block in saved:
+                if self.acked_seq[row, col] >= seq:
+                    continue
+                y, x = row * self.tile, col * self.tile
+                self.client_view[y:y + block.shape[0], x:x + block.shape[1]] = block
+                self.acked_seq[row, col] = seq
+                self.known[row, col] = True
+                if self.sent_seq[row, col] == seq:
+                    self.sent_seq[row, col] = 0
+
+    def stats(self):
+        with self._lock:
+            return {"peer": self.peer, "slices": self.seq, "pending": len(self.pending),
+                    "bytes_sent": self.bytes_sent, "resent_tiles": self.resent_tiles}
+
+    def close(self):
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+class DatagramReceiver:
+    """客户端UDP画面接收：发送探测包、重组分片组（必要时用异或校验恢复）并回调完整的消息
+
+    on_slice(message) 在接收线程中调用，消息中的图块数据为JPEG字节。
+    """
+
+    def __init__(self, session_key, server_address, on_slice):
+        self.aead = ChaCha20Poly1305(datagram_key(session_key))
+        self.server_address = server_address
+        self.on_slice = on_slice
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("0.0.0.0", 0))
+        self.running = False
+        self.active = False  # 收到第一个画面数据报后为True
+        self.slices = {}  # 序号 -> 重组状态
+        self.completed = 0
+        self.recovered = 0
+        self.dropped = 0
+        self._done = set()  # 最近完成的序号，忽略之后到达的多余分片（如未用到的校验包）
+        self._probe_seq = int.from_bytes(os.urandom(3), "big")
+
+    def start(self):
+        self.running = True
+        for target in (self._probe, self._receive):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def _probe(self):
+        """在收到画面之前定期发送探测包，让服务端得知本端地址"""
+        deadline = time.monotonic() + PROBE_TIMEOUT
+        while self.running and not self.active and time.monotonic() < deadline:
+            self._probe_seq += 1
+            header = HEADER.pack(PACKET_PROBE, self._probe_seq, 0, 0, 0, 0, 0)
+            packet = header + self.aead.encrypt(nonce(DIRECTION_CLIENT, 0, 0, self._probe_seq), b"probe", header)
+            try:
+                self.socket.sendto(packet, self.server_address)
+            except OSError:
+                break
+            time.sleep(PROBE_INTERVAL)
+
+    def _receive(self):
+        self.socket.settimeout(0.5)
+        while self.running:
+            try:
+                data, _ = self.socket.recvfrom(DATAGRAM_MTU)
+            except socket.timeout:
+                self._expire()
+                continue
+            except OSError:
+                break
+            if len(data) < HEADER.size:
+                continue
+            header = data[:HEADER.size]
+            kind, seq, index, count, group, parity, total = HEADER.unpack(header)
+            if kind != PACKET_DATA:
+                continue
+            try:
+                fragment = self.aead.decrypt(nonce(DIRECTION_SERVER, parity, index, seq), data[HEADER.size:], header)
+            except InvalidTag:
+                continue
+            self.active = True
+            self._add(seq, index, count, group, parity, total, fragment)
+
+    def _add(self, seq, index, count, group, parity, total, fragment):
+        """记录一个分片，收齐或可恢复时组装完整消息"""
+        state = self.slices.get(seq)
+        if state is None:
+            if seq in self._done:
+                return
+            state = self.slices[seq] = {"count": count, "group": group, "total": total,
+                                        "data": {}, "parity": {}, "created": time.monotonic()}
+        (state["parity"] if parity else state["data"])[index] = fragment
+
+        data = state["data"]
+        if len(data) < count:
+            # 每组只缺一个数据分片且校验分片已到时用异或恢复
+            for g, parity_fragment in list(state["parity"].items()):
+                members = range(g * group, min(count, (g + 1) * group))
+                missing = [i for i in members if i not in data]
+                if len(missing) == 1:
+                    lost = missing[0]
+                    size = FRAGMENT_SIZE if lost < count - 1 else total - (count - 1) * FRAGMENT_SIZE
+                    data[lost] = xor_fragments([parity_fragment] + [data[i] for i in members if i != lost])[:size]
+                    self.recovered += 1
+        if len(data) < count:
+            return
+
+        del self.slices[seq]
+        self._remember(seq)
+        payload = b"".join(data[i] for i in range(count))
+        self.completed += 1
+        try:
+            self.on_slice(pickle.loads(payload))
+        except Exception as e:
+            print(f"处理UDP画面出错: {e}")
+
+    def _remember(self, seq):
+        self._done.add(seq)
+        if len(self._done) > 1024:
+            for old in sorted(self._done)[:512]:
+                self._done.discard(old)
+
+    def _expire(self):
+        """丢弃超时未收齐的分片组（其中的图块由服务端在下一帧重发）"""
+        now = time.monotonic()
+        for seq in [s for s, state in self.slices.items() if now - state["created"] > SLICE_TIMEOUT]:
+            del self.slices[seq]
+            self.dropped += 1
+
+    def close(self):
+        self.running = False
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+def decode_tile(data):
+    """解码UDP画面中的JPEG图块"""
+    return Image.open(io.BytesIO(data))
@@ -0,0 +1,255 @@
+"""
+远程桌面控制系统 - 独立截图编码进程
+子进程负责截图、比较和编码，把序列化压缩后的画面消息写入共享内存环形缓冲区；
+主进程的发送线程直接从共享内存读取并加密发送，截图编码不再与接收输入的线程争抢GIL。
+子进程崩溃后由主进程的监督线程自动重启。
+"""
+import time
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from capture import create_capture_backend
+from colormodes import COLOR_MODES, ColorEncoder
+from scheduler import FrameScheduler
+
+RING_SLOTS = 4  # 环形缓冲区槽位数，发送线程落后超过该帧数时直接跳到最新帧
+SLOT_HEADER = 3  # 每个槽位头部: 序号、长度、校验值（各8字节）
+RESTART_DELAY = 0.5
+RESTART_MAX_DELAY = 8.0
+
+class FrameRing:
+    """共享内存中的画面环形缓冲区
+
+    布局: [最新序号][槽位头部 x 槽位数][槽位数据 x 槽位数]。写入时先把槽位序号清零，
+    写完数据和长度后再写入序号并更新最新序号；读取方在复制前后各检查一次槽位序号，
+    不一致说明读取期间被覆盖，丢弃即可（单写多读的序号锁）。
+    """
+
+    def __init__(self, slot_size, slots=RING_SLOTS, name=None, create=True):
+        self.slot_size = slot_size
+        self.slots = slots
+        self._meta_size = 8 * (1 + slots * SLOT_HEADER)
+        size = self._meta_size + slots * slot_size
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self.name = self.shm.name
+        meta = np.ndarray((1 + slots * SLOT_HEADER,), dtype=np.uint64, buffer=self.shm.buf)
+        self._latest = meta[:1]
+        self._headers = meta[1:].reshape(slots, SLOT_HEADER)
+        if create:
+            meta[:] = 0
+
+    @property
+    def latest(self):
+        """最新写入的序号，尚未写入时为0"""
+        return int(self._latest[0])
+
+    def write(self, seq, checksum, payload):
+        """写入一条消息，超过槽位容量时返回False"""
+        size = len(payload)
+        if size > self.slot_size:
+            return False
+        index = seq % self.slots
+        header = self._headers[index]
+        header[0] = 0
+        offset = self._meta_size + index * self.slot_size
+        self.shm.buf[offset:offset + size] = payload
+        header[1] = size
+        header[2] = checksum
+        header[0] = seq
+        self._latest[0] = seq
+        return True
+
+    def read(self, seq):
+        """读取指定序号的消息，返回 (校验值, 数据)，已被覆盖时返回None"""
+        index = seq % self.slots
+        header = self._headers[index]
+        if int(header[0]) != seq:
+            return None
+        size, checksum = int(header[1]), int(header[2])
+        offset = self._meta_size + index * self.slot_size
+        payload = bytes(self.shm.buf[offset:offset + size])
+        if int(header[0]) != seq:
+            return None
+        return checksum, payload
+
+    def close(self, unlink=False):
+        """释放共享内存（创建方负责unlink）"""
+        # 先释放引用共享内存的数组，否则close会因缓冲区仍被导出而失败
+        self._latest = None
+        self._headers = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+def run_encoder(ring_name, slot_size, capture_backend, settings, notify, input_event, stop_event):
+    """子进程入口：截全屏，画面变化时编码并写入环形缓冲区，再通过管道通知新序号"""
+    from utils import serialize_message
+
+    ring = FrameRing(slot_size, name=ring_name, create=False)
+    capture = create_capture_backend(capture_backend)
+    width, height = capture.screen_size
+    scheduler = FrameScheduler()
+    previous = np.empty((height, width, 4), dtype=np.uint8)
+    previous_key = None
+    seq = ring.latest
+
+    def watch_input():
+        # 主进程收到输入事件时置位，唤醒调度器提高帧率
+        while not stop_event.is_set():
+            if input_event.wait(0.5):
+                input_event.clear()
+                scheduler.notify_input()
+
+    watcher = threading.Thread(target=watch_input)
+    watcher.daemon = True
+    watcher.start()
+
+    encoder = None
+    try:
+        while not stop_event.is_set():
+            quality, frame_rate, max_frame_rate, mode_index = settings[:]
+            scheduler.configure(frame_rate, max_frame_rate)
+            mode = COLOR_MODES[mode_index]
+            if encoder is None or encoder.mode != mode:
+                encoder = ColorEncoder(mode)
+
+            frame = capture.grab()
+            key = (quality, mode)
+            changed = key != previous_key or not np.array_equal(frame, previous)
+            if changed:
+                np.copyto(previous, frame)
+                previous_key = key
+                seq += 1
+                message = {"type": "screen", "seq": seq, "region": [0, 0, width, height], "scale": 1.0}
+                message.update(encoder.encode_frame(frame, quality))
+                checksum, payload = serialize_message(message)
+                if ring.write(seq, checksum, payload):
+                    notify.send(seq)
+                else:
+                    print(f"画面消息 {len(payload)} 字节超过共享内存槽位容量，已丢弃")
+
+            scheduler.frame_done(changed)
+            scheduler.wait()
+    except (KeyboardInterrupt, BrokenPipeError, EOFError):
+        pass
+    finally:
+        capture.close()
+        ring.close()
+
+class FramePipeline:
+    """主进程中的截图编码进程监督者
+
+    负责创建共享内存、启动和重启子进程，并把子进程通知的新序号分发给各发送线程。
+    画质、帧率和色彩模式对所有客户端统一生效（与单进程模式下的全局画质一致）。
+    """
+
+    def __init__(self, capture_backend, screen_size, quality=70, frame_rate=10, max_frame_rate=30):
+        self.capture_backend = capture_backend
+        width, height = screen_size
+        # 最坏情况按未压缩的RGB565估算，再留出消息字段的余量
+        self.slot_size = width * height * 4 + 65536
+        self._context = multiprocessing.get_context("spawn")
+        self.settings = self._context.Array("i", [quality, frame_rate, max_frame_rate, 0], lock=False)
+        self.input_event = self._context.Event()
+        self.stop_event = self._context.Event()
+        self.ring = None
+        self.process = None
+        self.restarts = 0
+        self.latest = 0
+        self.running = False
+        self._condition = threading.Condition()
+
+    def start(self):
+        """创建共享内存并启动子进程和监督线程"""
+        self.ring = FrameRing(self.slot_size)
+        self.running = True
+        thread = threading.Thread(target=self._supervise)
+        thread.daemon = True
+        thread.start()
+
+    def configure(self, quality=None, frame_rate=None, max_frame_rate=None, color_mode=None):
+        """更新编码参数，子进程在下一帧读取"""
+        if quality is not None:
+            self.settings[0] = int(quality)
+        if frame_rate is not None:
+            self.settings[1] = int(frame_rate)
+        if max_frame_rate is not None:
+            self.settings[2] = int(max_frame_rate)
+        if color_mode in COLOR_MODES:
+            self.settings[3] = COLOR_MODES.index(color_mode)
+
+    def notify_input(self):
+        """输入事件预示画面即将变化"""
+        self.input_event.set()
+
+    def _spawn(self):
+        """启动子进程，返回接收序号通知的管道端"""
+        receiver, sender = self._context.Pipe(duplex=False)
+        self.process = self._context.Process(
+            target=run_encoder,
+            args=(self.ring.name, self.slot_size, self.capture_backend, self.settings,
+                  sender, self.input_event, self.stop_event),
+            daemon=True
+        )
+        self.process.start()
+        sender.close()
+        return receiver
+
+    def _supervise(self):
+        """转发子进程的序号通知；子进程退出时按指数退避重启"""
+        delay = RESTART_DELAY
+        while self.running:
+            receiver = self._spawn()
+            started = time.monotonic()
+            try:
+                while self.running:
+                    if not receiver.poll(1.0):
+                        continue
+                    seq = receiver.recv()
+                    with self._condition:
+                        self.latest = seq
+                        self._condition.notify_all()
+            except (EOFError, OSError):
+                pass
+            finally:
+                receiver.close()
+
+            if not self.running:
+                break
+            self.process.join(timeout=1.0)
+            self.restarts += 1
+            print(f"截图编码进程退出（退出码 {self.process.exitcode}），{delay:.1f}秒后重启")
+            # 稳定运行一段时间后再崩溃时重置退避
+            if time.monotonic() - started > RESTART_MAX_DELAY * 4:
+                delay = RESTART_DELAY
+            time.sleep(delay)
+            delay = min(delay * 2, RESTART_MAX_DELAY)
+
+    def wait_frame(self, last_seq, timeout=1.0):
+        """等待比last_seq更新的画面，返回最新序号，超时返回None"""
+        with self._condition:
+            if self._condition.wait_for(lambda: self.latest > last_seq or not self.running, timeout):
+                return self.latest if self.running else None
+        return None
+
+    def read(self, seq):
+        """从共享内存读取画面消息，返回 (校验值, 数据)，已被覆盖时返回None"""
+        return self.ring.read(seq)
+
+    def stop(self):
+        """停止子进程并释放共享内存"""
+        if not self.running:
+            return
+        self.running = False
+        self.stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self.process is not None:
+            self.process.join(timeout=2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(timeout=1.0)
+        self.ring.close(unlink=True)
@@ -0,0 +1,297 @@
+"""
+远程桌面控制系统 - 握手模块
+X25519密钥交换 + 基于密码的双向认证，为每个连接派生独立会话密钥，
+并签发恢复票据，重连时跳过密钥交换和耗时的密码KDF
+"""
+import base64
+import binascii
+import hmac
+import os
+import json
+import time
+import hashlib
+import threading
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+# 密码KDF（scrypt）默认参数，n越大越耗时，可通过服务端配置调整
+DEFAULT_KDF_PARAMS = {"n": 2 ** 15, "r": 8, "p": 1}
+# 客户端接受的KDF参数范围：n过小时截获一次握手即可离线快速猜测密码，过大时耗尽客户端内存和CPU
+KDF_N_RANGE = (2 ** 14, 2 ** 18)
+KDF_R = 8
+KDF_P = 1
+# 恢复票据有效期（秒）
+TICKET_LIFETIME = 3600
+HANDSHAKE_TIMEOUT = 10.0
+# 服务端完成整个握手的时限（秒），未认证的连接不能长时间占用名额
+PREAUTH_TIMEOUT = 5.0
+NONCE_SIZE = 16
+
+class HandshakeError(Exception):
+    """握手失败（认证失败、票据无效或消息格式错误）"""
+
+def derive_password_key(password, salt, params):
+    """用scrypt从密码派生32字节密钥，未设置密码时返回空字节"""
+    if not password:
+        return b""
+    kdf = Scrypt(salt=salt, length=32, n=params["n"], r=params["r"], p=params["p"])
+    return kdf.derive(password.encode("utf-8"))
+
+def check_kdf_params(params):
+    """检查KDF参数是否在允许范围内，返回规范化的参数，不合法时抛出HandshakeError"""
+    try:
+        n, r, p = int(params["n"]), int(params["r"]), int(params["p"])
+    except (KeyError, TypeError, ValueError):
+        raise HandshakeError("KDF参数无效")
+    if not KDF_N_RANGE[0] <= n <= KDF_N_RANGE[1] or n & (n - 1) or r != KDF_R or p != KDF_P:
+        raise HandshakeError(f"KDF参数超出允许范围: n={n} r={r} p={p}")
+    return {"n": n, "r": r, "p": p}
+
+def hkdf(secret, info):
+    """从共享秘密派生32字节密钥"""
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(secret)
+
+def transcript(*parts):
+    """握手记录摘要，绑定双方公钥和随机数，防止消息被替换"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(len(part).to_bytes(4, "big"))
+        digest.update(part)
+    return digest.digest()
+
+def finished_mac(session_key, label, record):
+    """握手完成校验值，证明持有相同的会话密钥"""
+    return hmac.new(session_key, label + record, hashlib.sha256).digest()
+
+def public_bytes(private_key):
+    """X25519公钥的原始字节"""
+    return private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+
+def expect(data, msg_type):
+    """检查握手消息类型"""
+    if not data or data.get("type") != msg_type:
+        raise HandshakeError(f"期望握手消息 {msg_type}，收到 {data.get('type') if data else None}")
+    return data
+
+# 握手消息中的字节字段，JSON编码时转为base64
+BYTES_FIELDS = ("public_key", "nonce", "salt", "mac", "ticket")
+
+def send_message(sock, message):
+    """发送握手消息
+
+    握手完成前双方都未经认证，消息用JSON编码而不是pickle，避免反序列化对端构造的数据时执行任意代码。
+    """
+    sock.send_json({key: base64.b64encode(value).decode("ascii") if key in BYTES_FIELDS and value is not None else value
+                    for key, value in message.items()})
+
+def decode_message(data, msg_type):
+    """检查握手消息类型并还原字节字段"""
+    message = dict(expect(data, msg_type))
+    for field in BYTES_FIELDS:
+        value = message.get(field)
+        if value is None:
+            continue
+        try:
+            message[field] = base64.b64decode(value, validate=True)
+        except (binascii.Error, TypeError, ValueError):
+            raise HandshakeError(f"握手消息字段 {field} 无效")
+    return message
+
+def receive_message(sock, msg_type, timeout, deadline=None):
+    """接收并解码握手消息"""
+    return decode_message(sock.receive_json(timeout, deadline), msg_type)
+
+class ServerHandshake:
+    """服务端握手
+
+    密码派生密钥只在启动或密码变化时计算一次；恢复票据用进程内随机密钥加密，
+    服务端重启或密码变化（包括开关密码保护）后换用新密钥，旧票据自动失效，客户端回退到完整握手。
+    票据记录最初完整握手的时间，恢复时签发的新票据沿用该时间，有效期不会因续签延长。
+    """
+
+    def __init__(self, password="", kdf_params=None, ticket_lifetime=TICKET_LIFETIME):
+        self._lock = threading.Lock()
+        self._ticket_fernet = None
+        self._password_digest = None
+        self.ticket_lifetime = ticket_lifetime
+        self.full_handshakes = 0
+        self.resumed_handshakes = 0
+        self.configure(password, kdf_params)
+
+    def configure(self, password="", kdf_params=None):
+        """设置密码和KDF参数（配置热加载时调用），密码变化时吊销已签发的恢复票据"""
+        params = dict(DEFAULT_KDF_PARAMS, **(kdf_params or {}))
+        try:
+            params = check_kdf_params(params)
+        except HandshakeError as e:
+            # 客户端会拒绝范围外的参数，这里退回默认值
+            print(f"{e}，改用默认值")
+            params = dict(DEFAULT_KDF_PARAMS)
+        salt = os.urandom(16)
+        password_key = derive_password_key(password, salt, params)
+        digest = hashlib.sha256(password.encode("utf-8")).digest()
+        with self._lock:
+            self.kdf_params = params
+            self.salt = salt
+            self.password_key = password_key
+            self.password_required = bool(password)
+            if digest != self._password_digest:
+                self._password_digest = digest
+                self._ticket_fernet = Fernet(Fernet.generate_key())
+
+    def perform(self, sock, timeout=PREAUTH_TIMEOUT):
+        """在已连接的安全套接字上完成握手并切换到会话密钥，超过timeout秒未完成时抛出超时"""
+        deadline = time.monotonic() + timeout
+        hello = receive_message(sock, "client_hello", timeout, deadline)
+        client_nonce = hello["nonce"]
+        server_nonce = os.urandom(NONCE_SIZE)
+
+        with self._lock:
+            ticket_fernet = self._ticket_fernet
+        opened = self._open_ticket(ticket_fernet, hello.get("ticket"))
+        if opened is not None:
+            # 恢复握手：直接由票据中的恢复秘密派生新会话密钥，新票据沿用原票据的签发时间
+            secret, issued_at = opened
+            record = transcript(b"resume", client_nonce, server_nonce)
+            session_key = hkdf(secret, b"session" + record)
+            send_message(sock, {
+                "type": "server_hello",
+                "resumed": True,
+                "nonce": server_nonce,
+                "mac": finished_mac(session_key, b"server", record),
+                "ticket": self._issue_ticket(ticket_fernet, session_key, issued_at),
+                "ticket_lifetime": self._remaining_lifetime(issued_at)
+            })
+            finish = receive_message(sock, "client_finish", timeout, deadline)
+            if not hmac.compare_digest(finish["mac"], finished_mac(session_key, b"client", record)):
+                raise HandshakeError("恢复握手校验失败")
+            self.resumed_handshakes += 1
+            sock.set_key(session_key)
+            return session_key
+
+        # 完整握手：X25519密钥交换，共享秘密与密码派生密钥一起参与会话密钥派生
+        with self._lock:
+            salt, params, password_key = self.salt, self.kdf_params, self.password_key
+            password_required, ticket_fernet = self.password_required, self._ticket_fernet
+        private_key = X25519PrivateKey.generate()
+        server_public = public_bytes(private_key)
+        client_public = hello["public_key"]
+        shared = private_key.exchange(X25519PublicKey.from_public_bytes(client_public))
+        send_message(sock, {
+            "type": "server_hello",
+            "resumed": False,
+            "public_key": server_public,
+            "nonce": server_nonce,
+            "salt": salt,
+            "kdf": params,
+            "password_required": password_required
+        })
+
+        record = transcript(b"full", client_public, server_public, client_nonce, server_nonce, salt)
+        session_key = hkdf(shared + password_key, b"session" + record)
+        finish = receive_message(sock, "client_finish", timeout, deadline)
+        if not hmac.compare_digest(finish["mac"], finished_mac(session_key, b"client", record)):
+            raise HandshakeError("密码错误或握手校验失败")
+        send_message(sock, {
+            "type": "server_finish",
+            "mac": finished_mac(session_key, b"server", record),
+            "ticket": self._issue_ticket(ticket_fernet, session_key, time.time()),
+            "ticket_lifetime": self.ticket_lifetime
+        })
+        self.full_handshakes += 1
+        sock.set_key(session_key)
+        return session_key
+
+    def _issue_ticket(self, ticket_fernet, session_key, issued_at):
+        """签发恢复票据，票据内容只有服务端能解密
+
+        ticket_fernet 是握手开始时的票据密钥，握手期间密码变化时签发的票据同样失效。
+        """
+        secret = hkdf(session_key, b"resumption")
+        content = {"secret": base64.b64encode(secret).decode("ascii"), "issued_at": issued_at}
+        return ticket_fernet.encrypt(json.dumps(content).encode("utf-8"))
+
+    def _open_ticket(self, ticket_fernet, ticket):
+        """校验票据，有效时返回 (恢复秘密, 最初签发时间)"""
+        if not ticket:
+            return None
+        try:
+            content = json.loads(ticket_fernet.decrypt(ticket, ttl=self.ticket_lifetime))
+            secret, issued_at = base64.b64decode(content["secret"]), float(content["issued_at"])
+        except (InvalidToken, KeyError, TypeError, ValueError, binascii.Error):
+            return None
+        if self._remaining_lifetime(issued_at) <= 0:
+            return None
+        return secret, issued_at
+
+    def _remaining_lifetime(self, issued_at):
+        """从最初签发时间算起的剩余有效期（秒）"""
+        return issued_at + self.ticket_lifetime - time.time()
+
+class ResumptionTicket:
+    """客户端保存的恢复票据"""
+
+    def __init__(self, ticket, secret, lifetime):
+        self.ticket = ticket
+        self.secret = secret
+        self.expires_at = time.time() + lifetime
+
+    def valid(self):
+        """票据是否仍在有效期内"""
+        return time.time() < self.expires_at
+
+def client_handshake(sock, password="", ticket=None):
+    """客户端握手，返回新的恢复票据；成功后套接字已切换到会话密钥"""
+    client_nonce = os.urandom(NONCE_SIZE)
+    private_key = X25519PrivateKey.generate()
+    client_public = public_bytes(private_key)
+    if ticket is not None and not ticket.valid():
+        ticket = None
+    send_message(sock, {
+        "type": "client_hello",
+        "public_key": client_public,
+        "nonce": client_nonce,
+        "ticket": ticket.ticket if ticket else None
+    })
+
+    hello = receive_message(sock, "server_hello", HANDSHAKE_TIMEOUT)
+    server_nonce = hello["nonce"]
+    if hello.get("resumed"):
+        if ticket is None:
+            raise HandshakeError("服务端声明恢复握手，但客户端没有票据")
+        record = transcript(b"resume", client_nonce, server_nonce)
+        session_key = hkdf(ticket.secret, b"session" + record)
+        if not hmac.compare_digest(hello["mac"], finished_mac(session_key, b"server", record)):
+            raise HandshakeError("服务端恢复握手校验失败")
+        send_message(sock, {"type": "client_finish", "mac": finished_mac(session_key, b"client", record)})
+        sock.set_key(session_key)
+        return ResumptionTicket(hello["ticket"], hkdf(session_key, b"resumption"), hello["ticket_lifetime"])
+
+    # 是否混入密码由客户端决定：填写了密码时，声称不需要密码的“服务端”可能是中间人
+    if hello.get("password_required") and not password:
+        raise HandshakeError("服务端要求密码")
+    if password and not hello.get("password_required"):
+        raise HandshakeError("服务端声称不需要密码，可能遭到中间人攻击，已中止连接")
+    server_public = hello["public_key"]
+    shared = private_key.exchange(X25519PublicKey.from_public_bytes(server_public))
+    kdf_params = check_kdf_params(hello["kdf"]) if password else hello["kdf"]
+    password_key = derive_password_key(password, hello["salt"], kdf_params)
+    record = transcript(b"full", client_public, server_public, client_nonce, server_nonce, hello["salt"])
+    session_key = hkdf(shared + password_key, b"session" + record)
+    send_message(sock, {"type": "client_finish", "mac": finished_mac(session_key, b"client", record)})
+
+    finish = sock.receive_json(timeout=HANDSHAKE_TIMEOUT)
+    if not finish:
+        # 服务端校验失败时直接断开
+        raise HandshakeError("密码错误或握手被拒绝")
+    finish = decode_message(finish, "server_finish")
+    if not hmac.compare_digest(finish["mac"], finished_mac(session_key, b"server", record)):
+        raise HandshakeError("服务端握手校验失败")
+    sock.set_key(session_key)
+    return ResumptionTicket(finish["ticket"], hkdf(session_key, b"resumption"), finish["ticket_lifetime"])
@@ -0,0 +1,212 @@
+"""
+远程桌面控制系统 - 输入注入模块
+客户端的键盘和鼠标命令放入队列，由独立的注入线程按分发表调用控制器执行，
+接收循环不会被缓慢的注入调用阻塞；同时统计从客户端发送到完成注入的延迟
+"""
+import time
+import queue
+import threading
+from collections import deque
+
+import numpy as np
+
+# 延迟统计保留的最近样本数
+LATENCY_SAMPLES = 1024
+
+# 由注入引擎处理的输入命令，也是会引起画面变化的命令
+INPUT_COMMANDS = frozenset({
+    "mouse_move", "mouse_click", "mouse_scroll",
+    "keyboard_press", "keyboard_release", "keyboard_type"
+})
+
+class PynputController:
+    """基于pynput的真实控制器，按键名称表和鼠标按键表在创建时预先计算"""
+
+    def __init__(self):
+        from pynput.mouse import Button, Controller as MouseController
+        from pynput.keyboard import Key, Controller as KeyboardController
+
+        self.mouse = MouseController()
+        self.keyboard = KeyboardController()
+        # 用 __members__ 而不是遍历 Key：遍历会跳过别名（如 alt_r 与 alt_gr 在部分平台上同值）
+        self.keys = dict(Key.__members__)
+        self.buttons = {"left": Button.left, "right": Button.right, "middle": Button.middle}
+
+    def move(self, x, y):
+        self.mouse.position = (x, y)
+
+    def click(self, button, clicks):
+        self.mouse.click(button, clicks)
+
+    def scroll(self, dx, dy):
+        self.mouse.scroll(dx, dy)
+
+    def press(self, key):
+        self.keyboard.press(key)
+
+    def release(self, key):
+        self.keyboard.release(key)
+
+    def type(self, text):
+        self.keyboard.type(text)
+
+class RecordingController:
+    """只记录调用的控制器，用于无显示环境下的测试和基准
+
+    delay 模拟单次注入的耗时（秒），用于观察注入缓慢时接收循环是否受影响。
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.keys = {}
+        self.buttons = {"left": "left", "right": "right", "middle": "middle"}
+        self.events = []  # (动作, 参数) 列表
+        self._lock = threading.Lock()
+
+    def _record(self, action, *args):
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            self.events.append((action,) + args)
+
+    def move(self, x, y):
+        self._record("move", x, y)
+
+    def click(self, button, clicks):
+        self._record("click", button, clicks)
+
+    def scroll(self, dx, dy):
+        self._record("scroll", dx, dy)
+
+    def press(self, key):
+        self._record("press", key)
+
+    def release(self, key):
+        self._record("release", key)
+
+    def type(self, text):
+        self._record("type", text)
+
+class InputEngine:
+    """输入注入引擎
+
+    submit() 只把命令和接收时间放入队列，立即返回；注入线程按命令类型查分发表执行。
+    积压时连续的鼠标移动只注入最后一个，按键、点击等不会丢弃。
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self._keys = controller.keys
+        self._buttons = controller.buttons
+        self._default_button = controller.buttons["left"]
+        self.handlers = {
+            "mouse_move": self._mouse_move,
+            "mouse_click": self._mouse_click,
+            "mouse_scroll": self._mouse_scroll,
+            "keyboard_press": self._keyboard_press,
+            "keyboard_release": self._keyboard_release,
+            "keyboard_type": self._keyboard_type
+        }
+        self.queue = queue.Queue()
+        self.injected = 0
+        self.coalesced = 0
+        # 端到端延迟依赖客户端时钟，同机或时钟同步时才有意义；排队延迟只用服务端时钟
+        self.end_to_end = deque(maxlen=LATENCY_SAMPLES)
+        self.queueing = deque(maxlen=LATENCY_SAMPLES)
+        self._thread = None
+
+    def start(self):
+        """启动注入线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """停止注入线程"""
+        if self._thread is None:
+            return
+        self.queue.put(None)
+        self._thread.join(timeout=2.0)
+        self._thread = None
+
+    def submit(self, command):
+        """提交一条输入命令，不等待注入完成"""
+        self.queue.put((command, time.monotonic()))
+
+    def _run(self):
+        """注入线程：每次取出队列中已有的全部命令，合并连续的鼠标移动后依次执行"""
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for index, item in enumerate(batch):
+                if item is None:
+                    return
+                command, received_at = item
+                cmd_type = command.get("type")
+                if cmd_type == "mouse_move" and index + 1 < len(batch):
+                    following = batch[index + 1]
+                    if following is not None and following[0].get("type") == "mouse_move":
+                        self.coalesced += 1
+                        continue
+
+                handler = self.handlers.get(cmd_type)
+                if handler is None:
+                    continue
+                try:
+                    handler(command)
+                except Exception as e:
+                    print(f"注入输入出错: {e}")
+                    continue
+                self._record_latency(command, received_at)
+
+    def _record_latency(self, command, received_at):
+        """记录排队延迟和（客户端带发送时间时的）端到端延迟，单位毫秒"""
+        self.injected += 1
+        self.queueing.append((time.monotonic() - received_at) * 1000)
+        sent_at = command.get("sent_at")
+        if sent_at is not None:
+            self.end_to_end.append((time.time() - sent_at) * 1000)
+
+    def latency_percentiles(self, percentiles=(50, 95, 99)):
+        """最近样本的延迟百分位数（毫秒）"""
+        stats = {"injected": self.injected, "coalesced": self.coalesced}
+        for name, samples in (("end_to_end", self.end_to_end), ("queue", self.queueing)):
+            values = list(samples)
+            if values:
+                stats[name] = dict(zip(percentiles, np.percentile(values, percentiles).tolist()))
+            else:
+                stats[name] = None
+        return stats
+
+    def _mouse_move(self, command):
+        self.controller.move(command.get("x", 0), command.get("y", 0))
+
+    def _mouse_click(self, command):
+        button = self._buttons.get(command.get("button", "left"), self._default_button)
+        self.controller.click(button, command.get("clicks", 1))
+
+    def _mouse_scroll(self, command):
+        self.controller.scroll(command.get("dx", 0), command.get("dy", 0))
+
+    def _keyboard_press(self, command):
+        key = command.get("key", "")
+        if key:
+            # 特殊键查预先计算的表，其余按普通字符注入
+            self.controller.press(self._keys.get(key, key))
+
+    def _keyboard_release(self, command):
+        key = command.get("key", "")
+        if key:
+            self.controller.release(self._keys.get(key, key))
+
+    def _keyboard_type(self, command):
+        text = command.get("text", "")
+        if text:
+            self.controller.type(text)
@@ -0,0 +1,117 @@
+"""
+远程桌面控制系统 - JPEG编码模块
+直接从截图得到的BGRA数组编码JPEG，不经过PIL图像对象和BytesIO：
+优先使用PyTurboJPEG（libjpeg-turbo），编码结果写入复用的输出缓冲区；
+未安装时使用OpenCV自带的libjpeg-turbo，两者都不可用时退回PIL。
+每个发送线程持有一个编码器实例，句柄和缓冲区跨帧复用，不能在线程间共享。
+"""
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+try:
+    import turbojpeg  # 可选依赖
+except ImportError:
+    turbojpeg = None
+
+# 色度抽样方式：420体积最小，444保留文字边缘的颜色细节
+SUBSAMPLING_MODES = ("420", "422", "444")
+DEFAULT_SUBSAMPLING = "420"
+
+_PIL_SUBSAMPLING = {"444": 0, "422": 1, "420": 2}
+_CV2_SUBSAMPLING = {"444": 0x111111, "422": 0x211111, "420": 0x221111}
+
+def _turbojpeg_handle():
+    """创建libjpeg-turbo句柄，库文件缺失时返回None"""
+    if turbojpeg is None:
+        return None
+    try:
+        return turbojpeg.TurboJPEG()
+    except (OSError, RuntimeError):
+        return None
+
+def available_backends():
+    """本机可用的编码后端"""
+    return (["turbojpeg"] if _turbojpeg_handle() is not None else []) + ["cv2", "pil"]
+
+class JpegEncoder:
+    """从BGRA数组编码JPEG，backend 为 auto / turbojpeg / cv2 / pil
+
+    encode() 返回的 memoryview 指向复用的缓冲区，下一次编码前有效，需要保留时调用方自行复制。
+    """
+
+    def __init__(self, backend="auto", subsampling=DEFAULT_SUBSAMPLING):
+        self.subsampling = subsampling if subsampling in SUBSAMPLING_MODES else DEFAULT_SUBSAMPLING
+        self._handle = None
+        if backend in ("auto", "turbojpeg"):
+            self._handle = _turbojpeg_handle()
+            if self._handle is None and backend == "turbojpeg":
+                print("PyTurboJPEG或libjpeg-turbo不可用，改用OpenCV编码")
+        if self._handle is not None:
+            self.name = "turbojpeg"
+        elif backend in ("auto", "turbojpeg", "cv2"):
+            self.name = "cv2"
+        else:
+            self.name = "pil"
+        self._output = None  # turbojpeg输出缓冲区，不够大时按需扩大
+        self._scaled = None  # 缩放结果缓冲区
+        self._bgr = None  # cv2的BGR转换缓冲区
+        self._stream = io.BytesIO()  # PIL的输出流
+
+    def resize(self, frame, scale):
+        """按编码比例缩放BGRA帧，结果写入复用的缓冲区"""
+        if scale >= 1.0:
+            return frame
+        height, width = frame.shape[:2]
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if self._scaled is None or self._scaled.shape[:2] != (size[1], size[0]):
+            self._scaled = np.empty((size[1], size[0], 4), dtype=np.uint8)
+        cv2.resize(frame, size, dst=self._scaled, interpolation=cv2.INTER_LINEAR)
+        return self._scaled
+
+    def encode(self, frame, quality=70, scale=1.0):
+        """编码BGRA帧（可以是整帧中的一块），返回JPEG数据的memoryview"""
+        frame = self.resize(frame, scale)
+        if self.name == "turbojpeg":
+            return self._encode_turbojpeg(np.ascontiguousarray(frame), quality)
+        if self.name == "cv2":
+            return self._encode_cv2(frame, quality)
+        return self._encode_pil(frame, quality)
+
+    def _encode_turbojpeg(self, frame, quality):
+        subsample = getattr(turbojpeg, f"TJSAMP_{self.subsampling}")
+        options = {"quality": quality, "pixel_format": turbojpeg.TJPF_BGRA, "jpeg_subsample": subsample}
+        try:
+            required = self._handle.buffer_size(frame, subsample)
+            if self._output is None or len(self._output) < required:
+                self._output = bytearray(required)
+            _, size = self._handle.encode(frame, dst=self._output, **options)
+        except (AttributeError, TypeError):
+            # 旧版PyTurboJPEG不支持写入调用方的缓冲区
+            return memoryview(self._handle.encode(frame, **options))
+        return memoryview(self._output)[:size]
+
+    def _encode_cv2(self, frame, quality):
+        # OpenCV的JPEG编码只接受BGR，转换到复用的缓冲区
+        height, width = frame.shape[:2]
+        if self._bgr is None or self._bgr.shape[:2] != (height, width):
+            self._bgr = np.empty((height, width, 3), dtype=np.uint8)
+        cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR, dst=self._bgr)
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality),
+                  cv2.IMWRITE_JPEG_SAMPLING_FACTOR, _CV2_SUBSAMPLING[self.subsampling]]
+        ok, encoded = cv2.imencode(".jpg", self._bgr, params)
+        if not ok:
+            raise ValueError("JPEG编码失败")
+        return memoryview(encoded).cast("B")
+
+    def _encode_pil(self, frame, quality):
+        frame = np.ascontiguousarray(frame)
+        height, width = frame.shape[:2]
+        image = Image.frombuffer("RGB", (width, height), frame, "raw", "BGRX", 0, 1)
+        self._stream.seek(0)
+        self._stream.truncate()
+        image.save(self._stream, format="JPEG", quality=quality, subsampling=_PIL_SUBSAMPLING[self.subsampling])
+        # getbuffer()导出的视图未释放前流不能截断，这里复制一份
+        return memoryview(self._stream.getvalue())
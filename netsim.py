@@ -0,0 +1,453 @@
+"""
+远程桌面控制系统 - 网络损伤模拟代理
+在本机客户端和服务端之间转发TCP数据，按链路参数注入延迟、抖动、带宽限制、突发停顿和丢包，
+并记录两个方向的吞吐量轨迹；随机数使用固定种子，同一参数下的链路行为可重复。
+UDP画面流使用 DatagramImpairmentProxy，按同样的链路参数逐个数据报丢弃、延迟和限速
+用法: python netsim.py <服务端地址> <服务端端口> [--port 监听端口] [--profile wan] ...
+"""
+import argparse
+import csv
+import heapq
+import math
+import random
+import socket
+import threading
+import time
+from collections import deque
+
+CHUNK_SIZE = 16384
+BUFFER_LIMIT = 256 * 1024  # 每个方向最多缓存的字节数，超过后停止读取，形成背压
+SEGMENT_SIZE = 1448  # 估算TCP报文段数量用的MSS
+DATAGRAM_SIZE = 65536
+
+class LinkProfile:
+    """单方向链路参数
+
+    delay/jitter 单位毫秒，bandwidth 单位 KB/秒（0表示不限），
+    stall_interval 为两次突发停顿之间的平均间隔（秒，0表示不停顿），stall_duration 为停顿时长（毫秒），
+    loss 为报文丢失率（百分比）。TCP无法在本机真正丢包，按报文段估算数据块中是否有丢失，
+    有丢失时该数据块延后一个重传超时 rto（毫秒）送达，之后的数据随之排队，即队头阻塞。
+    """
+
+    def __init__(self, delay=0.0, jitter=0.0, bandwidth=0.0, stall_interval=0.0, stall_duration=0.0,
+                 loss=0.0, rto=200.0):
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.stall_interval = stall_interval
+        self.stall_duration = stall_duration
+        self.loss = loss
+        self.rto = rto
+
+    def __repr__(self):
+        return (f"LinkProfile(delay={self.delay}, jitter={self.jitter}, bandwidth={self.bandwidth}, "
+                f"stall_interval={self.stall_interval}, stall_duration={self.stall_duration}, "
+                f"loss={self.loss}, rto={self.rto})")
+
+# 常见链路预设，上行与下行相同时两个方向各自独立模拟
+PROFILES = {
+    "lan": LinkProfile(delay=0.5),
+    "wan": LinkProfile(delay=40, jitter=10, bandwidth=2500),
+    "dsl": LinkProfile(delay=25, jitter=5, bandwidth=1000),
+    "4g": LinkProfile(delay=60, jitter=25, bandwidth=1200, stall_interval=5, stall_duration=300),
+    "satellite": LinkProfile(delay=300, jitter=20, bandwidth=600, stall_interval=10, stall_duration=500),
+    "lossy": LinkProfile(delay=40, jitter=10, bandwidth=2500, loss=2),
+}
+
+class ThroughputTrace:
+    """记录一个方向每次送达的时间和字节数"""
+
+    def __init__(self):
+        self.samples = []  # (相对时间秒, 字节数)
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, size):
+        with self._lock:
+            self.samples.append((time.monotonic() - self.start, size))
+
+    def total(self):
+        """累计送达字节数"""
+        with self._lock:
+            return sum(size for _, size in self.samples)
+
+    def series(self, bucket=0.1):
+        """按时间分桶的吞吐量序列，返回 [(桶起始时间, KB/秒)]"""
+        with self._lock:
+            samples = list(self.samples)
+        if not samples:
+            return []
+        counts = [0] * (int(samples[-1][0] / bucket) + 1)
+        for at, size in samples:
+            counts[int(at / bucket)] += size
+        return [(i * bucket, count / 1024 / bucket) for i, count in enumerate(counts)]
+
+class ImpairedPipe:
+    """单方向转发：读取线程给数据块打上到期时间，发送线程按到期时间和带宽送出"""
+
+    def __init__(self, source, destination, profile, trace, rng, on_close):
+        self.source = source
+        self.destination = destination
+        self.profile = profile
+        self.trace = trace
+        # random.Random 不是线程安全的，且两个线程交替取数会使同一种子的结果不可复现，
+        # 因此读取线程（抖动）和发送线程（停顿、丢包）各用一个由 rng 派生的生成器
+        self.reader_rng = random.Random(rng.random())
+        self.writer_rng = random.Random(rng.random())
+        self.on_close = on_close
+        self.chunks = deque()  # (到期时间, 数据)
+        self.buffered = 0
+        self.closed = False
+        self.eof = False
+        self.condition = threading.Condition()
+        self._last_due = 0.0
+        self._link_free = 0.0  # 链路上一个数据块发送完毕的时间
+        self._next_stall = self._schedule_stall(time.monotonic())
+
+    def start(self):
+        for target in (self._reader, self._writer):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def _schedule_stall(self, now):
+        """按指数分布安排下一次突发停顿的时间"""
+        if self.profile.stall_interval <= 0:
+            return None
+        return now + self.writer_rng.expovariate(1.0 / self.profile.stall_interval)
+
+    def _due_time(self, now):
+        """数据块的到期时间：固定延迟加随机抖动，且不早于前一块（TCP不会乱序）"""
+        delay = self.profile.delay
+        if self.profile.jitter:
+            delay = max(0.0, delay + self.reader_rng.uniform(-self.profile.jitter, self.profile.jitter))
+        due = max(now + delay / 1000, self._last_due)
+        self._last_due = due
+        return due
+
+    def _reader(self):
+        try:
+            while not self.closed:
+                data = self.source.recv(CHUNK_SIZE)
+                if not data:
+                    break
+                with self.condition:
+                    while self.buffered >= BUFFER_LIMIT and not self.closed:
+                        self.condition.wait()
+                    self.chunks.append((self._due_time(time.monotonic()), data))
+                    self.buffered += len(data)
+                    self.condition.notify_all()
+        except OSError:
+            pass
+        finally:
+            with self.condition:
+                self.eof = True
+                self.condition.notify_all()
+
+    def _writer(self):
+        try:
+            while not self.closed:
+                with self.condition:
+                    while not self.chunks and not self.eof and not self.closed:
+                        self.condition.wait()
+                    if not self.chunks:
+                        break
+                    due, data = self.chunks.popleft()
+                    self.buffered -= len(data)
+                    self.condition.notify_all()
+
+                send_at = max(due, self._link_free)
+                if self._next_stall is not None and send_at >= self._next_stall:
+                    # 突发停顿：停顿期间链路不发送任何数据
+                    send_at = max(send_at, self._next_stall + self.profile.stall_duration / 1000)
+                    self._next_stall = self._schedule_stall(send_at)
+                if self.profile.loss > 0:
+                    # 数据块中任一报文段丢失都要等重传，且阻塞后面的数据
+                    segments = math.ceil(len(data) / SEGMENT_SIZE)
+                    if self.writer_rng.random() < 1 - (1 - self.profile.loss / 100) ** segments:
+                        send_at += self.profile.rto / 1000
+                if self.profile.bandwidth > 0:
+                    # 按带宽计算串行化时间，数据块发送完毕后才算送达
+                    send_at += len(data) / (self.profile.bandwidth * 1024)
+                self._link_free = send_at
+
+                wait = send_at - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                self.destination.sendall(data)
+                self.trace.record(len(data))
+            # 源端关闭后把半关闭传递给另一端
+            self.destination.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        finally:
+            self.on_close()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class ImpairmentProxy:
+    """网络损伤代理：监听本地端口，把每个连接转发到目标地址
+
+    up 为客户端到服务端方向的链路参数，down 为服务端到客户端方向，
+    traces 中按方向累计所有连接的吞吐量轨迹。
+    """
+
+    def __init__(self, target_host, target_port, host="127.0.0.1", port=0, up=None, down=None, seed=0):
+        self.target = (target_host, target_port)
+        self.host = host
+        self.port = port
+        self.up = up or LinkProfile()
+        self.down = down or self.up
+        self.rng = random.Random(seed)
+        self.traces = {"up": ThroughputTrace(), "down": ThroughputTrace()}
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.running = False
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def listen(self):
+        """绑定端口并在后台线程中开始接受连接"""
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(64)
+        self.port = self.server_socket.getsockname()[1]
+        self.running = True
+        thread = threading.Thread(target=self.accept_connections)
+        thread.daemon = True
+        thread.start()
+        return self.port
+
+    def accept_connections(self):
+        """接受连接并为每个方向创建一个损伤管道"""
+        while self.running:
+            try:
+                client_socket, _ = self.server_socket.accept()
+            except OSError:
+                break
+            try:
+                upstream = socket.create_connection(self.target)
+            except OSError as e:
+                print(f"连接目标 {self.target} 失败: {e}")
+                client_socket.close()
+                continue
+            for sock in (client_socket, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connect_pipes(client_socket, upstream)
+
+    def connect_pipes(self, client_socket, upstream):
+        """两个方向各用独立的随机数序列，保证同一种子下轨迹可重复"""
+        sockets = (client_socket, upstream)
+        remaining = [2]
+        lock = threading.Lock()
+
+        def on_close():
+            with lock:
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done:
+                for sock in sockets:
+                    try:
+                        sock.close()
+                    except OSError:
+                        pass
+
+        with self.lock:
+            pipes = (
+                ImpairedPipe(client_socket, upstream, self.up, self.traces["up"],
+                             random.Random(self.rng.random()), on_close),
+                ImpairedPipe(upstream, client_socket, self.down, self.traces["down"],
+                             random.Random(self.rng.random()), on_close),
+            )
+            self.connections.append((sockets, pipes))
+        for pipe in pipes:
+            pipe.start()
+
+    def save_trace(self, path, bucket=0.1):
+        """把两个方向的吞吐量轨迹写入CSV文件"""
+        up = dict(self.traces["up"].series(bucket))
+        down = dict(self.traces["down"].series(bucket))
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["time", "up_kbps", "down_kbps"])
+            for at in sorted(set(up) | set(down)):
+                writer.writerow([f"{at:.3f}", f"{up.get(at, 0.0):.1f}", f"{down.get(at, 0.0):.1f}"])
+
+    def stop(self):
+        """停止代理并断开所有连接"""
+        self.running = False
+        try:
+            self.server_socket.close()
+        except OSError:
+            pass
+        with self.lock:
+            connections = list(self.connections)
+            self.connections.clear()
+        for sockets, pipes in connections:
+            for pipe in pipes:
+                pipe.close()
+            for sock in sockets:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+
+class DatagramImpairmentProxy:
+    """UDP损伤代理：把发往本地端口的数据报转发到目标地址，回复转发给最近一次发送的客户端地址
+
+    每个数据报独立按丢失率丢弃，延迟和抖动各自计算（可能乱序），带宽按数据报大小串行化。
+    dropped 和 forwarded 按方向统计数据报个数。
+    """
+
+    def __init__(self, target_host, target_port, host="127.0.0.1", port=0, up=None, down=None, seed=0):
+        self.target = (target_host, target_port)
+        self.up = up or LinkProfile()
+        self.down = down or self.up
+        self.rng = random.Random(seed)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.port = self.socket.getsockname()[1]
+        self.upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.upstream.bind((host, 0))
+        self.peer = None
+        self.running = False
+        self.queue = []  # (送达时间, 序号, 套接字, 数据, 目标地址)
+        self.condition = threading.Condition()
+        self.link_free = {"up": 0.0, "down": 0.0}
+        self.forwarded = {"up": 0, "down": 0}
+        self.dropped = {"up": 0, "down": 0}
+        self._counter = 0
+
+    def listen(self):
+        """启动两个方向的读取线程和送达线程"""
+        self.running = True
+        for target in (self._read_client, self._read_target, self._deliver):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        return self.port
+
+    def _schedule(self, direction, profile, sock, data, address):
+        """按链路参数决定数据报是否丢弃以及送达时间"""
+        now = time.monotonic()
+        with self.condition:
+            if profile.loss > 0 and self.rng.random() < profile.loss / 100:
+                self.dropped[direction] += 1
+                return
+            delay = profile.delay
+            if profile.jitter:
+                delay = max(0.0, delay + self.rng.uniform(-profile.jitter, profile.jitter))
+            due = now + delay / 1000
+            if profile.bandwidth > 0:
+                free = max(now, self.link_free[direction]) + len(data) / (profile.bandwidth * 1024)
+                self.link_free[direction] = free
+                due += free - now
+            self._counter += 1
+            heapq.heappush(self.queue, (due, self._counter, sock, data, address))
+            self.forwarded[direction] += 1
+            self.condition.notify()
+
+    def _read_client(self):
+        while self.running:
+            try:
+                data, address = self.socket.recvfrom(DATAGRAM_SIZE)
+            except OSError:
+                break
+            self.peer = address
+            self._schedule("up", self.up, self.upstream, data, self.target)
+
+    def _read_target(self):
+        while self.running:
+            try:
+                data, _ = self.upstream.recvfrom(DATAGRAM_SIZE)
+            except OSError:
+                break
+            if self.peer is not None:
+                self._schedule("down", self.down, self.socket, data, self.peer)
+
+    def _deliver(self):
+        while self.running:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                due = self.queue[0][0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                _, _, sock, data, address = heapq.heappop(self.queue)
+            try:
+                sock.sendto(data, address)
+            except OSError:
+                pass
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        for sock in (self.socket, self.upstream):
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+def profile_from_args(args):
+    """预设与命令行参数合并，命令行给出的参数覆盖预设"""
+    base = PROFILES[args.profile]
+    return LinkProfile(
+        delay=base.delay if args.delay is None else args.delay,
+        jitter=base.jitter if args.jitter is None else args.jitter,
+        bandwidth=base.bandwidth if args.bandwidth is None else args.bandwidth,
+        stall_interval=base.stall_interval if args.stall_interval is None else args.stall_interval,
+        stall_duration=base.stall_duration if args.stall_duration is None else args.stall_duration,
+        loss=base.loss if args.loss is None else args.loss,
+        rto=base.rto if args.rto is None else args.rto
+    )
+
+def add_link_arguments(parser):
+    """添加链路参数（网络损伤代理和基准脚本共用）"""
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="lan", help="链路预设")
+    parser.add_argument("--delay", type=float, help="单向延迟（毫秒）")
+    parser.add_argument("--jitter", type=float, help="延迟抖动（毫秒）")
+    parser.add_argument("--bandwidth", type=float, help="带宽（KB/秒，0表示不限）")
+    parser.add_argument("--stall-interval", type=float, help="突发停顿平均间隔（秒）")
+    parser.add_argument("--stall-duration", type=float, help="突发停顿时长（毫秒）")
+    parser.add_argument("--loss", type=float, help="丢包率（百分比）")
+    parser.add_argument("--rto", type=float, help="TCP重传超时（毫秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="远程桌面控制系统网络损伤模拟代理")
+    parser.add_argument("target_host")
+    parser.add_argument("target_port", type=int)
+    parser.add_argument("--port", type=int, default=5557, help="代理监听端口")
+    parser.add_argument("--trace", help="退出时写入吞吐量轨迹的CSV文件")
+    add_link_arguments(parser)
+    args = parser.parse_args()
+
+    profile = profile_from_args(args)
+    proxy = ImpairmentProxy(args.target_host, args.target_port, port=args.port, up=profile, seed=args.seed)
+    proxy.listen()
+    print(f"网络损伤代理 127.0.0.1:{proxy.port} -> {args.target_host}:{args.target_port}")
+    print(f"链路参数: {profile}")
+
+    try:
+        while True:
+            cmd = input("输入 'exit' 退出代理: ")
+            if cmd.lower() == 'exit':
+                break
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        proxy.stop()
+        if args.trace:
+            proxy.save_trace(args.trace)
+            print(f"吞吐量轨迹已写入 {args.trace}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+远程桌面控制系统 - 采样性能分析模块
+分析期间由一个后台线程按固定间隔读取所有线程的调用栈（sys._current_frames），按调用栈计数，
+结果写成折叠栈格式（每行 "线程;函数;函数... 次数"，可直接用 flamegraph.pl 或 speedscope 查看）。
+支持线程CPU时钟的平台（Linux、macOS等）上，两次采样之间线程CPU时间没有增加的采样视为阻塞等待，
+在栈尾标记 [idle]，热点函数统计不计入这些采样。不分析时没有任何线程或钩子，对服务端零开销。
+"""
+import os
+import re
+import sys
+import time
+import threading
+from collections import Counter
+
+DEFAULT_DURATION = 10.0
+MAX_DURATION = 120.0
+DEFAULT_INTERVAL = 0.005  # 采样间隔（秒）
+MIN_INTERVAL = 0.001
+TOP_FUNCTIONS = 20
+IDLE_MARK = "[idle]"
+
+_THREAD_NAME = re.compile(r"^Thread-\d+ \((.+)\)$")
+
+def thread_label(thread):
+    """线程在折叠栈中的根节点名：未命名线程用其入口函数名，同类线程合并统计"""
+    if thread is None:
+        return "unknown"
+    match = _THREAD_NAME.match(thread.name)
+    return match.group(1) if match else thread.name
+
+def thread_cpu_time(ident):
+    """线程累计CPU时间（纳秒），不支持的平台返回None"""
+    try:
+        return time.clock_gettime_ns(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """线程采样分析器，一次只能进行一个分析
+
+    start() 后采样线程运行 duration 秒，结束时调用 on_done(profiler)；
+    samples 为 {折叠栈: 次数}，collapsed() 和 top_functions() 用于输出结果。
+    """
+
+    def __init__(self, duration=DEFAULT_DURATION, interval=DEFAULT_INTERVAL, on_done=None):
+        self.duration = max(0.1, min(MAX_DURATION, float(duration)))
+        self.interval = max(MIN_INTERVAL, float(interval))
+        self.on_done = on_done
+        self.samples = Counter()
+        self.ticks = 0
+        self.started = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="profiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """提前结束分析（结果照常输出）"""
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        me = threading.get_ident()
+        start = time.monotonic()
+        deadline = start + self.duration
+        cpu_times = {}
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                thread = threads.get(ident)
+                stack = [IDLE_MARK] if self._idle(ident, cpu_times) else []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(thread_label(thread))
+                self.samples[";".join(reversed(stack))] += 1
+            self.ticks += 1
+            self._stop.wait(self.interval)
+        self.elapsed = time.monotonic() - start
+        if self.on_done is not None:
+            try:
+                self.on_done(self)
+            except Exception as e:
+                print(f"输出性能分析结果出错: {e}")
+
+    @staticmethod
+    def _idle(ident, cpu_times):
+        """线程自上次采样以来没有占用CPU（无法判断时视为运行）"""
+        cpu_time = thread_cpu_time(ident)
+        previous = cpu_times.get(ident)
+        cpu_times[ident] = cpu_time
+        return cpu_time is not None and cpu_time == previous
+
+    def collapsed(self):
+        """折叠栈文本，按次数从多到少排列"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """按自身采样数排列的函数，返回 [(函数, 自身次数, 累计次数)]"""
+        own, total = Counter(), Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")[1:]
+            if not frames or frames[-1] == IDLE_MARK:
+                continue
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        return [(name, count, total[name]) for name, count in own.most_common(limit)]
+
+    def thread_summary(self):
+        """各类线程的 [运行中采样数, 总采样数]，按运行中采样数排列"""
+        threads = {}
+        for stack, count in self.samples.items():
+            entry = threads.setdefault(stack.split(";", 1)[0], [0, 0])
+            if not stack.endswith(IDLE_MARK):
+                entry[0] += count
+            entry[1] += count
+        return dict(sorted(threads.items(), key=lambda item: -item[1][0]))
+
+    def save(self, directory):
+        """把折叠栈写入目录下以开始时间命名的文件，返回文件路径"""
+        os.makedirs(directory, exist_ok=True)
+        name = time.strftime("profile-%Y%m%d-%H%M%S", time.localtime(self.started))
+        path = os.path.join(directory, f"{name}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        return path
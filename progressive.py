@@ -0,0 +1,74 @@
+"""
+远程桌面控制系统 - 渐进式画质模块
+变化的区域先以低画质立即发送，区域静止后在空闲帧里逐步补发高画质JPEG和无损图块，
+每个图块当前达到的画质记录在画质图中
+"""
+import numpy as np
+
+# 画质等级：首次发送的低画质、补发的高画质JPEG、无损
+LEVEL_FIRST_PASS = 0
+LEVEL_REFINED = 1
+LEVEL_LOSSLESS = 2
+LEVEL_NAMES = {LEVEL_FIRST_PASS: "first_pass", LEVEL_REFINED: "refined", LEVEL_LOSSLESS: "lossless"}
+
+FIRST_PASS_QUALITY = 35
+REFINE_QUALITY = 90
+# 图块连续多少帧不变后开始补发下一等级
+REFINE_DELAY_FRAMES = 3
+# 每个空闲帧补发图块的字节预算，避免补发占满带宽影响下一次画面变化
+REFINE_BYTES_PER_FRAME = 96 * 1024
+
+class QualityMap:
+    """按图块记录客户端画面当前的画质等级和静止帧数"""
+
+    def __init__(self, width, height, tile):
+        self.width = width
+        self.height = height
+        self.tile = tile
+        rows, cols = -(-height // tile), -(-width // tile)
+        self.levels = np.zeros((rows, cols), dtype=np.uint8)
+        self.stable = np.zeros((rows, cols), dtype=np.uint16)
+        self.changed = np.zeros((rows, cols), dtype=bool)  # 本帧变化的图块，tick时不计入静止
+
+    def mark_changed(self, rects):
+        """变化的图块回到首次发送等级并重新计算静止帧数"""
+        for x, y, _, _ in rects:
+            row, col = y // self.tile, x // self.tile
+            self.levels[row, col] = LEVEL_FIRST_PASS
+            self.stable[row, col] = 0
+            self.changed[row, col] = True
+
+    def tick(self):
+        """又一帧结束：本帧未变化的图块静止帧数加一，变化的图块保持为0"""
+        np.minimum(self.stable + 1, np.iinfo(np.uint16).max, out=self.stable)
+        self.stable[self.changed] = 0
+        self.changed[:] = False
+
+    def candidates(self):
+        """可以补发的图块，等级低的优先，同等级按从上到下、从左到右"""
+        ready = (self.levels < LEVEL_LOSSLESS) & (self.stable >= REFINE_DELAY_FRAMES)
+        rows, cols = np.nonzero(ready)
+        order = np.argsort(self.levels[rows, cols], kind="stable")
+        for index in order:
+            row, col = int(rows[index]), int(cols[index])
+            x, y = col * self.tile, row * self.tile
+            yield row, col, (x, y, min(self.tile, self.width - x), min(self.tile, self.height - y))
+
+    def promote(self, row, col):
+        """图块补发完成，返回新的等级"""
+        self.levels[row, col] += 1
+        return int(self.levels[row, col])
+
+    def pending(self):
+        """是否还有未达到无损的图块"""
+        return bool((self.levels < LEVEL_LOSSLESS).any())
+
+    def summary(self):
+        """用于统计信息的摘要：各等级图块数和逐行的等级字符图"""
+        counts = np.bincount(self.levels.ravel(), minlength=len(LEVEL_NAMES))
+        return {
+            "tile": self.tile,
+            "size": [self.width, self.height],
+            "counts": {LEVEL_NAMES[level]: int(count) for level, count in enumerate(counts)},
+            "rows": ["".join(str(int(level)) for level in row) for row in self.levels]
+        }
@@ -0,0 +1,341 @@
+"""
+远程桌面控制系统 - 转发端（广播模式）
+以只观看身份连接一次服务端，把已编码的画面流原样转发给多个只观看的客户端，
+被控端的开销与观看人数无关。消息只序列化压缩一次，再用各观看者自己的会话密钥分别加密
+"""
+import sys
+import time
+import queue
+import secrets
+import socket
+import threading
+
+# 导入自定义工具模块
+from utils import SecureSocket, get_local_ip, serialize_message
+from handshake import ServerHandshake, HandshakeError, HANDSHAKE_TIMEOUT, client_handshake
+from admission import AdmissionController
+
+# 转发端配置
+DEFAULT_UPSTREAM_PORT = 5555
+DEFAULT_RELAY_PORT = 5556
+RELAY_VERSION = "1.0.0"
+VIEWER_QUEUE_SIZE = 8  # 每个观看者最多积压的消息数
+UPSTREAM_RETRY_DELAY = 1.0
+UPSTREAM_MAX_RETRY_DELAY = 8.0
+MAX_VIEWERS = 100
+
+class Viewer:
+    """下游观看者，拥有独立的有界发送队列"""
+
+    def __init__(self, client, address):
+        self.client = client
+        self.address = address
+        self.queue = queue.Queue(maxsize=VIEWER_QUEUE_SIZE)
+        self.need_keyframe = False  # 积压溢出后丢弃增量消息，直到下一关键帧
+        self.closed = False
+        self.authenticated = False  # 是否已占用准入控制的会话名额
+        self.dropped = 0
+
+class RemoteDesktopRelay:
+    """远程桌面控制系统转发端类"""
+
+    def __init__(self, upstream_host, upstream_port=DEFAULT_UPSTREAM_PORT, host=None, port=DEFAULT_RELAY_PORT,
+                 password="", viewer_password=None, allowed_ip_list=(), max_viewers=MAX_VIEWERS):
+        """初始化转发端
+
+        viewer_password 为观看者连接转发端的密码。上游受密码保护而未指定观看者密码（或与上游密码相同）时
+        随机生成一个，观看者不会得到可以直接控制被控端的密码；allowed_ip_list 为观看者IP白名单。
+        """
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.password = password  # 连接上游服务端的密码
+        self.host = host if host else get_local_ip()
+        self.port = port
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.running = False
+        self.viewers = []
+        self.upstream = None
+        if password and (viewer_password is None or viewer_password == password):
+            viewer_password = secrets.token_urlsafe(9)
+            print(f"观看者密码: {viewer_password}")
+        self.viewer_password = viewer_password or ""
+        # 观看者各自完成握手认证，使用独立的会话密钥
+        self.handshake = ServerHandshake(self.viewer_password)
+        # 与服务端相同的准入控制：白名单、单IP连接频率、未认证连接数和观看人数上限
+        self.admission = AdmissionController(allowed_ip_list, max_sessions=max_viewers)
+        self.ticket = None
+        self.server_info = None
+        self.keyframe = None  # 最近一帧完整画面的 (校验值, 压缩数据)，新观看者加入时立即发送
+        self.overview = None
+        self.frames_received = 0
+        self.lock = threading.Lock()
+
+    def listen(self):
+        """绑定端口，启动上游连接线程和观看者接收线程"""
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(64)
+        self.port = self.server_socket.getsockname()[1]
+        self.running = True
+
+        upstream_thread = threading.Thread(target=self.upstream_loop)
+        upstream_thread.daemon = True
+        upstream_thread.start()
+
+        accept_thread = threading.Thread(target=self.accept_viewers)
+        accept_thread.daemon = True
+        accept_thread.start()
+
+    def start(self):
+        """启动转发端"""
+        try:
+            self.listen()
+
+            print(f"=== 远程桌面控制系统转发端 v{RELAY_VERSION} ===")
+            print(f"上游服务端: {self.upstream_host}:{self.upstream_port}")
+            print(f"转发端启动成功，监听地址: {self.host}:{self.port}")
+
+            # 主线程等待用户输入命令
+            while self.running:
+                cmd = input("输入 'exit' 退出转发端: ")
+                if cmd.lower() == 'exit':
+                    self.stop()
+                    break
+
+        except Exception as e:
+            print(f"转发端启动失败: {e}")
+            self.stop()
+
+    def upstream_loop(self):
+        """保持与服务端的连接，断开后按指数退避重连"""
+        delay = UPSTREAM_RETRY_DELAY
+        while self.running:
+            try:
+                self.receive_upstream()
+                delay = UPSTREAM_RETRY_DELAY
+            except Exception as e:
+                if self.running:
+                    print(f"上游连接出错: {e}")
+            if self.running:
+                time.sleep(delay)
+                delay = min(delay * 2, UPSTREAM_MAX_RETRY_DELAY)
+
+    def receive_upstream(self):
+        """以只观看身份连接服务端并转发收到的消息"""
+        upstream = SecureSocket()
+        upstream.socket.settimeout(5)
+        upstream.connect(self.upstream_host, self.upstream_port)
+        self.ticket = client_handshake(upstream, self.password, self.ticket)
+        upstream.send_data({"type": "hello", "version": RELAY_VERSION, "view_only": True})
+        self.upstream = upstream
+        print(f"已连接上游服务端 {self.upstream_host}:{self.upstream_port}")
+
+        try:
+            while self.running:
+                try:
+                    data = upstream.receive_data()
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+
+                data_type = data.get("type", "")
+                if data_type == "server_info":
+                    # 下游观看者不能恢复上游会话，也不能发送输入
+                    # 观看者的消息由转发端接收，转发端不一定支持可选压缩方式，统一不启用
+                    info = dict(data, session_token=None, resumed=False, view_only=True, codecs=[], datagram=None)
+                    with self.lock:
+                        self.server_info = serialize_message(info)
+                        self.keyframe = None
+                    self.broadcast(self.server_info, keyframe=True)
+                elif data_type == "screen":
+                    self.frames_received += 1
+                    packet = serialize_message(data)
+                    with self.lock:
+                        self.keyframe = packet
+                    self.broadcast(packet, keyframe=True)
+                elif data_type == "overview":
+                    packet = serialize_message(data)
+                    with self.lock:
+                        self.overview = packet
+                    self.broadcast(packet)
+                elif data_type == "tiles":
+                    self.frames_received += 1
+                    self.broadcast(serialize_message(data))
+        finally:
+            self.upstream = None
+            upstream.close()
+
+    def broadcast(self, packet, keyframe=False):
+        """把已序列化压缩的消息放入每个观看者的队列，队列满的观看者丢弃积压并等待下一关键帧"""
+        with self.lock:
+            viewers = list(self.viewers)
+        for viewer in viewers:
+            if viewer.need_keyframe and not keyframe:
+                continue
+            try:
+                viewer.queue.put_nowait(packet)
+                viewer.need_keyframe = False
+            except queue.Full:
+                viewer.dropped += 1
+                self.drain(viewer)
+                if keyframe:
+                    viewer.queue.put_nowait(packet)
+                else:
+                    viewer.need_keyframe = True
+
+    def drain(self, viewer):
+        """清空观看者的积压消息"""
+        while True:
+            try:
+                viewer.queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def accept_viewers(self):
+        """接受观看者连接"""
+        while self.running:
+            try:
+                client_socket, client_address = self.server_socket.accept()
+
+                # 准入检查在创建线程和握手之前完成，被拒绝的连接直接关闭
+                admitted, reason = self.admission.admit(client_address[0])
+                if not admitted:
+                    client_socket.close()
+                    continue
+                print(f"观看者 {client_address} 已连接")
+                viewer = Viewer(SecureSocket(client_socket), client_address)
+
+                thread = threading.Thread(target=self.join_viewer, args=(viewer,))
+                thread.daemon = True
+                thread.start()
+
+            except Exception as e:
+                if self.running:
+                    print(f"接受观看者连接出错: {e}")
+
+    def join_viewer(self, viewer):
+        """完成观看者握手，然后开始转发"""
+        try:
+            self.handshake.perform(viewer.client)
+            viewer.authenticated, reason = self.admission.authenticate(viewer.address[0])
+            if not viewer.authenticated:
+                raise HandshakeError(f"观看者已满: {reason}")
+            # 客户端握手后紧接着发送hello，观看者不受信任，丢弃而不反序列化
+            viewer.client.skip_message(timeout=HANDSHAKE_TIMEOUT)
+        except (HandshakeError, OSError, KeyError, TypeError, ValueError) as e:
+            print(f"观看者 {viewer.address} 握手失败: {e}")
+            viewer.closed = True
+            viewer.client.close()
+            self.admission.release(viewer.address[0], viewer.authenticated)
+            return
+
+        # 加入时先发送服务端信息和最近的完整画面
+        with self.lock:
+            for packet in (self.server_info, self.overview, self.keyframe):
+                if packet is not None:
+                    viewer.queue.put_nowait(packet)
+            self.viewers.append(viewer)
+
+        reader = threading.Thread(target=self.viewer_reader, args=(viewer,))
+        reader.daemon = True
+        reader.start()
+        self.viewer_writer(viewer)
+
+    def viewer_writer(self, viewer):
+        """从队列取出数据包发送给观看者"""
+        try:
+            while self.running and not viewer.closed:
+                try:
+                    packet = viewer.queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                viewer.client.send_serialized(*packet)
+        except Exception as e:
+            if self.running and not viewer.closed:
+                print(f"向观看者 {viewer.address} 发送出错: {e}")
+        finally:
+            self.remove_viewer(viewer)
+
+    def viewer_reader(self, viewer):
+        """读取并丢弃观看者发来的消息（输入被禁用），用于及时发现断开
+
+        观看者可能不受信任，消息不解密也不反序列化。
+        """
+        try:
+            while self.running and not viewer.closed:
+                try:
+                    if not viewer.client.skip_message():
+                        break
+                except socket.timeout:
+                    continue
+        except Exception:
+            pass
+        finally:
+            self.remove_viewer(viewer)
+
+    def remove_viewer(self, viewer):
+        """移除观看者并关闭连接"""
+        with self.lock:
+            if viewer.closed:
+                return
+            viewer.closed = True
+            if viewer in self.viewers:
+                self.viewers.remove(viewer)
+        try:
+            viewer.client.close()
+        except:
+            pass
+        self.admission.release(viewer.address[0], viewer.authenticated)
+        print(f"观看者 {viewer.address} 已断开连接")
+
+    def stop(self):
+        """停止转发端"""
+        self.running = False
+        print("正在关闭转发端...")
+
+        with self.lock:
+            viewers = list(self.viewers)
+        for viewer in viewers:
+            self.remove_viewer(viewer)
+
+        for sock in (self.upstream, self.server_socket):
+            try:
+                sock.close()
+            except:
+                pass
+
+        print("转发端已关闭")
+
+if __name__ == "__main__":
+    # 解析命令行参数: relay.py <服务端地址> [服务端端口] [监听端口] [服务端密码] [观看者密码] [观看者IP白名单]
+    if len(sys.argv) < 2:
+        print("用法: python relay.py <服务端地址> [服务端端口] [监听端口] [服务端密码] [观看者密码] [观看者IP白名单]")
+        print("服务端有密码而未指定观看者密码时随机生成，IP白名单用逗号分隔，支持CIDR")
+        sys.exit(1)
+
+    upstream_host = sys.argv[1]
+    upstream_port = DEFAULT_UPSTREAM_PORT
+    port = DEFAULT_RELAY_PORT
+    password = sys.argv[4] if len(sys.argv) > 4 else ""
+    viewer_password = sys.argv[5] if len(sys.argv) > 5 else None
+    allowed_ip_list = [ip for ip in sys.argv[6].split(",") if ip.strip()] if len(sys.argv) > 6 else []
+
+    try:
+        if len(sys.argv) > 2:
+            upstream_port = int(sys.argv[2])
+        if len(sys.argv) > 3:
+            port = int(sys.argv[3])
+    except ValueError:
+        pass
+
+    relay = RemoteDesktopRelay(upstream_host, upstream_port, port=port, password=password,
+                               viewer_password=viewer_password, allowed_ip_list=allowed_ip_list)
+
+    try:
+        relay.start()
+    except KeyboardInterrupt:
+        relay.stop()
+    except Exception as e:
+        print(f"转发端运行出错: {e}")
+        relay.stop()
@@ -0,0 +1,122 @@
+"""
+远程桌面控制系统 - 帧调度模块
+根据输入事件、画面变化和X Damage通知自适应调整截图间隔
+"""
+import threading
+import time
+
+try:
+    from Xlib import display as xdisplay  # 可选依赖，用于X Damage通知
+    from Xlib.ext import damage as xdamage
+except ImportError:
+    xdisplay = None
+    xdamage = None
+
+class FrameScheduler:
+    """自适应帧调度器
+
+    - 收到输入事件后的一段时间内按最小间隔截图（用户操作预示画面即将变化）
+    - 连续多帧画面不变时间隔按指数退避，直到最大间隔
+    - 画面变化时恢复基础间隔
+    - 有X Damage通知时，空闲期间可退避到更长间隔，由通知随时唤醒
+    """
+
+    def __init__(self, base_interval=0.1, min_interval=1 / 30, max_interval=1.0,
+                 boost_window=0.5, backoff=2.0):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.boost_window = boost_window
+        self.backoff = backoff
+        self.interval = base_interval
+        self.boost_until = 0.0
+        self.damage_driven = False
+        self._wakeup = threading.Event()
+
+    def configure(self, frame_rate, max_frame_rate):
+        """按帧率设置基础间隔和输入后的最小间隔"""
+        self.base_interval = 1.0 / max(1, frame_rate)
+        self.min_interval = 1.0 / max(1, max_frame_rate, frame_rate)
+        self.interval = min(self.interval, self.base_interval)
+        self._wakeup.set()
+
+    def notify_input(self):
+        """收到输入事件：立即唤醒并在一段时间内提高帧率"""
+        self.boost_until = time.monotonic() + self.boost_window
+        self.interval = self.min_interval
+        self._wakeup.set()
+
+    def notify_damage(self):
+        """收到屏幕变化通知：立即唤醒"""
+        self.interval = min(self.interval, self.base_interval)
+        self._wakeup.set()
+
+    def frame_done(self, changed):
+        """记录一帧的结果，据此调整下一帧的间隔"""
+        if time.monotonic() < self.boost_until:
+            self.interval = self.min_interval
+        elif changed:
+            self.interval = self.base_interval
+        else:
+            # 有Damage通知时空闲期间可以睡得更久
+            limit = self.max_interval * (5 if self.damage_driven else 1)
+            self.interval = min(limit, max(self.interval, self.min_interval) * self.backoff)
+
+    def wait(self):
+        """等待到下一帧时刻，或被输入/变化通知提前唤醒"""
+        self._wakeup.wait(self.interval)
+        self._wakeup.clear()
+
+    def stop(self):
+        """唤醒等待中的线程以便其退出"""
+        self._wakeup.set()
+
+class DamageMonitor:
+    """基于X Damage扩展的屏幕变化监听，不可用时start()返回False"""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.running = False
+        self._display = None
+
+    def start(self):
+        """启动监听线程"""
+        if xdisplay is None:
+            return False
+        try:
+            self._display = xdisplay.Display()
+            if not self._display.has_extension("DAMAGE"):
+                self._display.close()
+                return False
+            self._display.damage_query_version()
+            root = self._display.screen().root
+            self._damage = root.damage_create(xdamage.DamageReportNonEmpty)
+            self._notify_type = self._display.query_extension("DAMAGE").first_event + xdamage.DamageNotifyCode
+        except Exception:
+            return False
+
+        self.running = True
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _run(self):
+        """读取Damage事件并回调"""
+        while self.running:
+            try:
+                event = self._display.next_event()
+                if event.type == self._notify_type:
+                    # 清空已报告的损坏区域，下一次变化才会再次通知
+                    self._display.damage_subtract(self._damage)
+                    self.callback()
+            except Exception:
+                break
+
+    def stop(self):
+        """停止监听"""
+        self.running = False
+        try:
+            self._display.close()
+        except Exception:
+            pass
@@ -2,60 +2,126 @@
 远程桌面控制系统 - 服务端（被控制端）
 负责捕获屏幕并发送给客户端，接收客户端发送的键盘和鼠标控制命令
 """
+import os
+import sys
 import time
 import socket
 import threading
-import io
-import base64
-from PIL import ImageGrab # type: ignore
 import keyboard
-from pynput.mouse import Button, Controller as MouseController
-from pynput.keyboard import Key, Controller as KeyboardController
 import logging
 from typing import Dict, Any
 import imagehash
 
 # 导入自定义工具模块
-from utils import SecureSocket, get_local_ip, compress_image
+from utils import (SecureSocket, get_local_ip, compress_image, send_screen, send_pipeline_screen,
+                   send_datagram_screen, TILE_SIZE)
+from capture import create_capture_backend
+from scheduler import DamageMonitor
+from session import SessionManager, EXPIRE_INTERVAL
+from config import get_config_store, get_config_dir
+from admission import AdmissionController
+from handshake import ServerHandshake, HandshakeError
+from colormodes import COLOR_MODES
+from inputengine import InputEngine, PynputController, INPUT_COMMANDS
+from framepipeline import FramePipeline
+from compression import available_codecs
+from datagram import DatagramStream
+from jpegencoder import SUBSAMPLING_MODES, DEFAULT_SUBSAMPLING
+from profiler import SamplingProfiler, DEFAULT_DURATION, DEFAULT_INTERVAL
 
 # 服务端配置
 DEFAULT_PORT = 5555
-SCREEN_SIZE = ImageGrab.grab().size
+CAPTURE_BACKEND = "auto"  # 截图后端: auto / mss / pil / synthetic
 SERVER_VERSION = "1.0.0"
 
-# 控制器初始化
-mouse = MouseController()
-keyboard_controller = KeyboardController()
-
 class RemoteDesktopServer:
     """远程桌面控制系统服务端类"""
     
-    def __init__(self, host=None, port=DEFAULT_PORT):
-        """初始化服务端"""
+    def __init__(self, host=None, port=DEFAULT_PORT, capture_backend=CAPTURE_BACKEND, input_controller=None,
+                 capture_process=None):
+        """初始化服务端
+
+        input_controller 默认使用pynput，测试时可传入 RecordingController；
+        capture_process 为True时截图编码在独立进程中进行，为None时按配置决定。
+        """
         self.host = host if host else get_local_ip()
         self.port = port
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.running = False
         self.clients = []
+        # 画质、帧率和准入参数来自配置，配置文件修改后实时应用到运行中的会话
+        self.config = get_config_store('server')
         self.screen_quality = 70  # 屏幕图像质量，可调整
+        self.jpeg_backend = "auto"
+        self.jpeg_subsampling = DEFAULT_SUBSAMPLING
+        self.frame_rate = 10
+        self.max_frame_rate = 30
+        self.admission = AdmissionController()
+        self.handshake = ServerHandshake()
+        # 探测截图后端和屏幕尺寸，每个发送线程各自创建后端实例以复用独立缓冲区
+        probe = create_capture_backend(capture_backend)
+        self.capture_backend = probe.name
+        self.screen_size = probe.screen_size
+        probe.close()
+        self.viewports = {}  # 各客户端当前可见区域
+        self.schedulers = {}  # 各客户端的帧调度器
+        self.damage_monitor = DamageMonitor(self.notify_damage)
+        self.damage_available = False
+        self.sessions = SessionManager()
+        self.client_sessions = {}  # 各客户端当前会话
+        self.datagram_streams = {}  # 协商使用UDP画面流的客户端
+        if capture_process is None:
+            capture_process = self.config.get_bool("capture_process")
+        # 独立进程模式下所有客户端共享同一路全屏画面，不支持按可见区域截图和图块级恢复
+        self.pipeline = FramePipeline(self.capture_backend, self.screen_size) if capture_process else None
+        self.apply_config(self.config.snapshot())
+        self.config.subscribe(self.apply_config)
+        self.view_only_clients = set()  # 只观看的客户端（如转发进程），忽略其输入
+        # 输入命令交给独立线程注入，控制命令按类型查分发表处理
+        self.input_engine = InputEngine(input_controller or PynputController())
+        self.profiler = None  # 正在进行的性能分析，不分析时没有采样线程
+        self.profile_lock = threading.Lock()
+        self.command_handlers = {
+            "set_quality": self.set_quality,
+            "viewport": self.set_viewport,
+            "frame_ack": self.acknowledge_frame,
+            "datagram_ack": self.acknowledge_datagram,
+            "stats": self.send_stats,
+            "profile": self.start_profile
+        }
+        
+    def listen(self):
+        """绑定端口并在后台线程中开始接受连接"""
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(64)  # 较大的积压队列，连接洪泛时合法连接不易被挤掉
+        self.port = self.server_socket.getsockname()[1]
+        self.running = True
+        self.damage_available = self.damage_monitor.start()
+        self.config.watch()
+        self.input_engine.start()
+        if self.pipeline is not None:
+            self.pipeline.start()
+        
+        # 启动客户端接收线程
+        accept_thread = threading.Thread(target=self.accept_clients)
+        accept_thread.daemon = True
+        accept_thread.start()
+
+        # 定期清理宽限期已过的会话，没有新连接时也能释放
+        expire_thread = threading.Thread(target=self.expire_sessions)
+        expire_thread.daemon = True
+        expire_thread.start()
         
     def start(self):
         """启动服务端"""
         try:
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            self.running = True
+            self.listen()
             
             print(f"=== 远程桌面控制系统服务端 v{SERVER_VERSION} ===")
             print(f"服务器启动成功，监听地址: {self.host}:{self.port}")
             print("等待客户端连接...")
             
-            # 启动客户端接收线程
-            accept_thread = threading.Thread(target=self.accept_clients)
-            accept_thread.daemon = True
-            accept_thread.start()
-            
             # 主线程等待用户输入命令
             while self.running:
                 cmd = input("输入 'exit' 退出服务端: ")
@@ -72,6 +138,13 @@ class RemoteDesktopServer:
         while self.running:
             try:
                 client_socket, client_address = self.server_socket.accept()
+                
+                # 准入检查在创建线程、加密和截图之前完成，被拒绝的连接直接关闭
+                admitted, reason = self.admission.admit(client_address[0])
+                if not admitted:
+                    logging.debug("拒绝连接 %s: %s", client_address, reason)
+                    client_socket.close()
+                    continue
                 print(f"客户端 {client_address} 已连接")
                 
                 # 为每个客户端创建安全套接字
@@ -90,121 +163,316 @@ class RemoteDesktopServer:
                 if self.running:
                     print(f"接受客户端连接出错: {e}")
                     
+    def expire_sessions(self):
+        """定期清理过期会话"""
+        while self.running:
+            time.sleep(EXPIRE_INTERVAL)
+            self.sessions.prune()
+
     def handle_client(self, client, address):
         """处理客户端连接"""
+        session = None
+        stream = None
+        authenticated = False
         try:
+            # 密钥交换和密码认证，成功后切换到本连接独立的会话密钥；未认证阶段有总时限
+            try:
+                self.handshake.perform(client)
+            except (HandshakeError, KeyError, TypeError, ValueError, socket.timeout) as e:
+                print(f"客户端 {address} 握手失败: {e}")
+                return
+            # 认证通过后才占用会话名额
+            authenticated, reason = self.admission.authenticate(address[0])
+            if not authenticated:
+                print(f"客户端 {address} 被拒绝: {reason}")
+                return
+                
+            # 读取客户端握手，携带会话令牌时尝试恢复会话
+            hello = client.receive_data(timeout=5.0)
+            if hello is None:
+                # 握手前连接已关闭
+                return
+            if hello.get("type") == "hello" and hello.get("session_token"):
+                session = self.sessions.resume(hello["session_token"], client)
+            resumed = session is not None
+            if session is None:
+                session = self.sessions.create(client)
+            self.client_sessions[client] = session
+            if hello.get("view_only"):
+                self.view_only_clients.add(client)
+            if hello.get("color_mode") in COLOR_MODES:
+                session.color_mode = hello["color_mode"]
+            if "progressive" in hello:
+                session.progressive = bool(hello["progressive"])
+            # 双方都支持相同字典的zstd时，控制消息改用zstd压缩
+            client.codec.enable_zstd(hello.get("codecs"))
+            if session.viewport:
+                self.viewports[client] = session.viewport
+            # 客户端支持时画面改走UDP（独立进程模式下所有客户端共享同一路TCP画面，不使用UDP）
+            if hello.get("datagram") and self.config.get_bool("udp_video") and self.pipeline is None:
+                stream = DatagramStream(client.session_key, self.host, TILE_SIZE)
+                self.datagram_streams[client] = stream
+            
             # 发送服务器信息
             client.send_data({
                 "type": "server_info",
                 "version": SERVER_VERSION,
-                "screen_size": {"width": SCREEN_SIZE[0], "height": SCREEN_SIZE[1]}
+                "screen_size": {"width": self.screen_size[0], "height": self.screen_size[1]},
+                "session_token": session.token,
+                "resumed": resumed,
+                "codecs": available_codecs(),
+                "datagram": {"port": stream.port} if stream is not None else None
             })
+            if hello.get("type") not in ("hello", None):
+                self.process_command(hello, client)
             
             # 启动屏幕发送线程
             screen_thread = threading.Thread(
                 target=self.send_screen, 
-                args=(client,)
+                args=(client, session, hello.get("last_seq") if resumed else None, stream)
             )
             screen_thread.daemon = True
             screen_thread.start()
             
             # 处理客户端命令
             while self.running:
-                data = client.receive_data()
+                try:
+                    data = client.receive_data()
+                except socket.timeout:
+                    continue
                 if not data:
                     break
                     
-                self.process_command(data)
+                self.process_command(data, client)
                 
         except Exception as e:
             print(f"处理客户端 {address} 出错: {e}")
         finally:
             if client in self.clients:
                 self.clients.remove(client)
+            self.viewports.pop(client, None)
+            self.client_sessions.pop(client, None)
+            self.view_only_clients.discard(client)
+            self.datagram_streams.pop(client, None)
+            if stream is not None:
+                stream.close()
+            if session is not None:
+                # 会话进入宽限期，客户端可凭令牌恢复
+                self.sessions.detach(session, client)
+            self.admission.release(address[0], authenticated)
             client.close()
             print(f"客户端 {address} 已断开连接")
             
-    def send_screen(self, client):
-        """简化屏幕捕获"""
-        screenshot = ImageGrab.grab()
-        img_byte_arr = io.BytesIO()
-        screenshot.save(img_byte_arr, format='JPEG', quality=85)
-        img_base64 = base64.b64encode(img_byte_arr.getvalue()).decode()
-        client.send_data({"type": "screen", "image": img_base64})
+    def send_screen(self, client, session, resume_seq=None, stream=None):
+        """持续捕获客户端可见区域并发送，UDP收不到客户端探测包或长时间没有确认时回退到TCP"""
+        if self.pipeline is not None:
+            send_pipeline_screen(self, client)
+            return
+        if stream is not None:
+            if stream.wait_for_peer() and send_datagram_screen(self, client, stream):
+                return
+            if not self.running or client not in self.clients:
+                return
+            print("UDP画面流不可用，回退到TCP")
+            self.datagram_streams.pop(client, None)
+            stream.close()
+            # UDP期间没有记录帧，从完整画面开始
+            resume_seq = None
+        send_screen(self, client, session, resume_seq)
+        
+    def apply_config(self, changes):
+        """应用配置变化（启动时传入完整配置，之后只传入变化的配置项）"""
+        if "screen_quality" in changes:
+            self.screen_quality = max(10, min(95, int(changes["screen_quality"])))
+        if "jpeg_encoder" in changes:
+            # 新连接的发送线程生效
+            self.jpeg_backend = changes["jpeg_encoder"]
+        if changes.get("jpeg_subsampling") in SUBSAMPLING_MODES:
+            self.jpeg_subsampling = changes["jpeg_subsampling"]
+        if "frame_rate" in changes or "max_frame_rate" in changes:
+            self.frame_rate = int(changes.get("frame_rate", self.frame_rate))
+            self.max_frame_rate = int(changes.get("max_frame_rate", self.max_frame_rate))
+            for scheduler in list(self.schedulers.values()):
+                scheduler.configure(self.frame_rate, self.max_frame_rate)
+        if self.pipeline is not None:
+            self.pipeline.configure(self.screen_quality, self.frame_rate, self.max_frame_rate)
+        if {"password_protected", "password", "kdf_n"} & set(changes):
+            # 密码派生密钥只在这里计算一次，之后的握手直接复用
+            password = self.config.get("password", "") if self.config.get_bool("password_protected") else ""
+            self.handshake.configure(password, {"n": self.config.get_int("kdf_n", 32768)})
+        self.admission.configure(
+            allowed_ip_list=changes.get("allowed_ip_list"),
+            rate=changes.get("connect_rate"),
+            burst=changes.get("connect_burst"),
+            max_sessions=changes.get("max_sessions"),
+            max_pending=changes.get("max_pending"),
+            max_pending_per_ip=changes.get("max_pending_per_ip")
+        )
+            
+    def notify_input(self):
+        """输入事件预示画面即将变化，通知所有帧调度器加速截图"""
+        for scheduler in list(self.schedulers.values()):
+            scheduler.notify_input()
+        if self.pipeline is not None:
+            self.pipeline.notify_input()
+            
+    def notify_damage(self):
+        """X Damage报告屏幕变化，唤醒所有帧调度器"""
+        for scheduler in list(self.schedulers.values()):
+            scheduler.notify_damage()
         
-    def process_command(self, command):
-        """处理客户端发送的控制命令"""
+    def process_command(self, command, client=None):
+        """处理客户端发送的控制命令（在接收循环中调用，不能阻塞）"""
         try:
             cmd_type = command.get("type", "")
+            if cmd_type in INPUT_COMMANDS:
+                if client in self.view_only_clients:
+                    return
+                self.notify_input()
+                self.input_engine.submit(command)
+                return
             
-            if cmd_type == "mouse_move":
-                # 处理鼠标移动
-                x = command.get("x", 0)
-                y = command.get("y", 0)
-                mouse.position = (x, y)
-                
-            elif cmd_type == "mouse_click":
-                # 处理鼠标点击
-                button = command.get("button", "left")
-                clicks = command.get("clicks", 1)
-                
-                if button == "left":
-                    btn = Button.left
-                elif button == "right":
-                    btn = Button.right
-                elif button == "middle":
-                    btn = Button.middle
-                else:
-                    btn = Button.left
-                    
-                mouse.click(btn, clicks)
-                
-            elif cmd_type == "mouse_scroll":
-                # 处理鼠标滚轮
-                dx = command.get("dx", 0)
-                dy = command.get("dy", 0)
-                mouse.scroll(dx, dy)
-                
-            elif cmd_type == "keyboard_press":
-                # 处理键盘按键
-                key = command.get("key", "")
-                if key:
-                    if hasattr(Key, key):
-                        # 特殊键
-                        keyboard_controller.press(getattr(Key, key))
-                    else:
-                        # 普通键
-                        keyboard_controller.press(key)
-                        
-            elif cmd_type == "keyboard_release":
-                # 处理键盘释放
-                key = command.get("key", "")
-                if key:
-                    if hasattr(Key, key):
-                        # 特殊键
-                        keyboard_controller.release(getattr(Key, key))
-                    else:
-                        # 普通键
-                        keyboard_controller.release(key)
-                        
-            elif cmd_type == "keyboard_type":
-                # 处理键盘输入文本
-                text = command.get("text", "")
-                if text:
-                    keyboard_controller.type(text)
-                    
-            elif cmd_type == "set_quality":
-                # 设置屏幕质量
-                quality = command.get("quality", 70)
-                self.screen_quality = max(10, min(95, quality))
+            handler = self.command_handlers.get(cmd_type)
+            if handler is not None:
+                handler(command, client)
                 
         except Exception as e:
             print(f"处理命令出错: {e}")
             
+    def set_quality(self, command, client):
+        """设置屏幕质量"""
+        quality = command.get("quality", 70)
+        self.screen_quality = max(10, min(95, quality))
+        # 色彩模式按客户端分别设置
+        color_mode = command.get("color_mode")
+        if color_mode in COLOR_MODES and client in self.client_sessions:
+            self.client_sessions[client].color_mode = color_mode
+        if "progressive" in command and client in self.client_sessions:
+            self.client_sessions[client].progressive = bool(command["progressive"])
+        if self.pipeline is not None:
+            # 独立进程模式下画质和色彩模式对所有客户端统一生效
+            self.pipeline.configure(quality=self.screen_quality, color_mode=color_mode)
+            
+    def set_viewport(self, command, client):
+        """记录客户端可见区域，后续只截取和编码该区域"""
+        if client is None:
+            return
+        self.viewports[client] = {
+            "x": command.get("x", 0),
+            "y": command.get("y", 0),
+            "width": command.get("width", self.screen_size[0]),
+            "height": command.get("height", self.screen_size[1]),
+            "zoom": command.get("zoom", 1.0)
+        }
+        if client in self.client_sessions:
+            self.client_sessions[client].viewport = self.viewports[client]
+        if client in self.schedulers:
+            self.schedulers[client].notify_damage()
+            
+    def acknowledge_frame(self, command, client):
+        """客户端确认已显示某一帧，作为断线恢复的基准"""
+        if client in self.client_sessions:
+            self.client_sessions[client].acknowledge(command.get("seq"))
+            
+    def acknowledge_datagram(self, command, client):
+        """客户端确认已显示UDP画面中的一个分片组"""
+        stream = self.datagram_streams.get(client)
+        if stream is not None:
+            stream.acknowledge(command.get("seq"))
+            
+    def get_stats(self, client=None):
+        """服务端运行统计：输入延迟、准入、握手，以及该客户端会话的渐进画质图"""
+        stats = {
+            "clients": len(self.clients),
+            "capture_backend": self.capture_backend,
+            "capture_process": self.pipeline is not None,
+            "input": self.input_engine.latency_percentiles(),
+            "admission": {"active": self.admission.active, "pending": self.admission.pending_count(),
+                          "rejected": dict(self.admission.rejected)},
+            "handshakes": {"full": self.handshake.full_handshakes, "resumed": self.handshake.resumed_handshakes},
+            "session": None
+        }
+        session = self.client_sessions.get(client)
+        if session is not None:
+            quality_map = session.quality_map
+            stats["session"] = {
+                "seq": session.seq,
+                "color_mode": session.color_mode,
+                "progressive": session.progressive,
+                "quality_map": quality_map.summary() if quality_map is not None else None
+            }
+        stream = self.datagram_streams.get(client)
+        stats["datagram"] = stream.stats() if stream is not None else None
+        return stats
+        
+    def send_stats(self, command, client):
+        """回复统计信息"""
+        if client is not None:
+            client.send_data(dict(self.get_stats(client), type="stats"))
+            
+    def start_profile(self, command, client):
+        """按客户端请求对服务端所有线程采样分析，结果写入文件，并把摘要（可选完整折叠栈）回传给客户端"""
+        if client is None or client in self.view_only_clients:
+            return
+        if not self.config.get_bool("allow_profiling"):
+            client.send_data({"type": "profile_result", "error": "服务端未启用性能分析（配置 allow_profiling）"})
+            return
+        with self.profile_lock:
+            if self.profiler is not None:
+                client.send_data({"type": "profile_result", "error": "已有性能分析正在进行"})
+                return
+            self.profiler = SamplingProfiler(
+                command.get("duration", DEFAULT_DURATION),
+                command.get("interval", DEFAULT_INTERVAL),
+                on_done=lambda profiler: self.finish_profile(profiler, client, bool(command.get("stream")))
+            )
+            self.profiler.start()
+        print(f"开始性能分析，持续 {self.profiler.duration:.1f} 秒")
+            
+    def finish_profile(self, profiler, client, stream):
+        """在采样线程中调用：保存结果并回复请求的客户端（已断开时只保存文件）
+
+        保存失败（目录不可写、磁盘已满等）时结果仍附带错误回传，且总会清除正在进行的分析以便再次发起。
+        """
+        path, error = None, None
+        try:
+            directory = self.config.get("profile_dir") or os.path.join(get_config_dir(), "profiles")
+            path = profiler.save(directory)
+            print(f"性能分析结果已写入 {path}")
+        except OSError as e:
+            error = f"保存性能分析结果失败: {e}"
+            print(error)
+        finally:
+            with self.profile_lock:
+                self.profiler = None
+        if client not in self.clients:
+            return
+        result = {
+            "type": "profile_result",
+            "path": path,
+            "error": error,
+            "duration": profiler.elapsed,
+            "ticks": profiler.ticks,
+            "threads": profiler.thread_summary(),
+            "top": profiler.top_functions()
+        }
+        if stream:
+            result["collapsed"] = profiler.collapsed()
+        client.send_data(result)
+            
     def stop(self):
         """停止服务端"""
         self.running = False
         print("正在关闭服务端...")
+        if self.profiler is not None:
+            self.profiler.stop()
+        self.damage_monitor.stop()
+        self.config.stop_watching()
+        self.input_engine.stop()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        for scheduler in list(self.schedulers.values()):
+            scheduler.stop()
         
         # 关闭所有客户端连接
         for client in self.clients:
@@ -226,7 +494,7 @@ class RemoteDesktopServer:
 if __name__ == "__main__":
     # 解析命令行参数
     host = None
-    port = DEFAULT_PORT
+    port = get_config_store('server').get_int('port', DEFAULT_PORT)
     
     if len(sys.argv) > 1:
         if sys.argv[1] != "auto":
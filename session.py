@@ -0,0 +1,150 @@
+"""
+远程桌面控制系统 - 会话模块
+保存客户端会话状态，断线后在宽限期内可凭会话令牌恢复
+"""
+import secrets
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# 断线后保留会话的宽限期（秒）
+SESSION_GRACE_PERIOD = 60.0
+# 等待确认的已发送帧最多保留数量
+MAX_PENDING_FRAMES = 4
+# 定期清理过期会话的间隔（秒）
+EXPIRE_INTERVAL = 10.0
+
+def tile_mask(previous, current, tile):
+    """两帧之间内容不同的图块"""
+    height, width = current.shape[:2]
+    # 每个BGRA像素按一个uint32比较，再按图块归约
+    diff = previous.view(np.uint32)[..., 0] != current.view(np.uint32)[..., 0]
+    mask = np.logical_or.reduceat(diff, np.arange(0, height, tile), axis=0)
+    return np.logical_or.reduceat(mask, np.arange(0, width, tile), axis=1)
+
+def tile_hashes(frame, tile, previous=None, previous_hashes=None):
+    """计算每个图块的CRC32，给出上一帧及其哈希时只重算变化的图块"""
+    height, width = frame.shape[:2]
+    rows, cols = -(-height // tile), -(-width // tile)
+    if previous is not None and previous_hashes is not None and previous.shape == frame.shape:
+        hashes = previous_hashes.copy()
+        dirty = zip(*np.nonzero(tile_mask(previous, frame, tile)))
+    else:
+        hashes = np.zeros((rows, cols), dtype=np.uint32)
+        dirty = ((row, col) for row in range(rows) for col in range(cols))
+    for row, col in dirty:
+        y, x = int(row) * tile, int(col) * tile
+        hashes[row, col] = zlib.crc32(frame[y:y + tile, x:x + tile].tobytes())
+    return hashes
+
+class Session:
+    """可恢复的客户端会话
+
+    记录客户端的可见区域以及已发送帧的图块哈希（不保存像素）。客户端每显示一帧回复一次确认，
+    确认后的帧即客户端当前画面，重连时只需发送哈希与之不同的图块。
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self.viewport = None
+        self.color_mode = "jpeg"
+        self.progressive = False  # 渐进式画质：先发低画质，静止后补发到无损
+        self.quality_map = None  # 渐进模式下各图块当前的画质等级（统计信息用）
+        self.seq = 0
+        self.pending = OrderedDict()  # seq -> (key, 图块哈希)
+        self.acked = None  # (seq, key, 图块哈希)
+        self._last = None  # 最近一次记录的 (key, 图块哈希)，用于增量计算哈希
+        self.owner = None  # 当前持有会话的连接
+        self.detached_at = None
+        self._lock = threading.Lock()
+
+    def record_frame(self, key, frame, tile, previous=None):
+        """记录一帧已发送的画面，返回 (序号, 图块哈希)
+
+        previous 为上一次记录的帧（调用方自己保留的像素），给出时只重算变化图块的哈希。
+        """
+        last = self._last
+        if previous is None or last is None or last[0] != key:
+            hashes = tile_hashes(frame, tile)
+        else:
+            hashes = tile_hashes(frame, tile, previous, last[1])
+        with self._lock:
+            self.seq += 1
+            self._last = (key, hashes)
+            self.pending[self.seq] = (key, hashes)
+            while len(self.pending) > MAX_PENDING_FRAMES:
+                self.pending.popitem(last=False)
+            return self.seq, hashes
+
+    def acknowledge(self, seq):
+        """客户端确认已显示某一帧"""
+        with self._lock:
+            if seq not in self.pending:
+                return
+            key, frame = self.pending.pop(seq)
+            self.acked = (seq, key, frame)
+            # 更早的帧已不再需要
+            for old in [s for s in self.pending if s < seq]:
+                del self.pending[old]
+
+    def base_frame(self, seq):
+        """返回客户端声明正在显示的帧 (key, 图块哈希)，不可用时返回None"""
+        with self._lock:
+            if self.acked and self.acked[0] == seq:
+                return self.acked[1], self.acked[2]
+            if seq in self.pending:
+                return self.pending[seq]
+            return None
+
+class SessionManager:
+    """会话管理器，负责会话的创建、恢复和过期清理"""
+
+    def __init__(self, grace_period=SESSION_GRACE_PERIOD):
+        self.grace_period = grace_period
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, owner):
+        """创建新会话"""
+        session = Session(secrets.token_urlsafe(16))
+        session.owner = owner
+        with self._lock:
+            self.expire()
+            self.sessions[session.token] = session
+        return session
+
+    def resume(self, token, owner):
+        """凭令牌恢复宽限期内的会话，失败返回None
+
+        服务端可能尚未察觉旧连接已断开，因此也允许新连接直接接管仍在使用的会话。
+        """
+        with self._lock:
+            self.expire()
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            session.owner = owner
+            session.detached_at = None
+            return session
+
+    def prune(self):
+        """清理超过宽限期的会话（由服务端定期调用，没有新连接时断开的会话也会释放）"""
+        with self._lock:
+            self.expire()
+
+    def detach(self, session, owner):
+        """连接断开，会话进入宽限期（会话已被新连接接管时忽略）"""
+        with self._lock:
+            if session.owner is owner:
+                session.owner = None
+                session.detached_at = time.monotonic()
+
+    def expire(self):
+        """清理超过宽限期的会话（调用方需持有锁）"""
+        now = time.monotonic()
+        for token in [t for t, s in self.sessions.items()
+                      if s.detached_at is not None and now - s.detached_at > self.grace_period]:
+            del self.sessions[token]
@@ -0,0 +1,5 @@
+"""测试配置：各模块位于仓库根目录，把根目录加入导入路径"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,36 @@
+"""准入控制：CIDR白名单匹配和令牌桶限速"""
+from admission import CIDRMatcher, TokenBucket
+
+def test_empty_allowlist_allows_everything():
+    assert CIDRMatcher().match("203.0.113.7")
+    assert CIDRMatcher([]).match("::1")
+
+def test_cidr_match():
+    matcher = CIDRMatcher(["192.168.1.0/24", "10.0.0.5", "2001:db8::/32"])
+    assert matcher.match("192.168.1.200")
+    assert not matcher.match("192.168.2.1")
+    assert matcher.match("10.0.0.5")
+    assert not matcher.match("10.0.0.6")
+    assert matcher.match("2001:db8::1")
+    assert not matcher.match("2001:db9::1")
+
+def test_cidr_ipv4_mapped_and_invalid():
+    matcher = CIDRMatcher(["192.168.1.0/24", "not-a-network"])
+    assert matcher.match("::ffff:192.168.1.9")
+    assert not matcher.match("garbage")
+
+def test_cidr_non_strict_network():
+    # 主机位非零的条目按所在网络处理
+    assert CIDRMatcher(["172.16.5.9/16"]).match("172.16.200.1")
+
+def test_token_bucket_burst_then_refill():
+    bucket = TokenBucket(burst=3)
+    now = bucket.updated
+    assert [bucket.consume(1.0, 3, now) for _ in range(4)] == [True, True, True, False]
+    assert not bucket.consume(1.0, 3, now + 0.5)
+    assert bucket.consume(1.0, 3, now + 1.0)
+
+def test_token_bucket_caps_at_burst():
+    bucket = TokenBucket(burst=2)
+    later = bucket.updated + 100.0
+    assert [bucket.consume(1.0, 2, later) for _ in range(3)] == [True, True, False]
@@ -0,0 +1,34 @@
+"""色彩模式编码后再解码的还原误差，以及体积大于JPEG时的回退"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from colormodes import COLOR_MODES, ColorEncoder, decode_image
+
+# 各模式的最大平均误差：JPEG和YUV 4:2:0有损，RGB565每通道丢掉低2~3位，调色板量化到256色
+MAX_ERROR = {"jpeg": 3, "yuv420": 3, "rgb565": 4, "palette": 8}
+
+def gradient_image(width=97, height=61):
+    """奇数宽高的平滑渐变，覆盖色度抽样的边界情况"""
+    y, x = np.mgrid[0:height, 0:width]
+    rgb = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    return Image.fromarray(rgb.astype(np.uint8), "RGB")
+
+@pytest.mark.parametrize("mode", COLOR_MODES)
+def test_round_trip(mode):
+    image = gradient_image()
+    encoder = ColorEncoder(mode)
+    # 直接用该模式编码，不经过与JPEG比较体积的回退逻辑
+    fields = encoder.encode(image, quality=90) if mode == "jpeg" else encoder._encode_reduced(image)
+    decoded = decode_image(fields).convert("RGB")
+    assert decoded.size == image.size
+    error = np.abs(np.asarray(decoded, dtype=np.int16) - np.asarray(image, dtype=np.int16)).mean()
+    assert error <= MAX_ERROR[mode]
+
+def test_falls_back_to_jpeg_when_larger():
+    rng = np.random.default_rng(0)
+    noise = Image.fromarray(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8), "RGB")
+    encoder = ColorEncoder("rgb565")
+    fields = encoder.encode(noise, quality=50)
+    assert encoder.jpeg_fallback
+    assert "image" in fields
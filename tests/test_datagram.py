@@ -0,0 +1,61 @@
+"""UDP画面流：分片组每组丢一个数据分片时用异或校验分片恢复"""
+import os
+import pickle
+
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+
+from datagram import (DatagramReceiver, HEADER, FEC_GROUP, FRAGMENT_SIZE, DIRECTION_SERVER, datagram_key, nonce,
+                      packetize, xor_fragments)
+
+@pytest.fixture
+def session_key():
+    return os.urandom(32)
+
+def open_packets(session_key, packets):
+    """解密数据报，返回 (头部字段, 分片) 列表"""
+    aead = ChaCha20Poly1305(datagram_key(session_key))
+    opened = []
+    for packet in packets:
+        header = packet[:HEADER.size]
+        fields = HEADER.unpack(header)
+        _, seq, index, _, _, parity, _ = fields
+        opened.append((fields, aead.decrypt(nonce(DIRECTION_SERVER, parity, index, seq), packet[HEADER.size:], header)))
+    return opened
+
+def feed(session_key, packets, drop=()):
+    """把数据报（跳过drop中的数据分片序号）交给接收端重组，返回 (回调收到的消息, 接收端)"""
+    received = []
+    receiver = DatagramReceiver(session_key, ("127.0.0.1", 9), received.append)
+    try:
+        for (kind, seq, index, count, group, parity, total), fragment in open_packets(session_key, packets):
+            if not parity and index in drop:
+                continue
+            receiver._add(seq, index, count, group, parity, total, fragment)
+    finally:
+        receiver.close()
+    return received, receiver
+
+def test_xor_fragments_pads_short_fragment():
+    a, b = b"\x01\x02\x03", b"\x10"
+    parity = xor_fragments([a, b])
+    assert len(parity) == FRAGMENT_SIZE
+    assert xor_fragments([parity, a])[:1] == b
+
+def test_recovers_one_lost_fragment_per_group(session_key):
+    message = {"type": "tiles", "tiles": [[0, 0, 64, 64, os.urandom(FRAGMENT_SIZE * (FEC_GROUP + 3))]]}
+    payload = pickle.dumps(message)
+    packets = packetize(ChaCha20Poly1305(datagram_key(session_key)), 7, payload)
+    count = -(-len(payload) // FRAGMENT_SIZE)
+    assert count > FEC_GROUP
+    # 第一组丢中间一个，第二组丢最后一个（长度不足一个分片）
+    received, receiver = feed(session_key, packets, drop=(3, count - 1))
+    assert received == [message]
+    assert receiver.recovered == 2
+
+def test_two_losses_in_one_group_are_not_recovered(session_key):
+    payload = pickle.dumps({"type": "tiles", "data": os.urandom(FRAGMENT_SIZE * 4)})
+    packets = packetize(ChaCha20Poly1305(datagram_key(session_key)), 1, payload)
+    received, receiver = feed(session_key, packets, drop=(0, 1))
+    assert received == []
+    assert receiver.completed == 0
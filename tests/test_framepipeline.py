@@ -0,0 +1,59 @@
+"""共享内存画面环形缓冲区的序号锁"""
+import pytest
+
+from framepipeline import FrameRing
+
+@pytest.fixture
+def ring():
+    ring = FrameRing(64, slots=4)
+    yield ring
+    ring.close(unlink=True)
+
+def test_write_then_read(ring):
+    assert ring.latest == 0
+    assert ring.write(1, 1234, b"frame-1")
+    assert ring.latest == 1
+    assert ring.read(1) == (1234, b"frame-1")
+
+def test_reader_attaches_by_name(ring):
+    ring.write(5, 42, b"shared")
+    reader = FrameRing(ring.slot_size, ring.slots, name=ring.name, create=False)
+    try:
+        assert reader.latest == 5
+        assert reader.read(5) == (42, b"shared")
+    finally:
+        reader.close()
+
+def test_overwritten_slot_is_rejected(ring):
+    ring.write(1, 1, b"old")
+    ring.write(1 + ring.slots, 2, b"new")
+    assert ring.read(1) is None
+    assert ring.read(1 + ring.slots) == (2, b"new")
+
+def test_read_during_write_is_rejected(ring):
+    ring.write(2, 1, b"complete")
+    # 写入开始时先把槽位序号清零，此时读取方必须丢弃该槽位
+    ring._headers[2 % ring.slots][0] = 0
+    assert ring.read(2) is None
+
+def test_read_discards_slot_overwritten_while_copying(ring, monkeypatch):
+    ring.write(3, 1, b"first")
+    shm = ring.shm
+
+    class OverwritingBuffer:
+        """复制数据时模拟写入方覆盖同一槽位"""
+
+        def __getitem__(self, key):
+            data = bytes(shm.buf[key])
+            ring._headers[3 % ring.slots][0] = 3 + ring.slots
+            return data
+
+    monkeypatch.setattr(ring, "shm", type("Shm", (), {"buf": OverwritingBuffer()})())
+    try:
+        assert ring.read(3) is None
+    finally:
+        monkeypatch.undo()
+
+def test_oversized_payload_is_refused(ring):
+    assert not ring.write(1, 0, b"x" * (ring.slot_size + 1))
+    assert ring.latest == 0
@@ -0,0 +1,97 @@
+"""握手与恢复票据：改密码吊销票据、续签不延长有效期、过期票据由服务端拒绝"""
+import socket
+import threading
+import time
+
+import pytest
+
+from handshake import ServerHandshake, ResumptionTicket, HandshakeError, client_handshake, check_kdf_params
+from utils import SecureSocket
+
+KDF_PARAMS = {"n": 2 ** 14}
+
+def handshake_once(server, password, ticket=None):
+    """在一对本地套接字上完成一次握手，返回 (新票据, 服务端是否接受了恢复握手)"""
+    server_sock, client_sock = (SecureSocket(s) for s in socket.socketpair())
+    resumed_before = server.resumed_handshakes
+    errors = []
+
+    def serve():
+        try:
+            server.perform(server_sock)
+        except (HandshakeError, OSError) as e:
+            errors.append(e)
+        finally:
+            server_sock.close()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        new_ticket = client_handshake(client_sock, password, ticket)
+    finally:
+        thread.join()
+        client_sock.close()
+    if errors:
+        raise errors[0]
+    return new_ticket, server.resumed_handshakes > resumed_before
+
+@pytest.fixture
+def server():
+    return ServerHandshake("old-password", KDF_PARAMS, ticket_lifetime=1.0)
+
+def test_ticket_resumes(server):
+    ticket, resumed = handshake_once(server, "old-password")
+    assert not resumed
+    _, resumed = handshake_once(server, "old-password", ticket)
+    assert resumed
+
+def test_password_change_revokes_tickets(server):
+    ticket, _ = handshake_once(server, "old-password")
+    server.configure("new-password", KDF_PARAMS)
+    # 旧票据被拒绝后回退到完整握手，而旧密码在完整握手中校验失败
+    with pytest.raises(HandshakeError):
+        handshake_once(server, "old-password", ticket)
+    assert server.resumed_handshakes == 0
+
+def test_disabling_password_revokes_tickets(server):
+    ticket, _ = handshake_once(server, "old-password")
+    server.configure("", KDF_PARAMS)
+    _, resumed = handshake_once(server, "", ticket)
+    assert not resumed
+
+def test_same_password_keeps_tickets(server):
+    ticket, _ = handshake_once(server, "old-password")
+    server.configure("old-password", KDF_PARAMS)
+    _, resumed = handshake_once(server, "old-password", ticket)
+    assert resumed
+
+def test_renewal_does_not_extend_lifetime(server):
+    first, _ = handshake_once(server, "old-password")
+    time.sleep(0.3)
+    renewed, resumed = handshake_once(server, "old-password", first)
+    assert resumed
+    assert renewed.expires_at <= first.expires_at + 0.05
+
+def test_expired_ticket_rejected_by_server(server):
+    ticket, _ = handshake_once(server, "old-password")
+    time.sleep(server.ticket_lifetime + 0.1)
+    # 伪造客户端侧的过期时间，确认由服务端拒绝
+    forged = ResumptionTicket(ticket.ticket, ticket.secret, 60)
+    _, resumed = handshake_once(server, "old-password", forged)
+    assert not resumed
+
+def test_tampered_ticket_falls_back_to_full_handshake(server):
+    ticket, _ = handshake_once(server, "old-password")
+    forged = ResumptionTicket(ticket.ticket[:-4] + b"AAAA", ticket.secret, 60)
+    _, resumed = handshake_once(server, "old-password", forged)
+    assert not resumed
+
+@pytest.mark.parametrize("params", [
+    {"n": 2, "r": 8, "p": 1},
+    {"n": 2 ** 30, "r": 8, "p": 1},
+    {"n": 3 * 2 ** 14, "r": 8, "p": 1},
+    {"n": 2 ** 14, "r": 1, "p": 1},
+])
+def test_kdf_params_out_of_range(params):
+    with pytest.raises(HandshakeError):
+        check_kdf_params(params)
@@ -2,10 +2,12 @@
 通用工具模块，提供各种辅助功能
 """
 import base64
+import json
 import pickle
 import zlib
 import socket
 import struct
+import threading
 from cryptography.fernet import Fernet
 import logging
 import cv2
@@ -13,11 +15,29 @@ import numpy as np
 import sys
 import io
 import time
-from PIL import ImageGrab
+from PIL import Image
+from capture import create_capture_backend, frame_to_image
+from scheduler import FrameScheduler
+from colormodes import ColorEncoder
+from jpegencoder import JpegEncoder
+from compression import StreamCodec, compress_standalone, CODEC_RAW
+from session import tile_mask
+from progressive import (QualityMap, FIRST_PASS_QUALITY, REFINE_QUALITY, REFINE_BYTES_PER_FRAME,
+                         LEVEL_REFINED)
 
 # 默认加密密钥，实际使用时应由用户自行设置
 DEFAULT_KEY = b'YD4XY7D9GKovs9tjJQQdOIr_wPvZ9wv_SjTvEKbvlpY='
 
+# 握手阶段JSON消息的大小上限（字节），未认证的对端不能让接收方分配大块内存
+MAX_JSON_SIZE = 16 * 1024
+
+# 会话恢复时比较画面差异的图块边长（像素）
+TILE_SIZE = 64
+
+# 局部截图时低分辨率全屏缩略图的刷新间隔（秒）和宽度
+OVERVIEW_INTERVAL = 2.0
+OVERVIEW_WIDTH = 320
+
 def get_local_ip():
     """改进的IP获取方法"""
     try:
@@ -33,6 +53,21 @@ def generate_key():
     """生成新的加密密钥"""
     return Fernet.generate_key()
 
+def serialize_message(data):
+    """序列化并压缩一条消息，返回 (校验值, 压缩数据)，可在其他进程中预先完成
+
+    使用不依赖连接状态的压缩，结果可以发给任意连接。
+    """
+    serialized_data = pickle.dumps(data)
+    return zlib.crc32(serialized_data), compress_standalone(data.get("type"), serialized_data)
+
+def seal_message(fernet, checksum, compressed_data):
+    """加密已压缩的消息，返回带消息头的完整数据包"""
+    encrypted_data = fernet.encrypt(compressed_data)
+    # 添加校验头
+    header = struct.pack('>II', len(encrypted_data), checksum)
+    return header + encrypted_data
+
 class SecureSocket:
     """安全套接字封装，提供加密通信功能"""
     
@@ -40,45 +75,138 @@ class SecureSocket:
         self.socket = sock if sock else socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # 如果没有提供密钥，使用默认密钥
         self.fernet = Fernet(encryption_key if encryption_key else DEFAULT_KEY)
+        # 收发字节统计（含消息头）
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # 多个线程可能同时发送（如输入事件与帧确认），整条消息需原子写入
+        self._send_lock = threading.Lock()
+        # 连接级流式压缩上下文，压缩和发送在同一把锁内完成以保证顺序一致
+        self.codec = StreamCodec()
+        self.session_key = None
+        
+    def set_key(self, key):
+        """切换到握手协商出的32字节会话密钥（UDP画面流的密钥也由它派生）"""
+        self.fernet = Fernet(base64.urlsafe_b64encode(key))
+        self.session_key = key
         
     def connect(self, host, port):
         """连接到指定主机和端口"""
         self.socket.connect((host, port))
         
     def send_data(self, data):
-        """增加数据校验机制"""
-        checksum = zlib.crc32(pickle.dumps(data))
+        """序列化后用本连接的压缩上下文压缩、加密并发送"""
         serialized_data = pickle.dumps(data)
-        compressed_data = zlib.compress(serialized_data)
-        encrypted_data = self.fernet.encrypt(compressed_data)
-        # 添加校验头
-        header = struct.pack('>II', len(encrypted_data), checksum)
-        self.socket.sendall(header)
-        self.socket.sendall(encrypted_data)
+        checksum = zlib.crc32(serialized_data)
+        with self._send_lock:
+            packet = seal_message(self.fernet, checksum, self.codec.compress(data.get("type"), serialized_data))
+            self.socket.sendall(packet)
+            self.bytes_sent += len(packet)
         
-    def receive_data(self, timeout=1.0):
-        """增加接收超时"""
-        self.socket.settimeout(timeout)
-        # 接收数据大小
-        data_size = struct.unpack('>I', self.socket.recv(4))[0]
-        # 接收数据
-        encrypted_data = b''
-        while len(encrypted_data) < data_size:
-            packet = self.socket.recv(data_size - len(encrypted_data))
+    def send_serialized(self, checksum, compressed_data):
+        """发送已序列化压缩的消息，只在本连接做加密"""
+        self.send_packet(seal_message(self.fernet, checksum, compressed_data))
+        
+    def send_packet(self, packet):
+        """发送已打包的数据包（转发场景下同一数据包可发给多个连接）"""
+        with self._send_lock:
+            self.socket.sendall(packet)
+            self.bytes_sent += len(packet)
+        
+    def _recv_exact(self, size, allow_timeout, deadline=None):
+        """读取指定长度的数据，连接关闭时返回None
+
+        只有尚未读到任何数据且allow_timeout为True时才抛出超时，
+        避免在消息中途超时导致数据流错位；超过deadline时无论如何都抛出超时，
+        调用方随后应关闭连接。
+        """
+        buf = bytearray()
+        while len(buf) < size:
+            try:
+                packet = self.socket.recv(size - len(buf))
+            except socket.timeout:
+                if allow_timeout and not buf or deadline is not None and time.monotonic() >= deadline:
+                    raise
+                continue
             if not packet:
                 return None
-            encrypted_data += packet
+            buf += packet
+        self.bytes_received += size
+        return bytes(buf)
+        
+    def _receive_packet(self, timeout, deadline, max_size=None):
+        """接收一个数据包，返回 (校验值, 加密数据)，连接关闭或数据包超过max_size时返回None"""
+        if deadline is not None:
+            timeout = max(0.01, min(timeout, deadline - time.monotonic()))
+        self.socket.settimeout(timeout)
+        # 接收数据大小和校验值
+        header = self._recv_exact(8, True, deadline)
+        if header is None:
+            return None
+        data_size, checksum = struct.unpack('>II', header)
+        if max_size is not None and data_size > max_size:
+            print(f"消息过大: {data_size} 字节")
+            return None
+        # 接收数据
+        encrypted_data = self._recv_exact(data_size, False, deadline)
+        if encrypted_data is None:
+            return None
+        return checksum, encrypted_data
+
+    def receive_data(self, timeout=1.0, deadline=None):
+        """增加接收超时，deadline（time.monotonic()时刻）限制整条消息的接收时间
+
+        消息用pickle反序列化，只能在握手认证并切换到会话密钥之后使用。
+        """
+        packet = self._receive_packet(timeout, deadline)
+        if packet is None:
+            return None
+        checksum, encrypted_data = packet
         
         # 解密数据
         try:
             decrypted_data = self.fernet.decrypt(encrypted_data)
-            # 解压数据
-            decompressed_data = zlib.decompress(decrypted_data)
+            # 按载荷标记的压缩方式解压（流式上下文需按接收顺序解压）
+            decompressed_data = self.codec.decompress(decrypted_data)
+            if zlib.crc32(decompressed_data) != checksum:
+                raise ValueError("校验失败")
             # 反序列化数据
             return pickle.loads(decompressed_data)
         except Exception as e:
             print(f"Error decrypting data: {e}")
             return None
+
+    def skip_message(self, timeout=1.0):
+        """读取并丢弃一条消息，不解密也不反序列化（来自不受信任的对端时使用）
+
+        连接关闭或消息超过 MAX_JSON_SIZE 时返回False。
+        """
+        return self._receive_packet(timeout, None, MAX_JSON_SIZE) is not None
+
+    def send_json(self, data):
+        """发送JSON消息（握手阶段使用），不经过压缩上下文"""
+        serialized_data = json.dumps(data).encode("utf-8")
+        packet = seal_message(self.fernet, zlib.crc32(serialized_data), bytes([CODEC_RAW]) + serialized_data)
+        self.send_packet(packet)
+
+    def receive_json(self, timeout=1.0, deadline=None):
+        """接收JSON消息（握手阶段使用）
+
+        握手完成前对端未经认证，不能用pickle反序列化；消息大小也限制在 MAX_JSON_SIZE 以内。
+        返回字典，连接关闭或消息无效时返回None。
+        """
+        packet = self._receive_packet(timeout, deadline, MAX_JSON_SIZE)
+        if packet is None:
+            return None
+        checksum, encrypted_data = packet
+        try:
+            decrypted_data = self.fernet.decrypt(encrypted_data)
+            if decrypted_data[:1] != bytes([CODEC_RAW]) or zlib.crc32(decrypted_data[1:]) != checksum:
+                raise ValueError("校验失败")
+            data = json.loads(decrypted_data[1:].decode("utf-8"))
+        except Exception as e:
+            print(f"Error decoding handshake message: {e}")
+            return None
+        return data if isinstance(data, dict) else None
     
     def close(self):
         """关闭套接字"""
@@ -100,18 +228,260 @@ def compress_image(image_data, quality=50):
         logging.error("图像压缩失败: %s", e)
         return image_data  # 返回原始数据作为降级方案 
 
-def send_screen(self, client):
-    """基础截图功能"""
-    while self.running:
+def viewport_to_bbox(viewport, screen_size):
+    """将客户端可见区域换算为截图边界框和编码缩放比例"""
+    width, height = screen_size
+    if not viewport:
+        return (0, 0, width, height), 1.0
+
+    left = max(0, min(width - 1, int(viewport.get("x", 0))))
+    top = max(0, min(height - 1, int(viewport.get("y", 0))))
+    right = max(left + 1, min(width, left + int(viewport.get("width", width))))
+    bottom = max(top + 1, min(height, top + int(viewport.get("height", height))))
+
+    # 客户端缩小显示时按显示分辨率编码，放大显示时保持原始分辨率
+    scale = max(0.1, min(1.0, float(viewport.get("zoom", 1.0))))
+    return (left, top, right, bottom), scale
+
+def encode_image(image, quality=85):
+    """将PIL图像编码为base64格式的JPEG"""
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format='JPEG', quality=quality)
+    return base64.b64encode(img_byte_arr.getvalue()).decode()
+
+def encode_tile(jpeg, block, quality, scale=1.0):
+    """直接从BGRA图块编码base64格式的JPEG"""
+    return base64.b64encode(jpeg.encode(block, quality, scale)).decode()
+
+def encode_lossless(image):
+    """将PIL图像编码为base64格式的PNG（无损）"""
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format='PNG', compress_level=3)
+    return base64.b64encode(img_byte_arr.getvalue()).decode()
+
+def changed_tiles(previous, current, tile=TILE_SIZE):
+    """比较两帧画面，返回发生变化的图块列表 [(x, y, w, h), ...]"""
+    return mask_to_tiles(tile_mask(previous, current, tile), current.shape, tile)
+
+def mask_to_tiles(mask, shape, tile=TILE_SIZE):
+    """图块掩码转为图块矩形列表 [(x, y, w, h), ...]"""
+    height, width = shape[:2]
+    tiles = []
+    for row, col in zip(*np.nonzero(mask)):
+        x, y = int(col) * tile, int(row) * tile
+        tiles.append((x, y, min(tile, width - x), min(tile, height - y)))
+    return tiles
+
+def keep_frame(previous, frame):
+    """把当前帧复制到复用的缓冲区，作为下一次比较的基准"""
+    if previous is None or previous.shape != frame.shape:
+        return frame.copy()
+    np.copyto(previous, frame)
+    return previous
+
+def scale_image(image, scale):
+    """按编码比例缩放图像"""
+    if scale >= 1.0:
+        return image
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    return image.resize(size, Image.BILINEAR)
+
+def send_overview(self, client, capture, bbox, last_overview):
+    """只截取局部时，定期补发全屏缩略图以保持小地图最新，返回最近一次发送的时间"""
+    full_bbox = (0, 0, self.screen_size[0], self.screen_size[1])
+    now = time.time()
+    if bbox == full_bbox or now - last_overview < OVERVIEW_INTERVAL:
+        return last_overview
+    overview = frame_to_image(capture.grab(full_bbox))
+    overview.thumbnail((OVERVIEW_WIDTH, OVERVIEW_WIDTH))
+    client.send_data({
+        "type": "overview",
+        "image": encode_image(overview, 50),
+        "scale": overview.width / self.screen_size[0]
+    })
+    return now
+
+def send_screen(self, client, session, resume_seq=None):
+    """按客户端可见区域截图，画面变化时才编码发送，并定期发送低分辨率全屏缩略图
+
+    截图间隔由FrameScheduler自适应调整：输入后加速，画面静止时指数退避。
+    恢复会话时以客户端最后确认帧的图块哈希为基准，首帧只发送哈希不同的图块。
+    渐进模式下变化的图块先以低画质发送，静止后在空闲帧里按画质图逐步补发到无损。
+    """
+    capture = create_capture_backend(self.capture_backend)
+    scheduler = FrameScheduler()
+    scheduler.configure(self.frame_rate, self.max_frame_rate)
+    jpeg = JpegEncoder(self.jpeg_backend, self.jpeg_subsampling)
+    encoder = ColorEncoder(session.color_mode, jpeg)
+    scheduler.damage_driven = self.damage_available
+    self.schedulers[client] = scheduler
+    previous = None  # 上一次发送的画面（复用的缓冲区）
+    previous_key = None
+    base_hashes = None
+    quality_map = None
+    if resume_seq is not None:
+        base = session.base_frame(resume_seq)
+        if base is not None:
+            previous_key, base_hashes = base
+    resuming = base_hashes is not None
+    last_overview = 0.0
+    while self.running and client in self.clients:
         try:
-            screenshot = ImageGrab.grab()
-            img_byte_arr = io.BytesIO()
-            screenshot.save(img_byte_arr, format='JPEG', quality=85)
-            client.send_data({
-                "type": "screen",
-                "image": base64.b64encode(img_byte_arr.getvalue()).decode()
-            })
-            time.sleep(0.1)
+            bbox, scale = viewport_to_bbox(self.viewports.get(client), self.screen_size)
+            frame = capture.grab(bbox)
+
+            # 与上一帧逐像素比较，可见区域、画质和色彩模式未变且画面相同时跳过编码
+            if encoder.mode != session.color_mode:
+                encoder = ColorEncoder(session.color_mode, jpeg)
+            jpeg.subsampling = self.jpeg_subsampling
+            key = (bbox, scale, self.screen_quality, encoder.mode, session.progressive)
+            changed = key != previous_key or previous is None or not np.array_equal(frame, previous)
+            refine = session.progressive
+            rects = None
+            if changed and refine and quality_map is not None and key == previous_key and not resuming:
+                rects = changed_tiles(previous, frame)
+                if len(rects) > quality_map.levels.size // 2:
+                    rects = None  # 大面积变化时整帧发送更省
+            if resuming and key == previous_key:
+                # 客户端保留了基准帧，只补发哈希不同的图块（无变化时也回复以确认恢复完成）
+                seq, hashes = session.record_frame(key, frame, TILE_SIZE)
+                tiles = []
+                for x, y, w, h in mask_to_tiles(hashes != base_hashes, frame.shape):
+                    tiles.append([x, y, w, h, encode_tile(jpeg, frame[y:y + h, x:x + w], self.screen_quality, scale)])
+                previous = keep_frame(previous, frame)
+                client.send_data({
+                    "type": "tiles",
+                    "seq": seq,
+                    "region": list(bbox),
+                    "scale": scale,
+                    "tiles": tiles
+                })
+            elif rects is not None:
+                # 渐进模式：只以低画质发送变化的图块，这些图块的画质等级归零
+                quality_map.mark_changed(rects)
+                tiles = []
+                for x, y, w, h in rects:
+                    tiles.append([x, y, w, h, encode_tile(jpeg, frame[y:y + h, x:x + w], FIRST_PASS_QUALITY, scale)])
+                seq, _ = session.record_frame(key, frame, TILE_SIZE, previous)
+                previous = keep_frame(previous, frame)
+                client.send_data({
+                    "type": "tiles",
+                    "seq": seq,
+                    "region": list(bbox),
+                    "scale": scale,
+                    "tiles": tiles
+                })
+            elif changed:
+                seq, _ = session.record_frame(key, frame, TILE_SIZE, previous if key == previous_key else None)
+                previous = keep_frame(previous, frame)
+                previous_key = key
+                message = {
+                    "type": "screen",
+                    "seq": seq,
+                    "region": list(bbox),
+                    "scale": scale
+                }
+                # 渐进模式只适用于JPEG，整帧以低画质发送后重建画质图
+                progressive = session.progressive and encoder.mode == "jpeg"
+                quality = FIRST_PASS_QUALITY if progressive else self.screen_quality
+                message.update(encoder.encode_frame(frame, quality, scale))
+                client.send_data(message)
+                quality_map = QualityMap(frame.shape[1], frame.shape[0], TILE_SIZE) if progressive else None
+                session.quality_map = quality_map
+                refine = False  # 刚整帧发送，下一帧再开始补发
+            if refine and quality_map is not None:
+                # 变化先发，然后在字节预算内为已静止的图块补发下一画质等级
+                quality_map.tick()
+                tiles = []
+                budget = REFINE_BYTES_PER_FRAME
+                for row, col, (x, y, w, h) in quality_map.candidates():
+                    block = previous[y:y + h, x:x + w]
+                    if quality_map.levels[row, col] + 1 == LEVEL_REFINED:
+                        data = encode_tile(jpeg, block, REFINE_QUALITY, scale)
+                    else:
+                        data = encode_lossless(scale_image(frame_to_image(block), scale))
+                    quality_map.promote(row, col)
+                    tiles.append([x, y, w, h, data])
+                    budget -= len(data)
+                    if budget <= 0:
+                        break
+                if tiles:
+                    # 补发不改变画面内容，不占用帧序号，也无需客户端确认
+                    client.send_data({
+                        "type": "tiles",
+                        "seq": None,
+                        "region": list(bbox),
+                        "scale": scale,
+                        "tiles": tiles,
+                        "refine": True
+                    })
+            resuming = False
+
+            last_overview = send_overview(self, client, capture, bbox, last_overview)
+
+            # 补发未完成时保持基础帧率，避免调度器退避拖慢补发
+            scheduler.frame_done(changed or (quality_map is not None and quality_map.pending()))
+            scheduler.wait()
         except Exception as e:
             print(f"截图错误: {e}")
-            break 
\ No newline at end of file
+            break
+    if self.schedulers.get(client) is scheduler:
+        del self.schedulers[client]
+    capture.close()
+
+def send_datagram_screen(self, client, stream):
+    """UDP模式：每帧把与客户端已确认画面不同的图块经UDP发送，缩略图仍走TCP
+
+    丢失的图块没有确认，在下一帧或超时后重发；UDP长时间收不到确认时返回False，由调用方回退到TCP。
+    """
+    capture = create_capture_backend(self.capture_backend)
+    scheduler = FrameScheduler()
+    scheduler.configure(self.frame_rate, self.max_frame_rate)
+    scheduler.damage_driven = self.damage_available
+    self.schedulers[client] = scheduler
+    jpeg = JpegEncoder(self.jpeg_backend, self.jpeg_subsampling)
+    last_overview = 0.0
+    healthy = True
+    while self.running and client in self.clients:
+        try:
+            bbox, scale = viewport_to_bbox(self.viewports.get(client), self.screen_size)
+            frame = capture.grab(bbox)
+            quality = self.screen_quality
+            jpeg.subsampling = self.jpeg_subsampling
+            sent = stream.send_frame(frame, bbox, scale, quality,
+                                     lambda block: bytes(jpeg.encode(block, quality, scale)))
+            last_overview = send_overview(self, client, capture, bbox, last_overview)
+            if stream.stalled():
+                healthy = False
+                break
+            # 还有未确认的图块时保持基础帧率，以便及时重发
+            scheduler.frame_done(sent > 0 or stream.inflight())
+            scheduler.wait()
+        except Exception as e:
+            print(f"UDP画面发送错误: {e}")
+            break
+    if self.schedulers.get(client) is scheduler:
+        del self.schedulers[client]
+    capture.close()
+    return healthy
+
+def send_pipeline_screen(self, client):
+    """独立进程模式：从截图编码进程的共享内存读取画面消息并发送
+
+    新连接先收到最近一帧；发送落后时跳到最新帧，中间被覆盖的帧直接丢弃。
+    """
+    pipeline = self.pipeline
+    last_seq = max(0, pipeline.latest - 1)
+    while self.running and client in self.clients:
+        try:
+            seq = pipeline.wait_frame(last_seq)
+            if seq is None:
+                continue
+            frame = pipeline.read(seq)
+            last_seq = seq
+            if frame is None:
+                continue
+            client.send_serialized(*frame)
+        except Exception as e:
+            print(f"发送画面错误: {e}")
+            break